@@ -0,0 +1,124 @@
+from dataclasses import dataclass, replace
+from typing import List, Optional, Tuple
+
+import texture
+
+from config import Config
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#----------------------------------------------
+# Content analysis of the source images, for the texture settings with "analyze": true.
+# The image is decoded once at the largest size a tier uses and measured per channel :
+#  - variance : an image whose channels are all constant (solid colour placeholder) is flat
+#  - detail : the image is halved with a box filter while the halved image, scaled back up,
+#    stays within detail_threshold (RMS) of the original. Near-constant roughness or metalness maps
+#    and blurry masks stop at a small size, a detailed image stops at its own size.
+# The effective setting of a tier caps its size at the size the detail needs, and a flat image is encoded
+# in etc1s instead of uastc. The images matching the keywords of a tier keep their setting.
+# Requires NumPy and Pillow, otherwise every tier keeps its setting.
+
+# Channel variance of a flat image, below one 8 bit step
+flat_variance = (0.5 / 255) ** 2
+# Size of a flat image
+flat_size = 4
+# RMS error allowed to the reduced image, about the error of the ktx2 encoders
+detail_threshold = 2 / 255
+
+@dataclass
+class TextureAnalysis:
+    # Size the image was analyzed at
+    size: Tuple[int, int]
+    variance: List[float]
+    # RMS error of halving the image once, 0 for a flat image
+    detail: float
+    # Largest side the image needs
+    effective_size: int
+
+    @property
+    def flat(self) -> bool:
+        return max(self.variance) <= flat_variance
+
+def is_available() -> bool:
+    return np is not None and texture.is_available()
+
+def pixels_of(image) -> "np.ndarray":
+    pixels = np.asarray(image).astype(np.float32) / (65535 if image.mode == "I;16" else 255)
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, None]
+    return pixels
+
+# Analyze the image file_path scaled to fit in max_size
+def analyze(file_path : str, max_size : int) -> TextureAnalysis:
+    image = texture.open_image(file_path)
+    if max(image.size) > max_size:
+        image = image.resize(Config.TextureSetting(max_size=max_size).target_size(*image.size), texture.resample_filter())
+    reference = pixels_of(image)
+    channels = reference.shape[2]
+    variance = reference.reshape(-1, channels).var(axis=0).tolist()
+
+    if max(variance) <= flat_variance:
+        return TextureAnalysis(image.size, variance, 0.0, flat_size)
+
+    level = reference
+    factor = 1
+    detail = 0.0
+    while max(level.shape[:2]) > flat_size and min(level.shape[:2]) >= 2:
+        height, width = level.shape[0] // 2 * 2, level.shape[1] // 2 * 2
+        lower = level[:height, :width].reshape(height // 2, 2, width // 2, 2, channels).mean(axis=(1, 3))
+        restored = np.repeat(np.repeat(lower, factor * 2, axis=0), factor * 2, axis=1)
+        difference = reference[:restored.shape[0], :restored.shape[1]] - restored
+        error = float(np.sqrt((difference * difference).mean(axis=(0, 1))).max())
+        if factor == 1:
+            detail = error
+        if error > detail_threshold:
+            break
+        level = lower
+        factor *= 2
+
+    return TextureAnalysis(image.size, variance, detail, max(level.shape[:2]))
+
+# Setting of the tier for an analyzed image. other_format : the image matches the keywords of the tier.
+def effective_setting(texture_setting : Config.TextureSetting, analysis : Optional[TextureAnalysis], source_size : Optional[Tuple[int, int]],
+                      other_format : bool) -> Config.TextureSetting:
+    # The keywords choose the encode of the image, it is left as configured
+    if not texture_setting.analyze or analysis is None or not source_size or other_format:
+        return texture_setting
+
+    if max(texture_setting.target_size(*source_size)) > analysis.effective_size:
+        texture_setting = replace(texture_setting, max_size=analysis.effective_size, scale=1.0)
+    if analysis.flat and texture_setting.encode_format(False) == 'uastc':
+        texture_setting = replace(texture_setting, default_format='etc1s')
+    return texture_setting
+
+# Effective settings of every tier for the image file_path. png_paths : the resized png of every tier, matched against the keywords.
+def effective_settings(texture_settings : List[Config.TextureSetting], file_path : str, png_paths : List[str]) -> List[Config.TextureSetting]:
+    analyzed = [texture_setting for texture_setting, png_path in zip(texture_settings, png_paths) if texture_setting.analyze and not texture_setting.is_other_format(png_path)]
+    source_size = texture.image_size(file_path)
+    if not analyzed or not source_size or not is_available():
+        return list(texture_settings)
+
+    try:
+        analysis = analyze(file_path, max(max(texture_setting.target_size(*source_size)) for texture_setting in analyzed))
+    except OSError as e:
+        print("Failed to analyze {}, its tiers keep their settings: {}".format(file_path, e))
+        return list(texture_settings)
+
+    return [effective_setting(texture_setting, analysis, source_size, texture_setting.is_other_format(png_path))
+            for texture_setting, png_path in zip(texture_settings, png_paths)]
+
+# Bytes of a transcoded texture with its mip chain : etc1s is transcoded to 4 bits per pixel formats (BC1, ETC1),
+# uastc to 8 bits per pixel formats (BC7, ASTC 4x4)
+def gpu_bytes(size : Tuple[int, int], encode_format : str) -> int:
+    return int(size[0] * size[1] * (0.5 if encode_format == 'etc1s' else 1) * 4 / 3)
+
+# (GPU bytes saved, shrunk, downgraded to etc1s) of a tier whose effective setting differs, None when it is unchanged
+def tier_savings(texture_setting : Config.TextureSetting, effective : Config.TextureSetting, source_size : Tuple[int, int], other_format : bool) -> Optional[Tuple[int, bool, bool]]:
+    if effective is texture_setting:
+        return None
+    size, effective_size = texture_setting.target_size(*source_size), effective.target_size(*source_size)
+    encode_format, effective_format = texture_setting.encode_format(other_format), effective.encode_format(other_format)
+    return (gpu_bytes(size, encode_format) - gpu_bytes(effective_size, effective_format), effective_size != size, effective_format != encode_format)
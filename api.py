@@ -0,0 +1,340 @@
+import asyncio
+import json
+import os
+import shutil
+import time
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Union
+
+import analysis
+import mesh
+import orm
+import preflight
+import texture
+
+from cache import TextureCache, file_hash, link_or_copy
+from config import Config, parse_config
+from directory import Directory, convert_file_path, get_all_file_paths, make_directory, publish_file
+from gltf_container import get_gltf_images, has_buffers
+from lod import lod_sources, relative_ratio
+from repackage import repackage_model
+from texture_registry import texture_file_name
+from tracing import ToolError, tracer
+
+#----------------------------------------------
+# Library API, for services that optimize models without running the CLI.
+#
+#   results = await api.optimize(["chair.glb"], "config.json", "out", concurrency=4, timeout=600)
+#
+# The tools run from the argument vectors of the Config, without a shell, through asyncio subprocesses.
+# A semaphore bounds the tool processes (and the in-process resize / weld threads) running at once.
+# A tool running longer than timeout is killed and fails its asset, cancelling optimize() kills the
+# running tools and removes the workspace. Every input gets an AssetResult, a failed asset does not stop
+# the others, a missing tool raises ToolError before any asset starts.
+# The outputs are laid out as with the CLI, without the manifest : there is no update mode.
+
+model_extensions = ['.glb', '.gltf']
+
+@dataclass
+class AssetResult:
+    input_path: str
+    # Published models and ktx2 textures of the asset
+    outputs: List[str] = field(default_factory=list)
+    textures: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+    seconds: float = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+@dataclass
+class Results:
+    assets: List[AssetResult]
+
+    @property
+    def ok(self) -> bool:
+        return all(asset.ok for asset in self.assets)
+
+    @property
+    def failed(self) -> List[AssetResult]:
+        return [asset for asset in self.assets if not asset.ok]
+
+def load_config(config : Union[Config, dict, str]) -> Config:
+    if isinstance(config, Config):
+        return config
+    if isinstance(config, dict):
+        return parse_config(config)
+    with open(config, 'r') as file:
+        return parse_config(json.load(file))
+
+# Model files of inputs, a model path or a folder of models, or a list of them
+def get_model_paths(inputs : Union[str, List[str]]) -> List[str]:
+    paths = []
+    for path in [inputs] if isinstance(inputs, str) else inputs:
+        if os.path.isdir(path):
+            paths += get_all_file_paths(path, model_extensions, True)
+        else:
+            paths.append(os.path.abspath(path))
+    return paths
+
+# Await every awaitable, then raise the first error. Unlike a plain gather, no task is left running on error.
+async def gather_all(*awaitables):
+    results = await asyncio.gather(*awaitables, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+async def optimize(inputs : Union[str, List[str]], config : Union[Config, dict, str], output_path : str, *,
+                   concurrency : int = None, timeout : float = None, cache_path : str = None, cache_size : int = 2048,
+                   workspace_path : str = None) -> Results:
+    config = load_config(config)
+    # Raised before the workspace is created, no asset could be built without the tools
+    errors = preflight.tool_errors(await asyncio.to_thread(preflight.discover, preflight.required_tools(config), cache_path))
+    if errors:
+        raise ToolError("Required tools are missing: " + "; ".join(errors))
+    session = Session(config, os.path.abspath(output_path), concurrency or os.cpu_count() or 1, timeout,
+                      TextureCache(cache_path, cache_size * 1024 * 1024) if cache_path else None, workspace_path)
+    try:
+        assets = await asyncio.gather(*(session.optimize_asset(file_path) for file_path in get_model_paths(inputs)))
+    finally:
+        await session.close()
+    if session.cache:
+        session.cache.evict()
+    return Results(list(assets))
+
+#----------------------------------------------
+# State of one optimize() call
+
+class Session:
+    def __init__(self, config : Config, output_path : str, concurrency : int, timeout : float, cache : TextureCache, workspace_path : str):
+        self.config = config
+        self.output_path = output_path
+        self.timeout = timeout
+        self.cache = cache
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # toktx shares the cores with the other processes
+        self.toktx_threads = max(1, (os.cpu_count() or 1) // concurrency)
+        self.dir = Directory(config.texture_settings, workspace_path)
+        # Unique images of every asset : {(image hash, other formats) : task returning the published ktx2}
+        self.textures : Dict[tuple, asyncio.Task] = {}
+        make_directory(output_path)
+
+    async def close(self):
+        # Shared textures of cancelled assets may still run
+        for task in self.textures.values():
+            task.cancel()
+        await asyncio.gather(*self.textures.values(), return_exceptions=True)
+        shutil.rmtree(self.dir.workspace, ignore_errors=True)
+
+    # Run the argument vector of a tool, raises ToolError unless it exits with 0
+    async def run_tool(self, stage : str, asset : str, command : List[str], inputs : List[str], outputs : List[str]):
+        async with self.semaphore:
+            await tracer.run_async(stage, asset, command, inputs, outputs, self.timeout)
+
+    # Run an in-process step in a thread, within the same limit as the tools
+    async def run_thread(self, function, *args):
+        async with self.semaphore:
+            return await asyncio.to_thread(function, *args)
+
+    async def optimize_asset(self, file_path : str) -> AssetResult:
+        result = AssetResult(file_path)
+        start = time.perf_counter()
+        try:
+            # Each model is extracted in its own folder
+            dest = os.path.join(self.dir.base_model, os.path.splitext(os.path.basename(file_path))[0])
+            make_directory(dest)
+            gltf_path = convert_file_path(file_path, dest, ".gltf")
+            await self.run_tool("to_gltf_separate", os.path.basename(gltf_path), self.config.model_settings[0].to_gltf_separate(file_path, gltf_path), [file_path], [gltf_path])
+            if self.config.pack_orm and orm.is_available():
+                with tracer.span("orm", os.path.basename(gltf_path), [gltf_path], [gltf_path], asyncio.current_task().get_name()):
+                    await self.run_thread(orm.pack_materials, gltf_path)
+
+            texture_names = {}
+            texture_tasks = []
+            for uri, image_path in get_gltf_images(gltf_path).items():
+                name, task = await self.register_texture(image_path)
+                texture_names[uri] = os.path.splitext(name)[0] + ".ktx2"
+                if task not in texture_tasks:
+                    texture_tasks.append(task)
+
+            textures, outputs = await gather_all(gather_all(*(asyncio.shield(task) for task in texture_tasks)), self.optimize_models(gltf_path, texture_names))
+            result.textures = [path for paths in textures for path in paths]
+            result.outputs = outputs
+        except Exception as e:
+            result.error = str(e) or type(e).__name__
+        result.seconds = time.perf_counter() - start
+        return result
+
+    #----------------------------------------------
+    # Textures
+
+    # Returns the unique file name of the image and the task building its ktx2, shared by every asset using the image
+    async def register_texture(self, image_path : str):
+        image_hash = await asyncio.to_thread(file_hash, image_path)
+        name = texture_file_name(image_path, image_hash)
+        other_formats = tuple(texture_setting.is_other_format(name) for texture_setting in self.config.texture_settings)
+        key = (image_hash, other_formats)
+        if key not in self.textures:
+            path = os.path.join(self.dir.images, name)
+            link_or_copy(image_path, path)
+            self.textures[key] = asyncio.create_task(self.optimize_texture(path, image_hash), name="texture:{}".format(name))
+        return name, self.textures[key]
+
+    # Encode every tier of the image, returns the published ktx2
+    async def optimize_texture(self, file_path : str, image_hash : str) -> List[str]:
+        # Settings of every tier for the content of the image, see analysis.py
+        png_paths = [convert_file_path(file_path, texture_path, ".png") for texture_path in self.dir.texture]
+        settings = self.config.texture_settings
+        if any(texture_setting.analyze for texture_setting in settings):
+            settings = await self.run_thread(analysis.effective_settings, settings, file_path, png_paths)
+
+        size = texture.image_size(file_path)
+        groups : Dict[tuple, List[int]] = {}
+        for index, texture_setting in enumerate(settings):
+            other_format = texture_setting.is_other_format(png_paths[index])
+            groups.setdefault(texture.tier_key(texture_setting, index, size, other_format), []).append(index)
+
+        # One encode per group of tiers, linked into the others. Cached ktx2 are linked as well.
+        targets : Dict[int, List[int]] = {}
+        for indices in groups.values():
+            cached = None
+            if self.cache:
+                cached = next((index for index in indices if self.cache.fetch(self.cache_key(settings[index], index, file_path, image_hash), self.ktx_path(index, file_path))), None)
+                self.cache.count_lookup(cached is not None)
+            if cached is None:
+                targets[indices[0]] = indices[1:]
+                continue
+            for index in indices:
+                if index != cached:
+                    link_or_copy(self.ktx_path(cached, file_path), self.ktx_path(index, file_path))
+
+        if targets:
+            await self.prepare_texture(settings, file_path, list(targets))
+            await gather_all(*(self.encode_texture(settings, file_path, image_hash, index, aliases) for index, aliases in targets.items()))
+
+        published = []
+        for index, texture_path in enumerate(self.dir.texture):
+            tier_path = os.path.join(self.output_path, os.path.basename(texture_path))
+            make_directory(tier_path)
+            published.append(convert_file_path(file_path, tier_path, ".ktx2"))
+            publish_file(self.ktx_path(index, file_path), published[-1])
+        return published
+
+    def ktx_path(self, index : int, file_path : str) -> str:
+        return convert_file_path(file_path, self.dir.texture[index], ".ktx2")
+
+    def cache_key(self, texture_setting : Config.TextureSetting, index : int, file_path : str, image_hash : str) -> str:
+        return self.cache.key(texture_setting, image_hash, texture_setting.is_other_format(convert_file_path(file_path, self.dir.texture[index], ".png")))
+
+    # Write the resized png of the tiers in targets, settings : the settings of every tier for the image
+    async def prepare_texture(self, settings : List[Config.TextureSetting], file_path : str, targets : List[int]):
+        png_paths = {index: convert_file_path(file_path, self.dir.texture[index], ".png") for index in targets}
+        if texture.is_available():
+            try:
+                with tracer.span("resize", os.path.basename(file_path), [file_path], png_paths.values(), asyncio.current_task().get_name()):
+                    await self.run_thread(texture.build_pyramid, settings, file_path, png_paths)
+                return
+            except OSError as e:
+                print("Failed to resize {} in process, fallback to imagemagick: {}".format(file_path, e))
+
+        for index, png_path in png_paths.items():
+            texture_setting = settings[index]
+            asset = os.path.basename(png_path)
+            await self.run_tool("copy", asset, ["cp", file_path, png_path], [file_path], [png_path])
+            await self.run_tool("mogrify", asset, texture_setting.resize(png_path, 1), [png_path], [png_path])
+            await self.run_tool("mogrify", asset, texture_setting.resize_scale(png_path, 1), [png_path], [png_path])
+
+    async def encode_texture(self, settings : List[Config.TextureSetting], file_path : str, image_hash : str, index : int, aliases : List[int]):
+        texture_setting = settings[index]
+        png_path = convert_file_path(file_path, self.dir.texture[index], ".png")
+        ktx_path = self.ktx_path(index, file_path)
+        if texture_setting.is_other_format(png_path):
+            command = texture_setting.to_ktx_other(png_path, ktx_path, self.toktx_threads)
+        else:
+            command = texture_setting.to_ktx(png_path, ktx_path, self.toktx_threads)
+        await self.run_tool("toktx", os.path.basename(ktx_path), command, [png_path], [ktx_path])
+        os.remove(png_path)
+
+        for alias in aliases:
+            link_or_copy(ktx_path, self.ktx_path(alias, file_path))
+        if self.cache:
+            for tier in [index] + aliases:
+                self.cache.store(self.cache_key(settings[tier], tier, file_path, image_hash), ktx_path)
+
+    #----------------------------------------------
+    # Models
+
+    # Build every LOD of the base gltf file_path, returns the published models
+    async def optimize_models(self, file_path : str, texture_names : Dict[str, str]) -> List[str]:
+        config = self.config
+        scratch_path = os.path.dirname(file_path)
+        glb_path = convert_file_path(file_path, scratch_path, ".glb")
+        await self.run_tool("to_glb", os.path.basename(glb_path), config.model_settings[0].to_glb(file_path, glb_path), [file_path], [glb_path])
+
+        model_has_buffers = has_buffers(file_path)
+        sources = lod_sources(config.model_settings)
+        weld_keys = list(dict.fromkeys((model_setting.tolerance, model_setting.weld_engine) for model_setting in config.model_settings))
+        # Weld and simplify tasks, shared by the LODs built from them
+        tasks : Dict[tuple, asyncio.Task] = {}
+
+        def shared(key : tuple, factory) -> asyncio.Task:
+            if key not in tasks:
+                tasks[key] = asyncio.ensure_future(factory())
+            return tasks[key]
+
+        async def weld(model_setting : Config.ModelSetting) -> str:
+            if model_setting.tolerance == -1:
+                return glb_path
+            weld_path = convert_file_path(file_path, scratch_path, "_weld{}.glb".format(weld_keys.index((model_setting.tolerance, model_setting.weld_engine))))
+            await self.weld_model(model_setting, glb_path, weld_path)
+            return weld_path
+
+        async def simplify(model_setting : Config.ModelSetting) -> str:
+            source = sources[model_setting.suffix]
+            source_path = await (lod_mesh(source) if source else shared(("weld", model_setting.tolerance, model_setting.weld_engine), lambda: weld(model_setting)))
+            simplify_path = convert_file_path(file_path, scratch_path, "{}_simplified.glb".format(model_setting.suffix))
+            simplify_setting = replace(model_setting, ratio=relative_ratio(model_setting, source))
+            await self.run_tool("simplify", os.path.basename(simplify_path), simplify_setting.simplify(source_path, simplify_path), [source_path], [simplify_path])
+            return simplify_path
+
+        def lod_mesh(model_setting : Config.ModelSetting) -> asyncio.Task:
+            if model_setting.ratio == -1:
+                return shared(("weld", model_setting.tolerance, model_setting.weld_engine), lambda: weld(model_setting))
+            return shared(("simplify", model_setting.suffix), lambda: simplify(model_setting))
+
+        async def optimize_model(model_setting : Config.ModelSetting) -> List[str]:
+            # Without buffers there is no mesh to weld, simplify or compress
+            mesh_path = await lod_mesh(model_setting) if model_has_buffers else glb_path
+            compressed_path = mesh_path
+            if model_setting.compression != "none" and model_has_buffers:
+                compressed_path = convert_file_path(file_path, self.dir.workspace, "{}.glb".format(model_setting.suffix))
+                command = getattr(model_setting, model_setting.compression)(mesh_path, compressed_path)
+                await self.run_tool(model_setting.compression, os.path.basename(compressed_path), command, [mesh_path], [compressed_path])
+
+            output_paths = await self.run_thread(repackage_model, model_setting, self.dir.workspace, config.output_exts, file_path, compressed_path, texture_names)
+            published = []
+            for output_path in output_paths:
+                published.append(os.path.join(self.output_path, os.path.basename(output_path)))
+                publish_file(output_path, published[-1])
+            return published
+
+        try:
+            lods = await gather_all(*(optimize_model(model_setting) for model_setting in config.model_settings))
+        finally:
+            # Shared steps whose every user failed first
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+        return [path for paths in lods for path in paths]
+
+    # Weld with the engine of model_setting, the numpy engine falls back to gltf-transform for the files it does not support
+    async def weld_model(self, model_setting : Config.ModelSetting, src : str, dst : str):
+        if model_setting.weld_engine == "numpy" and mesh.is_available():
+            with tracer.span("weld:numpy", os.path.basename(dst), [src], [dst], asyncio.current_task().get_name()) as record:
+                try:
+                    await self.run_thread(mesh.weld_glb, src, dst, model_setting.tolerance)
+                    return
+                except mesh.MeshError as e:
+                    print("numpy weld of {} is not possible ({}), gltf-transform is used".format(os.path.basename(src), e))
+                    record["exit_code"] = "fallback"
+        await self.run_tool("weld", os.path.basename(dst), model_setting.weld(src, dst), [src], [dst])
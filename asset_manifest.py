@@ -0,0 +1,160 @@
+import json
+import os
+import struct
+from typing import Dict, List, Optional
+
+import analysis
+
+from cache import file_hash
+from config import Config
+from gltf_container import GltfFile, replace_file
+from manifest import BuildManifest
+
+#----------------------------------------------
+# Asset manifests of the output, one per model, for the clients choosing a LOD and a texture tier.
+# <model>.assets.json lists every LOD file and every ktx2 of every tier with its size and sha256 (for immutable
+# CDN caching), the triangle and vertex counts of each LOD and the GPU memory of the ktx2 once transcoded.
+# With "asset_manifest": "json+bin" a compact binary index <model>.assets.bin is written as well.
+# The numbers are recorded in the build manifest when a unit writes its files (the checksum is the one of the
+# journal), so the asset manifests are written from memory after the outputs are published.
+
+ASSET_MANIFEST_VERSION = 1
+ASSET_MANIFEST_EXT = ".assets.json"
+ASSET_INDEX_EXT = ".assets.bin"
+ASSET_INDEX_MAGIC = b"GOAM"
+
+KTX2_HEADER = struct.Struct("<12sIIII")
+KTX2_IDENTIFIER = b"\xabKTX 20\xbb\r\n\x1a\n"
+
+INDEX_HEADER = struct.Struct("<4sIII")
+INDEX_LOD = struct.Struct("<QII32s")
+INDEX_TIER = struct.Struct("<IIQQ")
+
+# (triangles, vertices) of the meshes of a gltf, read from the accessor counts. A mesh used by several nodes counts once.
+def mesh_counts(gltf_data : dict) -> tuple:
+    accessors = gltf_data.get("accessors", [])
+    triangles = 0
+    positions = set()
+    for mesh in gltf_data.get("meshes", []):
+        for primitive in mesh.get("primitives", []):
+            position = primitive.get("attributes", {}).get("POSITION")
+            if position is None:
+                continue
+            count = accessors[primitive["indices"]]["count"] if "indices" in primitive else accessors[position]["count"]
+            mode = primitive.get("mode", 4)
+            if mode == 4:
+                triangles += count // 3
+            elif mode in (5, 6):
+                triangles += max(0, count - 2)
+            positions.add(position)
+    return triangles, sum(accessors[position]["count"] for position in positions)
+
+# Triangles and vertices of a LOD glb, only its JSON chunk is read
+def lod_stats(glb_path : str) -> dict:
+    with GltfFile(glb_path) as gltf:
+        triangles, vertices = mesh_counts(gltf.json)
+    return {"triangles": triangles, "vertices": vertices}
+
+# Size and GPU memory of a ktx2, read from its header
+def ktx2_stats(ktx_path : str, encode_format : str) -> dict:
+    with open(ktx_path, 'rb') as file:
+        header = file.read(KTX2_HEADER.size)
+    if len(header) < KTX2_HEADER.size:
+        return {"format": encode_format}
+    identifier, vk_format, type_size, width, height = KTX2_HEADER.unpack(header)
+    if identifier != KTX2_IDENTIFIER:
+        return {"format": encode_format}
+    return {"width": width, "height": height, "format": encode_format, "gpu_bytes": analysis.gpu_bytes((width, height), encode_format)}
+
+# Size, checksum and metrics of an output file. checksum : the sha256 when it is already known
+def file_stats(path : str, checksum : str = None, metrics : dict = None) -> dict:
+    stats = {"bytes": os.path.getsize(path), "sha256": checksum or file_hash(path)}
+    stats.update(metrics or {})
+    return stats
+
+# Stats of an artifact of the output, computed once for the outputs published before the asset manifests
+def artifact_stats(manifest : BuildManifest, artifact : str) -> Optional[dict]:
+    stats = manifest.files.get(artifact)
+    if stats:
+        return stats
+    path = os.path.join(manifest.output_path, artifact)
+    if not os.path.isfile(path):
+        return None
+    metrics = lod_stats(path) if artifact.endswith(".glb") else None
+    manifest.set_file(artifact, file_stats(path, metrics=metrics))
+    return manifest.files[artifact]
+
+def asset_manifest_paths(output_path : str, key : str) -> List[str]:
+    stem = os.path.splitext(os.path.basename(key))[0]
+    return [os.path.join(output_path, stem + ASSET_MANIFEST_EXT), os.path.join(output_path, stem + ASSET_INDEX_EXT)]
+
+# Asset manifest of the model key. tiers : {tier folder name : texture setting}
+def build_asset_manifest(config : Config, manifest : BuildManifest, key : str, tiers : Dict[str, Config.TextureSetting]) -> dict:
+    model = manifest.models[key]
+
+    lods = []
+    for model_setting in config.model_settings:
+        lod = model["lods"].get(model_setting.suffix)
+        if not lod:
+            continue
+        entry = {"suffix": model_setting.suffix, "files": []}
+        for artifact in lod["artifacts"]:
+            stats = artifact_stats(manifest, artifact)
+            if not stats:
+                continue
+            entry["files"].append({"uri": artifact, "bytes": stats["bytes"], "sha256": stats["sha256"]})
+            if "triangles" in stats:
+                entry["triangles"], entry["vertices"] = stats["triangles"], stats["vertices"]
+        lods.append(entry)
+
+    tier_entries = []
+    for tier, texture_setting in tiers.items():
+        entry = {"name": tier, "max_size": texture_setting.max_size, "bytes": 0, "gpu_bytes": 0, "textures": []}
+        for name in model["images"]:
+            texture = manifest.textures.get("{}/{}".format(tier, name))
+            for artifact in texture["artifacts"] if texture else []:
+                stats = artifact_stats(manifest, artifact)
+                if not stats:
+                    continue
+                entry["textures"].append(dict(stats, uri=artifact))
+                entry["bytes"] += stats["bytes"]
+                entry["gpu_bytes"] += stats.get("gpu_bytes", 0)
+        tier_entries.append(entry)
+
+    return {"version": ASSET_MANIFEST_VERSION, "model": key, "hash": model["hash"], "lods": lods, "tiers": tier_entries}
+
+# Binary index : header (magic, version, LOD count, tier count), then per LOD (glb bytes, triangles, vertices,
+# glb sha256) and per tier (max size, texture count, bytes, GPU bytes), little endian, in the order of the json
+def build_asset_index(asset_manifest : dict) -> bytes:
+    chunks = [INDEX_HEADER.pack(ASSET_INDEX_MAGIC, ASSET_MANIFEST_VERSION, len(asset_manifest["lods"]), len(asset_manifest["tiers"]))]
+    for lod in asset_manifest["lods"]:
+        glb = next((file for file in lod["files"] if file["uri"].endswith(".glb")), {"bytes": 0, "sha256": "00" * 32})
+        chunks.append(INDEX_LOD.pack(glb["bytes"], lod.get("triangles", 0), lod.get("vertices", 0), bytes.fromhex(glb["sha256"])))
+    for tier in asset_manifest["tiers"]:
+        chunks.append(INDEX_TIER.pack(tier["max_size"], len(tier["textures"]), tier["bytes"], tier["gpu_bytes"]))
+    return b"".join(chunks)
+
+# Write the asset manifests of every model of the build manifest into its output, returns the number written
+def write_asset_manifests(config : Config, manifest : BuildManifest, tier_names : List[str]) -> int:
+    if config.asset_manifest == "none":
+        return 0
+    tiers = dict(zip(tier_names, config.texture_settings))
+    for key in manifest.models:
+        asset_manifest = build_asset_manifest(config, manifest, key, tiers)
+        json_path, index_path = asset_manifest_paths(manifest.output_path, key)
+        replace_file(json_path, [json.dumps(asset_manifest, indent=1).encode('utf-8')])
+        if config.asset_manifest == "json+bin":
+            replace_file(index_path, [build_asset_index(asset_manifest)])
+        elif os.path.exists(index_path):
+            os.remove(index_path)
+    return len(manifest.models)
+
+# Remove the asset manifests of the models no longer in the build manifest
+def remove_asset_manifests(output_path : str, keys : List[str]) -> int:
+    count = 0
+    for key in keys:
+        for path in asset_manifest_paths(output_path, key):
+            if os.path.isfile(path):
+                os.remove(path)
+                count += 1
+    return count
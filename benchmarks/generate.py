@@ -0,0 +1,164 @@
+import getopt
+import json
+import math
+import os
+import random
+import struct
+import sys
+import zlib
+from array import array
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gltf_container import align, write_glb
+
+#----------------------------------------------
+# Synthetic input generator for the benchmarks.
+# Writes `models` glb files of about `triangles` triangles, each with `textures` embedded png of
+# `texture_size` pixels. The first `shared` textures have the same name and content in every model,
+# the others are unique per model. The same seed always writes the same bytes.
+# A benchmark.json next to the models lists the size of every texture name.
+
+BENCHMARK_FILE_NAME = "benchmark.json"
+
+def png_chunk(chunk_type : bytes, data : bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+# RGB gradient with noise, so that the png neither compresses to nothing nor is pure noise
+def make_png(width : int, height : int, rng : random.Random) -> bytes:
+    noise = rng.randbytes(width * height)
+    gradient = bytes(x * 255 // max(1, width - 1) for x in range(width))
+    rows = bytearray()
+    for y in range(height):
+        noise_row = noise[y * width:(y + 1) * width]
+        green = y * 255 // max(1, height - 1)
+        row = bytearray(width * 3)
+        row[0::3] = gradient
+        row[1::3] = noise_row.translate(bytes((value // 4 + green) & 0xFF for value in range(256)))
+        row[2::3] = noise_row
+        rows.append(0)
+        rows += row
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", header) + png_chunk(b"IDAT", zlib.compress(bytes(rows), 6)) + png_chunk(b"IEND", b"")
+
+# Grid of at least `triangles` triangles with a little height noise : (positions, normals, uvs, indices)
+def make_grid(triangles : int, rng : random.Random):
+    size = max(1, math.ceil(math.sqrt(triangles / 2)))
+    positions = array("f")
+    normals = array("f")
+    uvs = array("f")
+    for y in range(size + 1):
+        for x in range(size + 1):
+            positions.extend((x / size - 0.5, rng.random() * 0.01, y / size - 0.5))
+            normals.extend((0.0, 1.0, 0.0))
+            uvs.extend((x / size, y / size))
+
+    indices = array("I")
+    for y in range(size):
+        for x in range(size):
+            corner = y * (size + 1) + x
+            indices.extend((corner, corner + size + 1, corner + 1, corner + 1, corner + size + 1, corner + size + 2))
+    return positions, normals, uvs, indices
+
+def make_model(path : str, triangles : int, images : List[tuple], rng : random.Random):
+    positions, normals, uvs, indices = make_grid(triangles, rng)
+
+    bin_chunk = bytearray()
+    buffer_views = []
+    def add_view(data : bytes, target : int = None) -> int:
+        bin_chunk.extend(b"\0" * (align(len(bin_chunk)) - len(bin_chunk)))
+        view = {"buffer": 0, "byteOffset": len(bin_chunk), "byteLength": len(data)}
+        if target:
+            view["target"] = target
+        buffer_views.append(view)
+        bin_chunk.extend(data)
+        return len(buffer_views) - 1
+
+    vertex_count = len(positions) // 3
+    xs, ys, zs = positions[0::3], positions[1::3], positions[2::3]
+    accessors = [
+        {"bufferView": add_view(positions.tobytes(), 34962), "componentType": 5126, "count": vertex_count, "type": "VEC3",
+         "min": [min(xs), min(ys), min(zs)], "max": [max(xs), max(ys), max(zs)]},
+        {"bufferView": add_view(normals.tobytes(), 34962), "componentType": 5126, "count": vertex_count, "type": "VEC3"},
+        {"bufferView": add_view(uvs.tobytes(), 34962), "componentType": 5126, "count": vertex_count, "type": "VEC2"},
+        {"bufferView": add_view(indices.tobytes(), 34963), "componentType": 5125, "count": len(indices), "type": "SCALAR"},
+    ]
+
+    gltf_images = [{"name": name, "mimeType": "image/png", "bufferView": add_view(data)} for name, data in images]
+    gltf = {
+        "asset": {"version": "2.0", "generator": "gltf-optimizer benchmarks"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0}],
+        "meshes": [{"primitives": [{"attributes": {"POSITION": 0, "NORMAL": 1, "TEXCOORD_0": 2}, "indices": 3, "material": 0}]}],
+        "materials": [{"pbrMetallicRoughness": {"baseColorTexture": {"index": index}}} for index in range(len(images))] or [{}],
+        "samplers": [{"magFilter": 9729, "minFilter": 9987}],
+        "textures": [{"sampler": 0, "source": index} for index in range(len(images))],
+        "images": gltf_images,
+        "accessors": accessors,
+        "bufferViews": buffer_views,
+        "buffers": [{"byteLength": len(bin_chunk)}],
+    }
+    if not images:
+        for key in ("samplers", "textures", "images"):
+            del gltf[key]
+
+    write_glb(path, gltf, bytes(bin_chunk))
+
+# Returns the benchmark description written to benchmark.json
+def generate(output_path : str, models : int = 8, triangles : int = 20000, textures : int = 4, texture_size : int = 1024, shared : int = 2, seed : int = 1) -> dict:
+    os.makedirs(output_path, exist_ok=True)
+    rng = random.Random(seed)
+    shared = min(shared, textures)
+
+    # Shared textures are encoded once and reused by every model
+    shared_images = [("shared_{:02d}".format(index), make_png(texture_size, texture_size, rng)) for index in range(shared)]
+    sizes : Dict[str, List[int]] = {"{}.png".format(name): [texture_size, texture_size] for name, data in shared_images}
+
+    for model in range(models):
+        images = list(shared_images)
+        for index in range(shared, textures):
+            name = "model_{:03d}_{:02d}".format(model, index)
+            images.append((name, make_png(texture_size, texture_size, rng)))
+            sizes["{}.png".format(name)] = [texture_size, texture_size]
+        make_model(os.path.join(output_path, "model_{:03d}.glb".format(model)), triangles, images, rng)
+
+    description = {
+        "models": models, "triangles": triangles, "textures": textures, "texture_size": texture_size, "shared": shared, "seed": seed,
+        "sizes": sizes,
+    }
+    with open(os.path.join(output_path, BENCHMARK_FILE_NAME), 'w') as file:
+        json.dump(description, file, indent=1, sort_keys=True)
+    return description
+
+#----------------------------------------------
+# CLI
+def main(argv):
+    usage = "{} --output <path> --models <count> --triangles <count> --textures <count per model> --texture-size <pixels> --shared <count> --seed <seed>".format(argv[0])
+    try:
+        opts, etc_args = getopt.getopt(argv[1:], "h", ["help", "output=", "models=", "triangles=", "textures=", "texture-size=", "shared=", "seed="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+
+    output_path = ""
+    options = {}
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage)
+            sys.exit()
+        elif opt == "--output":
+            output_path = os.path.abspath(arg)
+        else:
+            options[opt[2:].replace("-", "_")] = int(arg)
+
+    if not output_path:
+        print(usage)
+        sys.exit(2)
+
+    description = generate(output_path, **options)
+    print("{} models, {} textures written to {}".format(description["models"], len(description["sizes"]), output_path))
+
+if __name__ == "__main__":
+    main(sys.argv)
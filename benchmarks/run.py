@@ -0,0 +1,262 @@
+import getopt
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmarks_dir))
+from config import Config, parse_config
+from generate import BENCHMARK_FILE_NAME, generate
+
+#----------------------------------------------
+# Benchmark harness.
+# Generates a synthetic input, runs gltf-optimizer.py once per --jobs value with the stub tools of
+# benchmarks/stubs and reads back its --trace. Reports the end-to-end throughput (models/s, source
+# megapixels/s) and the throughput of every stage, and compares them with a stored baseline.
+# Texture stages are measured in megapixels/s of the images they process, other stages in items/s.
+# With --compression, the build is also run once per mesh compression and their encode time and
+# model bytes are compared, use --real-tools for meaningful sizes (the stubs copy the mesh unchanged).
+
+SCRIPT_PATH = os.path.join(os.path.dirname(benchmarks_dir), "gltf-optimizer.py")
+STUBS_PATH = os.path.join(benchmarks_dir, "stubs")
+CONFIG_PATH = os.path.join(benchmarks_dir, "config.json")
+BASELINE_PATH = os.path.join(benchmarks_dir, "baseline.json")
+
+texture_stages = ["resize", "mogrify", "toktx"]
+model_extensions = (".glb", ".gltf")
+
+def load_config(config_path : str) -> Config:
+    with open(config_path, 'r') as file:
+        return parse_config(json.load(file))
+
+# Suffix of the content hash in the texture names of a build, see texture_file_name
+hash_suffix = re.compile(r"_[0-9a-f]{8}$")
+
+# Megapixels of a span asset : "<name>_<hash8>.png" is a source image, "<tier>/<name>_<hash8>.<ext>" a resized tier of it
+def asset_megapixels(config : Config, sizes : Dict[str, List[int]], asset : str) -> float:
+    tier, _, name = asset.rpartition("/")
+    stem = os.path.splitext(name)[0]
+    name = stem + ".png"
+    if name not in sizes:
+        name = hash_suffix.sub("", stem) + ".png"
+    if name not in sizes:
+        return 0
+    width, height = sizes[name]
+    for texture_setting in config.texture_settings:
+        if str(texture_setting.max_size) == tier:
+            width, height = texture_setting.target_size(width, height)
+            break
+    return width * height / 1e6
+
+def run_once(input_path : str, work_path : str, config_path : str, jobs : int, name : str = None, real_tools : bool = False) -> dict:
+    name = name or str(jobs)
+    output_path = os.path.join(work_path, "output_{}".format(name))
+    if os.path.exists(output_path):
+        shutil.rmtree(output_path)
+    os.makedirs(output_path)
+    trace_path = os.path.join(work_path, "trace_{}.json".format(name))
+
+    env = dict(os.environ)
+    if not real_tools:
+        env["PATH"] = STUBS_PATH + os.pathsep + env.get("PATH", "")
+    command = [sys.executable, SCRIPT_PATH, "--path", input_path, "--output", output_path, "--config", config_path,
+               "--node-workers", "0", "--no-cache", "--jobs", str(jobs), "--trace", trace_path]
+
+    start_time = time.perf_counter()
+    result = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    wall_time = time.perf_counter() - start_time
+    if result.returncode != 0:
+        print(result.stdout)
+        raise RuntimeError("gltf-optimizer.py exited with {}".format(result.returncode))
+
+    with open(trace_path, 'r') as file:
+        events = [event for event in json.load(file)["traceEvents"] if event["ph"] == "X"]
+    model_bytes = sum(os.path.getsize(os.path.join(output_path, file_name)) for file_name in os.listdir(output_path) if file_name.endswith(model_extensions))
+    return {"wall": wall_time, "events": events, "model_bytes": model_bytes}
+
+def measure(config : Config, description : dict, run : dict) -> dict:
+    sizes = description["sizes"]
+    source_megapixels = sum(width * height for width, height in sizes.values()) / 1e6
+
+    stages = {}
+    for event in run["events"]:
+        stage = stages.setdefault(event["name"], {"count": 0, "seconds": 0.0, "megapixels": 0.0})
+        stage["count"] += 1
+        stage["seconds"] += event["dur"] / 1e6
+        if event["name"] in texture_stages:
+            stage["megapixels"] += asset_megapixels(config, sizes, event["args"]["asset"])
+
+    results = {
+        "wall": run["wall"],
+        "models/s": description["models"] / run["wall"],
+        "MP/s": source_megapixels / run["wall"],
+        "stages": {},
+    }
+    for name, stage in stages.items():
+        seconds = max(stage["seconds"], 1e-9)
+        if name in texture_stages:
+            results["stages"][name] = {"count": stage["count"], "seconds": stage["seconds"], "throughput": stage["megapixels"] / seconds, "unit": "MP/s"}
+        else:
+            results["stages"][name] = {"count": stage["count"], "seconds": stage["seconds"], "throughput": stage["count"] / seconds, "unit": "items/s"}
+    return results
+
+# Run the build once per mesh compression, with every model setting using it
+def compare_compressions(input_path : str, work_path : str, config_path : str, jobs : int, compressions : List[str], real_tools : bool) -> Dict[str, dict]:
+    with open(config_path, 'r') as file:
+        config_data = json.load(file)
+
+    results = {}
+    for compression in compressions:
+        for model_setting in config_data["model_settings"]:
+            model_setting["compression"] = compression
+        compression_config_path = os.path.join(work_path, "config_{}.json".format(compression))
+        with open(compression_config_path, 'w') as file:
+            json.dump(config_data, file)
+
+        run = run_once(input_path, work_path, compression_config_path, jobs, "compression_{}".format(compression), real_tools)
+        # The compression runs through the CLI or a node worker
+        encode_seconds = sum(event["dur"] / 1e6 for event in run["events"] if event["name"] in (compression, "node:{}".format(compression)))
+        results[compression] = {"wall": run["wall"], "encode": encode_seconds, "model_bytes": run["model_bytes"]}
+    return results
+
+#----------------------------------------------
+# Report
+
+def report_compressions(results : Dict[str, dict]):
+    row = "{:<12} {:>12} {:>12} {:>14}"
+    print("\nmesh compression")
+    print(row.format("compression", "wall(s)", "encode(s)", "models(MB)"))
+    for compression, result in results.items():
+        print(row.format(compression, "{:.2f}".format(result["wall"]), "{:.2f}".format(result["encode"]), "{:.3f}".format(result["model_bytes"] / 1048576)))
+
+def change(current : float, baseline : float) -> str:
+    if not baseline:
+        return ""
+    return "{:+.1f}%".format((current / baseline - 1) * 100)
+
+# Prints the results, returns the metrics slower than the baseline by more than tolerance percent
+def report(results : Dict[str, dict], baseline : Dict[str, dict], tolerance : float) -> List[str]:
+    regressions = []
+    row = "{:<28} {:>12} {:>12} {:>10}"
+    for jobs, result in results.items():
+        base = baseline.get(jobs, {})
+        print("\n--jobs {} : {:.2f}s".format(jobs, result["wall"]))
+        print(row.format("metric", "current", "baseline", "change"))
+
+        # (name, current, baseline, checked), stages shorter than 10% of the run are too noisy to be checked
+        metrics = [("models/s", result["models/s"], base.get("models/s"), True), ("MP/s", result["MP/s"], base.get("MP/s"), True)]
+        for name, stage in sorted(result["stages"].items(), key=lambda item: item[1]["seconds"], reverse=True):
+            base_stage = base.get("stages", {}).get(name, {})
+            metrics.append(("{} {}".format(name, stage["unit"]), stage["throughput"], base_stage.get("throughput"), stage["seconds"] >= result["wall"] * 0.1))
+
+        for name, current, previous, checked in metrics:
+            print(row.format(name, "{:.2f}".format(current), "{:.2f}".format(previous) if previous else "-", change(current, previous)))
+            if checked and previous and current < previous * (1 - tolerance / 100):
+                regressions.append("--jobs {} {}".format(jobs, name))
+    return regressions
+
+#----------------------------------------------
+# CLI
+def main(argv):
+    usage = ("{} --jobs <counts, e.g. 1,2,4> --repeat <count> --baseline <json path> --save-baseline --tolerance <percent> --work <path> "
+             "--config <config json path> --compression <e.g. draco,meshopt,none> --real-tools --models <count> --triangles <count> --textures <count per model> --texture-size <pixels> --shared <count> --seed <seed>").format(argv[0])
+    generator_options = ["models", "triangles", "textures", "texture-size", "shared", "seed"]
+    try:
+        opts, etc_args = getopt.getopt(argv[1:], "h", ["help", "jobs=", "repeat=", "baseline=", "save-baseline", "tolerance=", "work=", "config=", "compression=", "real-tools"] +
+                                       ["{}=".format(option) for option in generator_options])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+
+    jobs_list = [1, os.cpu_count() or 1]
+    repeat = 1
+    baseline_path = BASELINE_PATH
+    save_baseline = False
+    tolerance = 10.0
+    work_path = None
+    config_path = CONFIG_PATH
+    compressions = []
+    real_tools = False
+    options = {}
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage)
+            sys.exit()
+        elif opt == "--jobs":
+            jobs_list = [int(jobs) for jobs in arg.split(",")]
+        elif opt == "--repeat":
+            repeat = int(arg)
+        elif opt == "--baseline":
+            baseline_path = os.path.abspath(arg)
+        elif opt == "--save-baseline":
+            save_baseline = True
+        elif opt == "--tolerance":
+            tolerance = float(arg)
+        elif opt == "--work":
+            work_path = os.path.abspath(arg)
+        elif opt == "--config":
+            config_path = os.path.abspath(arg)
+        elif opt == "--compression":
+            compressions = arg.split(",")
+        elif opt == "--real-tools":
+            real_tools = True
+        else:
+            options[opt[2:].replace("-", "_")] = int(arg)
+
+    temporary = work_path is None
+    if temporary:
+        work_path = tempfile.mkdtemp(prefix="gltf-optimizer-benchmark-")
+
+    try:
+        input_path = os.path.join(work_path, "input")
+        if os.path.exists(input_path):
+            shutil.rmtree(input_path)
+        description = generate(input_path, **options)
+        os.remove(os.path.join(input_path, BENCHMARK_FILE_NAME))
+        config = load_config(config_path)
+
+        # The fastest of `repeat` runs, the slower ones are disturbed by other processes
+        results = {}
+        for jobs in sorted(set(jobs_list)):
+            runs = [run_once(input_path, work_path, config_path, jobs, real_tools=real_tools) for index in range(repeat)]
+            results[str(jobs)] = measure(config, description, min(runs, key=lambda run: run["wall"]))
+
+        compression_results = {}
+        if compressions:
+            compression_results = compare_compressions(input_path, work_path, config_path, max(jobs_list), compressions, real_tools)
+    finally:
+        if temporary:
+            shutil.rmtree(work_path, ignore_errors=True)
+
+    print("{models} models, {triangles} triangles, {textures} textures of {texture_size}px ({shared} shared), seed {seed}".format(**description))
+
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path, 'r') as file:
+            data = json.load(file)
+        # A baseline of another input is not comparable
+        if data.get("input") == {key: value for key, value in description.items() if key != "sizes"}:
+            baseline = data.get("results", {})
+        else:
+            print("Baseline {} was measured on another input, it is ignored".format(baseline_path))
+
+    regressions = report(results, baseline, tolerance)
+    if compression_results:
+        report_compressions(compression_results)
+
+    if save_baseline:
+        with open(baseline_path, 'w') as file:
+            json.dump({"input": {key: value for key, value in description.items() if key != "sizes"}, "results": results}, file, indent=1, sort_keys=True)
+        print("\nbaseline written to {}".format(baseline_path))
+    elif regressions:
+        print("\n{} metrics are more than {}% slower than the baseline: {}".format(len(regressions), tolerance, ", ".join(regressions)))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,126 @@
+import json
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gltf_container import GltfFile, align, remove_image_buffer_views, write_glb, write_gltf
+
+#----------------------------------------------
+# Local stand-ins for gltf-pipeline, gltf-transform, toktx and mogrify, run from benchmarks/stubs.
+# They produce valid outputs with the same names as the real tools and spend a simulated cost :
+# a fixed time per call plus a time per input MB, burnt on one core so that the core budget is exercised.
+# The cost of each tool is set with GLTF_OPTIMIZER_STUB_COST, e.g. '{"toktx": [0.02, 0.2]}'.
+# Calls are appended to GLTF_OPTIMIZER_STUB_LOG when set.
+
+# tool : (seconds per call, seconds per input MB)
+default_costs = {
+    "gltf-pipeline": (0.05, 0.02),
+    "gltf-transform": (0.05, 0.05),
+    "toktx": (0.02, 0.2),
+    "mogrify": (0.01, 0.05),
+}
+
+def get_cost(tool : str, input_bytes : int) -> float:
+    costs = dict(default_costs)
+    costs.update(json.loads(os.environ.get("GLTF_OPTIMIZER_STUB_COST", "{}")))
+    fixed, per_mb = costs[tool]
+    return fixed + per_mb * input_bytes / 1048576
+
+def spend(seconds : float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+def get_size(path : str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def option(args, name : str, default = None):
+    return args[args.index(name) + 1] if name in args else default
+
+#----------------------------------------------
+# gltf-pipeline -i <src> -o <dst> [-b] [-t] : embeds images with -b, extracts them with -t
+def gltf_pipeline(args) -> str:
+    src = option(args, "-i")
+    dst = option(args, "-o")
+    binary = "-b" in args
+    separate = "-t" in args
+
+    with GltfFile(src) as gltf:
+        gltf_data = gltf.json
+        bin_chunk = bytearray(gltf.bin or b"")
+
+    src_dir = os.path.dirname(src)
+    dst_dir = os.path.dirname(dst)
+    buffer_views = gltf_data.setdefault("bufferViews", [])
+    for index, image in enumerate(gltf_data.get("images", [])):
+        if "uri" in image and not separate:
+            with open(os.path.join(src_dir, image.pop("uri")), 'rb') as file:
+                data = file.read()
+            bin_chunk += b"\0" * (align(len(bin_chunk)) - len(bin_chunk))
+            buffer_views.append({"buffer": 0, "byteOffset": len(bin_chunk), "byteLength": len(data)})
+            bin_chunk += data
+            image["bufferView"] = len(buffer_views) - 1
+            image.setdefault("mimeType", "image/png")
+        elif "bufferView" in image and separate:
+            view = buffer_views[image["bufferView"]]
+            name = "{}.png".format(image.get("name") or "image{}".format(index))
+            with open(os.path.join(dst_dir, name), 'wb') as file:
+                file.write(bin_chunk[view.get("byteOffset", 0):view.get("byteOffset", 0) + view["byteLength"]])
+            image["uri"] = name
+        elif "uri" in image and separate and src_dir != dst_dir:
+            shutil.copyfile(os.path.join(src_dir, image["uri"]), os.path.join(dst_dir, image["uri"]))
+
+    # The extracted images leave the buffer, as with the real tool
+    if separate:
+        bin_chunk = remove_image_buffer_views(gltf_data, bin_chunk)
+    if gltf_data.get("buffers"):
+        gltf_data["buffers"][0].pop("uri", None)
+    (write_glb if binary else write_gltf)(dst, gltf_data, bytes(bin_chunk) if gltf_data.get("buffers") else None)
+    return src
+
+# gltf-transform <command> [options] <src> <dst> : the model is copied unchanged, draco and meshopt included
+def gltf_transform(args) -> str:
+    src, dst = args[-2], args[-1]
+    if os.path.abspath(src) != os.path.abspath(dst):
+        shutil.copyfile(src, dst)
+    return src
+
+# toktx [options] <dst> <src> : the png is copied as the ktx2, --threads divides the cost
+def toktx(args) -> str:
+    dst, src = args[-2], args[-1]
+    shutil.copyfile(src, dst)
+    return src
+
+# mogrify [options] <path> : the png is kept unchanged
+def mogrify(args) -> str:
+    return args[-1]
+
+tools = {
+    "gltf-pipeline": gltf_pipeline,
+    "gltf-transform": gltf_transform,
+    "toktx": toktx,
+    "mogrify": mogrify,
+}
+
+def main(tool : str):
+    args = sys.argv[1:]
+    # Version probe of the preflight
+    if args in (["--version"], ["-version"]):
+        print("{} stub".format(tool))
+        return
+
+    log_path = os.environ.get("GLTF_OPTIMIZER_STUB_LOG")
+    if log_path:
+        with open(log_path, 'a') as file:
+            file.write("{} {}\n".format(tool, " ".join(args)))
+
+    src = tools[tool](args)
+    cost = get_cost(tool, get_size(src))
+    if tool == "toktx":
+        cost /= max(1, int(option(args, "--threads", 1)))
+    spend(cost)
@@ -0,0 +1,70 @@
+import concurrent.futures
+import json
+import os
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+#----------------------------------------------
+# Size budgets of the model settings and texture settings with target_bytes.
+# The candidate settings of a budget go from the most detailed to the least (see budget_settings in config.py),
+# and their output size decreases along the list. The search runs `parallel` trials at once, spread over the
+# candidates still undecided : a candidate that fits prunes every less detailed one, a candidate that does not
+# prunes every more detailed one, until the most detailed candidate that fits is known. The first round
+# includes the most detailed candidate, so an asset already within its budget costs a single round.
+# The chosen candidate is remembered per asset hash in budgets.json of the cache folder,
+# later runs build it directly.
+
+BUDGET_FILE_NAME = "budgets.json"
+
+# Index of the most detailed candidate whose size fits in target_bytes, the last candidate when none fits,
+# and {candidate index : size} of the trials. trial(index) builds the candidate and returns its size.
+def search(count : int, trial : Callable[[int], int], target_bytes : int, parallel : int) -> Tuple[int, Dict[int, int]]:
+    sizes : Dict[int, int] = {}
+    # Candidates up to lo do not fit, candidates from hi fit
+    lo, hi = -1, count
+    with concurrent.futures.ThreadPoolExecutor(max(1, parallel), thread_name_prefix="budget") as pool:
+        while hi - lo > 1:
+            trials = min(max(1, parallel), hi - lo - 1)
+            start = lo
+            indices = set()
+            # The first round always tries the settings as configured, the budget often fits them
+            if not sizes:
+                indices.add(0)
+                start, trials = 0, trials - 1
+            indices.update(start + max(1, round((hi - start) * (step + 1) / (trials + 1))) for step in range(trials))
+            indices = sorted(index for index in indices if lo < index < hi)
+            for index, size in zip(indices, pool.map(trial, indices)):
+                sizes[index] = size
+
+            fitting = [index for index in indices if sizes[index] <= target_bytes]
+            if fitting:
+                hi = min(fitting)
+            # The sizes are not strictly monotonic, a candidate past the first fitting one is not needed
+            not_fitting = [index for index in indices if sizes[index] > target_bytes and index < hi]
+            if not_fitting:
+                lo = max(not_fitting)
+    return min(hi, count - 1), sizes
+
+class BudgetCache:
+    def __init__(self, root : str):
+        self.path = os.path.join(root, BUDGET_FILE_NAME)
+        self.lock = threading.Lock()
+        self.entries = {}
+        try:
+            with open(self.path, 'r') as file:
+                self.entries = json.load(file)
+        except (OSError, ValueError):
+            pass
+
+    def get(self, key : str) -> Optional[dict]:
+        with self.lock:
+            return self.entries.get(key)
+
+    def put(self, key : str, value : dict):
+        with self.lock:
+            self.entries[key] = value
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = "{}.{}.tmp".format(self.path, os.getpid())
+            with open(temp_path, 'w') as file:
+                json.dump(self.entries, file, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
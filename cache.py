@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from config import Config, changed_fields
+from directory import make_directory
+
+#----------------------------------------------
+def file_hash(path : str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def link_or_copy(src : str, dst : str):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+#----------------------------------------------
+# Persistent content-addressed store of encoded KTX2 textures.
+# The key is the sha256 of the source image plus every encode parameter,
+# so a changed image or a tuned texture setting never hits a stale entry.
+class TextureCache:
+    def __init__(self, root : str, max_bytes : int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.reset_stats()
+        make_directory(root)
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+    # source_hash : file_hash of the source image
+    def key(self, texture_setting : Config.TextureSetting, source_hash : str, other_format : bool) -> str:
+        params = changed_fields(texture_setting)
+        params["other_format"] = other_format
+        digest = hashlib.sha256()
+        digest.update(source_hash.encode())
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def entry_path(self, key : str) -> str:
+        return os.path.join(self.root, key[:2], "{}.ktx2".format(key))
+
+    # Link the cached texture to dst. Returns False on a miss.
+    # A lookup may probe several keys (the tiers of one encode group), the caller counts it once with count_lookup.
+    def fetch(self, key : str, dst : str) -> bool:
+        path = self.entry_path(key)
+        try:
+            link_or_copy(path, dst)
+            # Touch the entry so eviction sees it as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def count_lookup(self, hit : bool):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def store(self, key : str, src : str):
+        path = self.entry_path(key)
+        make_directory(os.path.dirname(path))
+
+        # Write under a unique name and rename, so concurrent runs never read a partial entry
+        temp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        link_or_copy(src, temp_path)
+        os.replace(temp_path, path)
+
+    # Remove least recently used entries until the cache fits in max_bytes
+    def evict(self):
+        entries = []
+        total_size = 0
+        for root, dirs, files in os.walk(self.root):
+            for file in files:
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                # Leftovers of an interrupted store
+                if file.endswith(".tmp") and stat.st_mtime < time.time() - 3600:
+                    os.remove(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total_size <= self.max_bytes:
+                break
+            os.remove(path)
+            total_size -= size
+
+    def summary(self) -> str:
+        return "texture cache: {} hits, {} misses".format(self.hits, self.misses)
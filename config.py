@@ -1,5 +1,6 @@
-from dataclasses import dataclass, field
-from typing import List
+import difflib
+from dataclasses import MISSING, dataclass, field, fields, replace
+from typing import List, Tuple
 
 
 @dataclass
@@ -19,74 +20,132 @@ class Config:
         clevel: int = 1
         qlevel: int = 128
         assign_oetf: str = "srgb"
+        # Bytes of the ktx2 of an image, the quality (qlevel or uastc_rdo_l) is lowered until it fits. 0 keeps the quality.
+        target_bytes: int = 0
+        # Size and format of each image follow its content, see analysis.py
+        analyze: bool = False
 
-        # imagemagic commands
+        def clamped_scale(self) -> float:
+            return min(max(0.01, self.scale), 1)
+
+        # Size after resize and resize_scale, following the imagemagick geometry rules.
+        # 'WxH>' only shrinks and keeps the aspect ratio, a percent resize rounds to the nearest pixel.
+        def target_size(self, width : int, height : int) -> Tuple[int, int]:
+            if width > self.max_size or height > self.max_size:
+                factor = min(self.max_size / width, self.max_size / height)
+                width = max(1, int(width * factor + 0.5))
+                height = max(1, int(height * factor + 0.5))
+
+            scale = self.clamped_scale()
+            if scale < 1:
+                width = max(1, int(width * scale + 0.5))
+                height = max(1, int(height * scale + 0.5))
+
+            return width, height
+
+        # The images whose path contains one of the keywords (e.g. lightmaps) are encoded in the other format
+        def is_other_format(self, file_path : str) -> bool:
+            return bool(self.keywords) and any(keyword in file_path for keyword in self.keywords)
+
+        # Format of the ktx2, the other format is used for the images matching the keywords
+        def encode_format(self, other_format : bool) -> str:
+            if other_format:
+                return 'etc1s' if self.default_format == 'uastc' else 'uastc'
+            return 'uastc' if self.default_format == 'uastc' else 'etc1s'
+
+        # Parameters of the toktx command once the image is resized, tiers with the same target size
+        # and the same parameters produce the same ktx2
+        def encode_params(self, other_format : bool) -> tuple:
+            if self.encode_format(other_format) == 'uastc':
+                return ('uastc', self.astc_blk_d, self.uastc_quality, self.uastc_rdo_l, self.uastc_rdo_d, self.zcmp, self.assign_oetf, self.target_bytes)
+            return ('etc1s', self.clevel, self.qlevel, self.assign_oetf, self.target_bytes)
+
+        # Settings tried for target_bytes, from the highest quality (this setting) to the lowest.
+        # etc1s lowers qlevel, uastc raises the rdo lambda.
+        def budget_settings(self, other_format : bool) -> List["Config.TextureSetting"]:
+            if self.encode_format(other_format) == 'uastc':
+                lambdas = [self.uastc_rdo_l]
+                while lambdas[-1] < 10:
+                    lambdas.append(min(10, round(max(lambdas[-1], 0.05) * 1.6, 3)))
+                return [replace(self, uastc_rdo_l=value) for value in lambdas]
+            qlevels = [self.qlevel]
+            while qlevels[-1] > 1:
+                qlevels.append(max(1, int(qlevels[-1] * 0.75)))
+            return [replace(self, qlevel=value) for value in qlevels]
+
+        # imagemagic commands, as argument vectors run without a shell
         # ref : https://imagemagick.org/Usage/resize/
 
+        # thread limit option, 0 lets the tool decide
+        def mogrify_threads(self, threads) -> List[str]:
+            return ["-limit", "thread", str(threads)] if threads > 0 else []
+
         # resize command
-        def resize(self, src) -> str:
-            return (
-                "mogrify -resize "
-                f"{self.max_size}x{self.max_size}\> "
-                "{}"
-            ).format(src)
-        
+        def resize(self, src, threads=0) -> List[str]:
+            return [
+                "mogrify",
+                *self.mogrify_threads(threads),
+                "-resize", f"{self.max_size}x{self.max_size}>",
+                src,
+            ]
+
         # resize scale command
-        def resize_scale(self, src) -> str:
-            scale = min(max(0.01, self.scale), 1) * 100
-            return (
-                "mogrify -resize "
-                f"{scale}% " 
-                "{}"
-            ).format(src)
-        
+        def resize_scale(self, src, threads=0) -> List[str]:
+            scale = self.clamped_scale() * 100
+            return [
+                "mogrify",
+                *self.mogrify_threads(threads),
+                "-resize", f"{scale}%",
+                src,
+            ]
+
 
         # toktx commands
         # ref : https://github.khronos.org/KTX-Software/ktxtools/toktx.html
 
-        # to ktx common command
-        def to_ktx_common(self) -> str:
-            return (
-                "toktx "
-                "--genmipmap "
-                "--t2 "
-                "--assign_primaries none "
-            )
-    
+        # to ktx common command, threads 0 lets toktx use every core
+        def to_ktx_common(self, threads=0) -> List[str]:
+            return [
+                "toktx",
+                "--genmipmap",
+                "--t2",
+                "--assign_primaries", "none",
+            ] + (["--threads", str(threads)] if threads > 0 else [])
+
         # to etc1 ktx2 command
-        def to_etc1s(self, src, dst) -> str:
-            return self.to_ktx_common() + (
-                "--encode etc1s "
-                f"--assign_oetf {self.assign_oetf} "
-                "'{}' '{}' "
-            ).format(dst, src)
-        
+        def to_etc1s(self, src, dst, threads=0) -> List[str]:
+            return self.to_ktx_common(threads) + [
+                "--encode", "etc1s",
+                "--assign_oetf", self.assign_oetf,
+                dst, src,
+            ]
+
         # to uastc ktx2 command
-        def to_uastc(self, src, dst) -> str:
-            return self.to_ktx_common() + (
-                "--encode uastc "
-                f"--astc_blk_d {self.astc_blk_d} "
-                f"--uastc_quality {self.uastc_quality} "
-                f"--uastc_rdo_l {self.uastc_rdo_l} "
-                f"--uastc_rdo_d {self.uastc_rdo_d} "
-                f"--zcmp {self.zcmp} "
-                f"--assign_oetf {self.assign_oetf} "
-                "'{}' '{}' "
-            ).format(dst, src)
-        
+        def to_uastc(self, src, dst, threads=0) -> List[str]:
+            return self.to_ktx_common(threads) + [
+                "--encode", "uastc",
+                "--astc_blk_d", self.astc_blk_d,
+                "--uastc_quality", str(self.uastc_quality),
+                "--uastc_rdo_l", str(self.uastc_rdo_l),
+                "--uastc_rdo_d", str(self.uastc_rdo_d),
+                "--zcmp", str(self.zcmp),
+                "--assign_oetf", self.assign_oetf,
+                dst, src,
+            ]
+
         # set default format to ktx2 command
-        def to_ktx(self, src, dst) -> str: 
+        def to_ktx(self, src, dst, threads=0) -> List[str]:
             if self.default_format == 'uastc':
-                return self.to_uastc(src, dst)
+                return self.to_uastc(src, dst, threads)
             else:
-                return self.to_etc1s(src, dst)
-        
+                return self.to_etc1s(src, dst, threads)
+
         # other format to ktx2 command
-        def to_ktx_other(self, src, dst) -> str:
+        def to_ktx_other(self, src, dst, threads=0) -> List[str]:
             if self.default_format == 'uastc':
-                return self.to_etc1s(src, dst)
+                return self.to_etc1s(src, dst, threads)
             else:
-                return self.to_uastc(src, dst)
+                return self.to_uastc(src, dst, threads)
             
 
                 
@@ -103,53 +162,108 @@ class Config:
         quantize_normal: int = 8
         quantize_texcoord: int = 10
         quantize_color: int = 8
+        # "gltf-transform" runs the weld command, "numpy" the in-process engine of mesh.py
+        weld_engine: str = "gltf-transform"
+        # "draco", "meshopt" (reorder + quantize + EXT_meshopt_compression) or "none"
+        compression: str = "draco"
+        meshopt_level: str = "high"
+        # Bytes of the LOD file, the simplify ratio is lowered from ratio (1 when -1) until it fits. 0 keeps the ratio.
+        target_bytes: int = 0
+        # Geometric error allowed to the simplify of target_bytes, 0 uses error
+        max_error: float = 0
+
+        # Settings tried for target_bytes, from the most detailed to the least
+        def budget_settings(self) -> List["Config.ModelSetting"]:
+            ratios = [self.ratio if 0 < self.ratio <= 1 else 1.0]
+            while ratios[-1] > 0.01:
+                ratios.append(max(0.01, round(ratios[-1] * 0.8, 4)))
+            return [replace(self, ratio=ratio, error=self.max_error or self.error) for ratio in ratios]
 
-        # gltf-pipeline commands
+        # gltf-pipeline commands, as argument vectors run without a shell
         # ref : https://github.com/CesiumGS/gltf-pipeline
-        def gltf_pipeline(self, src, dst) -> str:
-            return "gltf-pipeline -i {} -o {} --keepUnusedElements --keepLegacyExtensions".format(src, dst)
-
-        def to_glb(self, src, dst) -> str: 
-            return self.gltf_pipeline(src, dst) + " -b"
-        
-        def to_glb_separate(self, src, dst) -> str: 
-            return self.gltf_pipeline(src, dst) + " -b -t"
-        
-        def to_gltf_separate(self, src, dst) -> str: 
-            return self.gltf_pipeline(src, dst) + " -t"
-        
+        def gltf_pipeline(self, src, dst) -> List[str]:
+            return ["gltf-pipeline", "-i", src, "-o", dst, "--keepUnusedElements", "--keepLegacyExtensions"]
+
+        def to_glb(self, src, dst) -> List[str]:
+            return self.gltf_pipeline(src, dst) + ["-b"]
+
+        def to_glb_separate(self, src, dst) -> List[str]:
+            return self.gltf_pipeline(src, dst) + ["-b", "-t"]
+
+        def to_gltf_separate(self, src, dst) -> List[str]:
+            return self.gltf_pipeline(src, dst) + ["-t"]
+
         # gltf-transform commands
         # ref : https://gltf-transform.donmccurdy.com/cli
-        def weld(self, src, dst) -> str:
-            return (
-                "gltf-transform weld " 
-                f"--tolerance {self.tolerance} " 
-                "{} {}"
-            ).format(src, dst)
-
-        def simplify(self, src, dst) -> str:
-            return (
-                "gltf-transform simplify "
-                f"--ratio {self.ratio} "
-                f"--error {self.error} " 
-                f"--lock_border {self.lock_border} "
-                "{} {}"
-            ).format(src, dst)
-
-        def draco(self, src, dst) -> str:
-            return (
-                "gltf-transform draco "
-                f"--decode-speed {self.decode_speed} --encode-speed {self.encode_speed} "
-                f"--quantize-position {self.quantize_position} "
-                f"--quantize-normal {self.quantize_normal} "
-                f"--quantize-texcoord {self.quantize_texcoord} "
-                f"--quantize-color {self.quantize_color} "
-                "{} {}"
-            ).format(src, dst)
+        def weld(self, src, dst) -> List[str]:
+            return [
+                "gltf-transform", "weld",
+                "--tolerance", str(self.tolerance),
+                src, dst,
+            ]
+
+        def simplify(self, src, dst) -> List[str]:
+            return [
+                "gltf-transform", "simplify",
+                "--ratio", str(self.ratio),
+                "--error", str(self.error),
+                "--lock_border", str(self.lock_border),
+                src, dst,
+            ]
+
+        def draco(self, src, dst) -> List[str]:
+            return [
+                "gltf-transform", "draco",
+                "--decode-speed", str(self.decode_speed), "--encode-speed", str(self.encode_speed),
+                "--quantize-position", str(self.quantize_position),
+                "--quantize-normal", str(self.quantize_normal),
+                "--quantize-texcoord", str(self.quantize_texcoord),
+                "--quantize-color", str(self.quantize_color),
+                src, dst,
+            ]
+
+        def meshopt(self, src, dst) -> List[str]:
+            return [
+                "gltf-transform", "meshopt",
+                "--level", self.meshopt_level,
+                "--quantize-position", str(self.quantize_position),
+                "--quantize-normal", str(self.quantize_normal),
+                "--quantize-texcoord", str(self.quantize_texcoord),
+                src, dst,
+            ]
+
+        # gltf-transform function options, same values as the commands above
+        def weld_options(self) -> dict:
+            return {"tolerance": self.tolerance}
+
+        def simplify_options(self) -> dict:
+            return {"ratio": self.ratio, "error": self.error, "lockBorder": self.lock_border}
+
+        def draco_options(self) -> dict:
+            return {
+                "decodeSpeed": self.decode_speed,
+                "encodeSpeed": self.encode_speed,
+                "quantizePosition": self.quantize_position,
+                "quantizeNormal": self.quantize_normal,
+                "quantizeTexcoord": self.quantize_texcoord,
+                "quantizeColor": self.quantize_color,
+            }
+
+        def meshopt_options(self) -> dict:
+            return {
+                "level": self.meshopt_level,
+                "quantizePosition": self.quantize_position,
+                "quantizeNormal": self.quantize_normal,
+                "quantizeTexcoord": self.quantize_texcoord,
+            }
 
 
     def __init__(self, output_exts: List[str]):
         self.output_exts = output_exts
+        # Occlusion and metallic-roughness images of a material packed into one, see orm.py
+        self.pack_orm = False
+        # Asset manifests written next to the models : "json", "json+bin" or "none", see asset_manifest.py
+        self.asset_manifest = "json"
         self.texture_settings: List[Config.TextureSetting] = []
         self.model_settings: List[Config.ModelSetting] = []
 
@@ -168,7 +282,9 @@ class Config:
                     zcmp=setting.get("zcmp", 22),
                     clevel=setting.get("clevel", 1),
                     qlevel=setting.get("qlevel", 128),
-                    assign_oetf=setting.get("assign_oetf", "srgb")
+                    assign_oetf=setting.get("assign_oetf", "srgb"),
+                    target_bytes=setting.get("target_bytes", 0),
+                    analyze=setting.get("analyze", False)
                 )
             )
 
@@ -185,18 +301,110 @@ class Config:
                 quantize_position=setting.get("quantize_position", 11),
                 quantize_normal=setting.get("quantize_normal", 8),
                 quantize_texcoord=setting.get("quantize_texcoord", 10),
-                quantize_color=setting.get("quantize_color", 8)
+                quantize_color=setting.get("quantize_color", 8),
+                weld_engine=setting.get("weld_engine", "gltf-transform"),
+                compression=setting.get("compression", "draco"),
+                meshopt_level=setting.get("meshopt_level", "high"),
+                target_bytes=setting.get("target_bytes", 0),
+                max_error=setting.get("max_error", 0)
             )
             self.model_settings.append(model_setting)
 
 
+#----------------------------------------------
+# Schema of the config file. Every key is checked before parsing : a misspelled key (e.g. "defualt_format")
+# would otherwise fall back to its default without a word, a value of the wrong type would fail a tool much later.
+
+config_keys = {"output_exts": list, "texture_settings": list, "model_settings": list, "pack_orm": bool, "asset_manifest": str}
+
+# Values allowed for the string options, and for the items of output_exts
+config_choices = {
+    "output_exts": (".glb", ".gltf"),
+    "default_format": ("etc1s", "uastc"),
+    "assign_oetf": ("srgb", "linear"),
+    "weld_engine": ("gltf-transform", "numpy"),
+    "compression": ("draco", "meshopt", "none"),
+    "meshopt_level": ("medium", "high"),
+    "asset_manifest": ("json", "json+bin", "none"),
+}
+
+# Options whose value is a list of strings
+string_list_keys = ("output_exts", "keywords")
+
+# {key : type} of the fields of a setting class, lists are lists of strings
+def setting_keys(setting_class) -> dict:
+    return {setting_field.name: list if setting_field.type == List[str] else setting_field.type for setting_field in fields(setting_class)}
+
+# {name : value} of the fields of a setting that differ from their default. The setting hashes are computed on it :
+# a field added later with a default leaves the hashes of the existing configs, and their outputs, unchanged.
+def changed_fields(setting) -> dict:
+    changed = {}
+    for setting_field in fields(setting):
+        default = setting_field.default_factory() if setting_field.default_factory is not MISSING else setting_field.default
+        value = getattr(setting, setting_field.name)
+        if value != default:
+            changed[setting_field.name] = value
+    return changed
+
+def is_type(value, expected) -> bool:
+    # JSON numbers : an integer is a valid float, a boolean is not a number
+    if isinstance(value, bool):
+        return expected is bool
+    if expected is float:
+        return isinstance(value, (int, float))
+    return isinstance(value, expected)
+
+type_names = {bool: "boolean", int: "integer", float: "number", str: "string", list: "list", dict: "object"}
+
+def json_type(value) -> str:
+    return type_names.get(type(value), "null")
+
+def check_keys(where : str, data, keys : dict) -> List[str]:
+    if not isinstance(data, dict):
+        return ["{}: an object is expected".format(where)]
+    errors = []
+    for key, value in data.items():
+        if key not in keys:
+            matches = difflib.get_close_matches(key, keys, 1)
+            errors.append("{}: unknown key \"{}\"{}".format(where, key, ", did you mean \"{}\"?".format(matches[0]) if matches else ""))
+            continue
+        expected = keys[key]
+        if not is_type(value, expected):
+            errors.append("{}: \"{}\" must be a {}, not {}".format(where, key, type_names[expected], json_type(value)))
+            continue
+        items = value if expected is list else [value]
+        if key in config_choices or key in string_list_keys:
+            for item in items:
+                if not isinstance(item, str):
+                    errors.append("{}: \"{}\" must be a list of strings".format(where, key))
+                    break
+                if key in config_choices and item not in config_choices[key]:
+                    errors.append("{}: \"{}\" is \"{}\", expected one of {}".format(where, key, item, ", ".join(config_choices[key])))
+    return errors
+
+# Raises ValueError listing every error of the config data
+def validate_config(data):
+    errors = check_keys("config", data, config_keys)
+    if isinstance(data, dict):
+        for name, setting_class in (("texture_settings", Config.TextureSetting), ("model_settings", Config.ModelSetting)):
+            settings = data.get(name)
+            if isinstance(settings, list):
+                for index, setting in enumerate(settings):
+                    errors += check_keys("{}[{}]".format(name, index), setting, setting_keys(setting_class))
+    if errors:
+        raise ValueError("Invalid config:\n  " + "\n  ".join(errors))
+
 def parse_config(data) -> Config:
+    validate_config(data)
+
     # Check output ext
     output_exts = data.get('output_exts', [])
     if not output_exts:
         raise ValueError("output_exts is required.")
 
     config = Config(output_exts)
+    config.pack_orm = data.get('pack_orm', False)
+    config.asset_manifest = data.get('asset_manifest', "json")
 
     # Check texture setting
     texture_settings = data.get('texture_settings', [])
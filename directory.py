@@ -1,6 +1,9 @@
+import ctypes
+import ctypes.util
 import os
 import shutil
 import sys
+import tempfile
 import time
 from typing import List
 
@@ -21,19 +24,22 @@ image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
 def get_all_image_paths(directory : str, deep: bool) -> List[str]:
     return get_all_file_paths(directory, image_extensions, deep)
 
+# Files of directory whose name ends with one of extensions, in one os.scandir walk : the type of each entry
+# comes with the listing, without a stat per file. deep walks the sub folders too, in the order of os.walk.
 def get_all_file_paths(directory : str, extensions : str, deep : bool) -> List[str] :
+    extensions = tuple(extensions)
     file_paths = []
-    if deep:
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                if file.endswith(tuple(extensions)):
-                    file_paths.append(os.path.abspath(os.path.join(root, file)))
-    else:
-        for file in os.listdir(directory):
-            if file.endswith(tuple(extensions)):
-                path = os.path.abspath(os.path.join(directory, file))
-                if os.path.isfile(path):
-                    file_paths.append(os.path.abspath(os.path.join(directory, file)))
+    folders = [os.path.abspath(directory)]
+    while folders:
+        sub_folders = []
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if deep:
+                        sub_folders.append(entry.path)
+                elif entry.name.endswith(extensions) and entry.is_file():
+                    file_paths.append(entry.path)
+        folders += reversed(sub_folders)
 
     return file_paths
 
@@ -48,26 +54,82 @@ def convert_file_path(target_file: str, dest_path: str, ext: str) -> str:
     output_path = os.path.join(dest_path, f"{target_file_name}{ext}")
     return output_path
 
-class Directory :
-     def __init__(self, texture_settings : List[Config.TextureSetting]):
+def get_bundle_dir() -> str:
+    if getattr(sys, "frozen", False):
+        return sys._MEIPASS
+    else:
+        return os.path.dirname(os.path.abspath(__file__))
 
-        if getattr(sys, "frozen", False):
-            bundle_dir = sys._MEIPASS
-        else:
-            bundle_dir = os.path.dirname(os.path.abspath(__file__))
+def get_workspace_root_path() -> str:
+    return "{}/workspace".format(get_bundle_dir())
+
+#----------------------------------------------
+# Swap two paths of the same file system in one step (renameat2 RENAME_EXCHANGE, Linux 3.15+),
+# so that readers of either path never see it missing. Returns False when it is not supported.
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+libc = None
+
+def exchange_paths(path_a : str, path_b : str) -> bool:
+    global libc
+    if libc is None:
+        library = ctypes.util.find_library("c")
+        libc = ctypes.CDLL(library, use_errno=True) if library else False
+    if not libc or not hasattr(libc, "renameat2"):
+        return False
+    return libc.renameat2(AT_FDCWD, os.fsencode(path_a), AT_FDCWD, os.fsencode(path_b), RENAME_EXCHANGE) == 0
+
+# Replace the directory dst by src, both on the same file system
+def swap_directory(src : str, dst : str):
+    if not os.path.exists(dst):
+        os.rename(src, dst)
+        return
 
-        # Create 'workspace' folder in the current execution path
-        self.workspace_root_path = "{}/workspace".format(bundle_dir)
+    if exchange_paths(src, dst):
+        # src now holds the previous dst
+        shutil.rmtree(src)
+        return
+
+    # dst is missing between the two renames
+    old_path = "{}.{}.old".format(dst, os.getpid())
+    os.rename(dst, old_path)
+    os.rename(src, dst)
+    shutil.rmtree(old_path)
+
+# Replace dst by src so that readers of dst see either the old or the new file, never a partial one
+def publish_file(src : str, dst : str):
+    try:
+        os.replace(src, dst)
+    except OSError:
+        # Different file system, copy next to dst first
+        temp_path = "{}.{}.tmp".format(dst, os.getpid())
+        shutil.copyfile(src, temp_path)
+        os.replace(temp_path, dst)
+        os.remove(src)
+
+class Directory :
+     def __init__(self, texture_settings : List[Config.TextureSetting], workspace_root_path : str = None, resume_run_id : str = None):
+
+        # Create the workspace root, 'workspace' in the current execution path unless --workspace is given (e.g. tmpfs /dev/shm)
+        self.workspace_root_path = workspace_root_path or get_workspace_root_path()
         make_directory(self.workspace_root_path)
 
-        # Create a folder in 'workspace' with the current timestamp
-        self.workspace = "{}/{}".format(self.workspace_root_path, time.strftime("%Y%m%d_%H%M%S", time.localtime(time.time())))
-        make_directory(self.workspace)
+        # Create a folder in the workspace root named by the run id : the current timestamp and a random part,
+        # unique when several builds start in the same second. A resumed run reuses the folder of its run id.
+        if resume_run_id:
+            self.workspace = os.path.join(self.workspace_root_path, resume_run_id)
+        else:
+            self.workspace = tempfile.mkdtemp(prefix=time.strftime("%Y%m%d_%H%M%S_", time.localtime(time.time())), dir=self.workspace_root_path)
+        self.run_id = os.path.basename(self.workspace)
 
         # Convert the base file to texture-separated gltf and create a base folder to save it
         self.base_model = "{}/{}".format(self.workspace, 'base')
         make_directory(self.base_model)
 
+        # The unique images of every model, named by content, see TextureRegistry
+        self.images = "{}/{}".format(self.workspace, 'images')
+        make_directory(self.images)
+
         self.texture : List[str] = []
         for texture_setting in texture_settings:
             texture_path = "{}/{}".format(self.workspace, texture_setting.max_size)
@@ -0,0 +1,71 @@
+import concurrent.futures
+import os
+import time
+
+#----------------------------------------------
+# Core budget shared by every task of a run.
+# CPU tasks (toktx, Draco, resize ...) reserve the number of threads they start, so that the
+# threads of all running tools stay within --jobs cores. I/O tasks (cache links, file copies)
+# run on their own pool and do not count against the budget.
+# The methods are not thread-safe, the scheduler calls them under its own lock.
+
+CPU = "cpu"
+IO = "io"
+
+def default_jobs() -> int:
+    return os.cpu_count() or 1
+
+class ResourceExecutor:
+    def __init__(self, jobs : int = None, io_workers : int = None):
+        self.jobs = max(1, jobs or default_jobs())
+        self.io_workers = io_workers or min(32, self.jobs * 2)
+        self.cpu_pool = concurrent.futures.ThreadPoolExecutor(self.jobs, thread_name_prefix="cpu")
+        self.io_pool = concurrent.futures.ThreadPoolExecutor(self.io_workers, thread_name_prefix="io")
+
+        self.cores_in_use = 0
+        self.io_in_use = 0
+        self.reset_stats()
+
+        # Threads given to each multi-threaded tool.
+        # toktx scales well up to a few threads, beyond that running more images at once is better.
+        self.toktx_threads = max(1, min(4, self.jobs // 8))
+
+    # Utilization is measured from here, i.e. per build in watch mode
+    def reset_stats(self):
+        self.busy_core_seconds = 0.0
+        self.start_time = time.time()
+
+    def can_start(self, kind : str, threads : int) -> bool:
+        if kind == IO:
+            return self.io_in_use < self.io_workers
+        # A task asking for more than the whole budget still runs, alone
+        return self.cores_in_use == 0 or self.cores_in_use + threads <= self.jobs
+
+    def submit(self, kind : str, threads : int, function, *args) -> concurrent.futures.Future:
+        if kind == IO:
+            self.io_in_use += 1
+            return self.io_pool.submit(function, *args)
+
+        self.cores_in_use += min(threads, self.jobs)
+        return self.cpu_pool.submit(function, *args)
+
+    # Called when a submitted task finished, with its run time
+    def release(self, kind : str, threads : int, duration : float):
+        if kind == IO:
+            self.io_in_use -= 1
+            return
+
+        threads = min(threads, self.jobs)
+        self.cores_in_use -= threads
+        self.busy_core_seconds += duration * threads
+
+    def utilization(self) -> float:
+        wall_time = max(time.time() - self.start_time, 1e-6)
+        return self.busy_core_seconds / (wall_time * self.jobs)
+
+    def summary(self) -> str:
+        return "cpu utilization: {:.0f}% of {} cores".format(self.utilization() * 100, self.jobs)
+
+    def shutdown(self):
+        self.cpu_pool.shutdown()
+        self.io_pool.shutdown()
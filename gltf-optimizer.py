@@ -1,23 +1,45 @@
 import os
 import shutil
-import subprocess
 import sys
 import time
 import json
 import getopt
 
-import concurrent.futures
-
+from dataclasses import replace
 from pathlib import Path
-from shutil import copy
-from typing import List
+from typing import Dict, List, Tuple
+
+import analysis
+import asset_manifest
+import mesh
+import orm
+import preflight
+import scratch
+import texture
 
+from budget import BudgetCache, search as budget_search
+from cache import TextureCache, file_hash, link_or_copy
+from manifest import MANIFEST_FILE_NAME, BuildManifest, lod_config_hash, settings_hash, model_source_hash, texture_config_hash
+from runtime import Runtime
+from scheduler import FAILED
+from lod import lod_lineage, lod_sources, relative_ratio
+from watch import Watcher
+from work_queue import DONE, FAILED as FAILED_UNITS, LEASED, PENDING, WorkQueue, worker_name
+from tracing import ToolError, tracer
+from texture_registry import TextureEntry, TextureRegistry, texture_file_name
+from journal import Journal
+from node_worker import NodeWorkerPool
+from executor import CPU, IO, ResourceExecutor, default_jobs
 from config import Config, parse_config
-from directory import Directory, remove_directory, get_all_file_paths, convert_file_path, get_all_image_paths, remove_unnecessary_assets
+from gltf_container import get_gltf_images, has_buffers
+from repackage import repackage_model
+from directory import Directory, publish_file, make_directory, swap_directory, remove_directory, get_all_file_paths, convert_file_path, remove_unnecessary_assets, get_bundle_dir, get_workspace_root_path
 
 #----------------------------------------------
 
-def run(base_model_input_path : str, final_output_path : str, config_file : str, update_mode : bool):
+def run(base_model_input_path : str, final_output_path : str, config_file : str, update_mode : bool,
+        cache_path : str = None, cache_size : int = 2048, node_workers : int = 0, jobs : int = None, watch_mode : bool = False, trace_path : str = None,
+        workspace_path : str = None, resume_run_id : str = None, max_scratch : int = 0):
     start_time = time.time()
 
     if not os.path.exists(final_output_path):    
@@ -27,267 +49,1045 @@ def run(base_model_input_path : str, final_output_path : str, config_file : str,
 #----------------------------------------------
     # Initialize
 
-    # Read config JSON
-    with open(config_file, 'r') as file:
-        config = parse_config(json.load(file))
+    # Read config JSON, every key is validated
+    try:
+        config = load_config(config_file)
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(2)
+
+    # Check the tools before any work, a missing tool fails the run here
+    node_workers = preflight_tools(config, node_workers, cache_path)
 
     # Check target base models
-    target_file_paths = get_all_file_paths(base_model_input_path, ['glb', 'gltf'], True)
-    if not target_file_paths:
+    target_file_paths = get_model_paths(base_model_input_path)
+    if not target_file_paths and not watch_mode:
         print("At least 1 model file(glb/gltf) is required.")
         sys.exit(2)
+    print("preflight: {} models, {:.0f} ms".format(len(target_file_paths), (time.time() - start_time) * 1000))
 
-#----------------------------------------------
-    # Check if the file already exists in the output folder. In update mode 
-    if update_mode:
-        target_file_paths = get_not_exist_file_paths(config, target_file_paths, final_output_path)
-        if len(target_file_paths) == 0:
-            print("All modeling already exists in the output path. Clear --update to run nonetheless")
-            sys.exit(2)
+    # Encoded textures are reused across runs unless the cache is disabled
+    cache = None
+    budgets = None
+    if cache_path:
+        cache = TextureCache(cache_path, cache_size * 1024 * 1024)
+        budgets = BudgetCache(cache_path)
 
-    print("\n\n-----------------------\n")
-    for file_path in target_file_paths:
-        print("{}".format(file_path))
-    print("\n-----------------------\n\n")
+    # gltf-pipeline / gltf-transform run in warm node processes, or through the CLI when node_workers is 0
+    node_pool = NodeWorkerPool(node_workers)
+
+    # A resumed run continues in the workspace of the run id, see journal.py
+    if resume_run_id and not os.path.isdir(os.path.join(workspace_path or get_workspace_root_path(), resume_run_id)):
+        print("No workspace of the run {} in {}".format(resume_run_id, workspace_path or get_workspace_root_path()))
+        sys.exit(2)
+
+    runtime = Runtime(ResourceExecutor(jobs), cache, node_pool, trace_path, workspace_path, resume_run_id, max_scratch * 1024 * 1024, budgets)
 
 #----------------------------------------------
-    # Create paths
-    dir = Directory(config.texture_settings)
+    # Build
+    status = UP_TO_DATE
+    if target_file_paths:
+        status = build(runtime, config, base_model_input_path, final_output_path, target_file_paths, target_file_paths, update_mode)
+
+    # Keep the workers and the cache, and rebuild the models changed in the input path
+    if watch_mode:
+        watch_models(runtime, config_file, config, base_model_input_path, final_output_path)
+
+    runtime.close()
+
+    # The failed tasks and the resume hint are printed by build, the exit code tells scripts the run failed
+    if status == BUILD_FAILED and not watch_mode:
+        sys.exit(1)
+
+    if status == UP_TO_DATE and not watch_mode:
+        print("All modeling is up to date in the output path. Clear --update to run nonetheless")
+        sys.exit(2)
+
+#--------------------------------------------
+    # Print total time
+    end_time = time.time()
+    execution_time = end_time - start_time
+    print("total execution time: {:.2f}s".format(execution_time))
+
+def load_config(config_file : str) -> Config:
+    with open(config_file, 'r') as file:
+        return parse_config(json.load(file))
+
+# Resolve and probe the tools config calls, see preflight.py. Exits when one is missing,
+# returns the node workers to start : none without node.
+def preflight_tools(config : Config, node_workers : int, cache_path : str) -> int:
+    tools = preflight.discover(preflight.required_tools(config, node_workers), cache_path)
+    errors = preflight.tool_errors(tools)
+    if errors:
+        print("Required tools are missing:\n  " + "\n  ".join(errors))
+        sys.exit(2)
+    print("tools: {}".format(preflight.summary(tools)))
+    if "node" in tools and not tools["node"].ok:
+        print("node: {}".format(tools["node"].error))
+        return 0
+    return node_workers
+
+model_extensions = ['.glb', '.gltf']
+def get_model_paths(base_model_input_path : str) -> List[str]:
+    return get_all_file_paths(base_model_input_path, model_extensions, True)
+
+#--------------------------------------------
+# Results of build
+UP_TO_DATE = 0
+BUILT = 1
+BUILD_FAILED = 2
+
+# Build target_file_paths into final_output_path. all_file_paths are every model of the input path,
+# the outputs of other models are removed in update mode. Returns UP_TO_DATE when there was nothing to build,
+# BUILD_FAILED when a task failed and BUILT otherwise.
+# plans : the units to build when already known, e.g. a work unit of --worker, see get_build_plans
+# resumable : a build with failed tasks keeps its workspace and publishes nothing, so that --resume completes it.
+# Otherwise the outputs built are published and the workspace is removed.
+def build(runtime : Runtime, config : Config, base_model_input_path : str, final_output_path : str,
+          target_file_paths : List[str], all_file_paths : List[str], update_mode : bool, forced_file_paths = (), plans = None,
+          resumable : bool = True) -> int:
+    build_start_time = time.time()
 
 #----------------------------------------------
-    # Convert base file to texture-separated gltf with base folder path
-    copy_models(config, dir, target_file_paths)
+    # Find the units to build. In update mode, only the models whose source, settings or outputs
+    # changed since the build recorded in the manifest of the output folder
+    manifest = BuildManifest(final_output_path, base_model_input_path)
+    if plans is None:
+        plans = get_build_plans(config, manifest, target_file_paths, update_mode, forced_file_paths)
+    if not plans:
+        if update_mode:
+            remove_orphan_outputs(config, manifest, all_file_paths)
+        manifest.save()
+        return UP_TO_DATE
 
 #----------------------------------------------
-    # Optimize Texture
-    optimize_textures(config, dir)
-    
+    # Create paths
+    # Only the first build of the process resumes a workspace
+    dir = Directory(config.texture_settings, runtime.workspace_path, runtime.resume_run_id)
+    runtime.resume_run_id = None
+
+    print("\n\n-----------------------\n")
+    print("run {}".format(dir.run_id))
+    for file_path, (source_hash, model_settings) in plans.items():
+        print("{} {}".format(file_path, " ".join(model_setting.suffix for model_setting in model_settings)))
+    print("\n-----------------------\n\n")
+
+    published = False
+    failed_tasks = []
+    try:
 #----------------------------------------------
-    # Optimize Mesh
-    optimize_models(config, dir)
-    
+        # Convert base file to texture-separated gltf with base folder path,
+        # then optimize its textures and meshes as soon as it is converted.
+        # The units completed by a previous run of the workspace are skipped.
+        journal = Journal(dir.workspace)
+        runtime.begin(manifest, update_mode, TextureRegistry(), journal)
+        copy_models(runtime, config, dir, plans)
+        failed_tasks = runtime.scheduler.run()
+
+        for task in failed_tasks:
+            journal.failed(task.name, str(task.error))
+        print(journal.summary())
+
+        if failed_tasks:
+            print("{} tasks failed".format(len(failed_tasks)))
+
+        print(texture_dedup_summary(runtime, dir))
+        if any(texture_setting.analyze for texture_setting in config.texture_settings):
+            print(runtime.textures.analysis_summary([texture_tier_name(texture_path) for texture_path in dir.texture]))
+
+        if not failed_tasks or not resumable:
 #--------------------------------------------
-    # Remove unnecessary assets
-    remove_unnecessary_assets(dir.workspace, False)
-    remove_directory(dir.base_model)
+            # Record the units whose outputs were produced
+            manifest.commit()
+
+            # Remove unnecessary assets
+            remove_unnecessary_assets(dir.workspace, False)
+            remove_directory(dir.base_model)
+            remove_directory(dir.images)
 
 #--------------------------------------------
-    # Move output path
+            # Move output path
+            with tracer.span("publish", os.path.basename(final_output_path)):
+                publish_workspace(config, dir, final_output_path, update_mode)
+            published = True
+    finally:
+        # A workspace on tmpfs holds memory until it is removed
+        if published or not resumable:
+            shutil.rmtree(dir.workspace, ignore_errors=True)
+        else:
+            print("The workspace {} is kept, complete the run with --resume {}".format(dir.workspace, dir.run_id))
 
-    for file_path in os.listdir(dir.workspace):
-        path = Path(file_path)
-        if path.suffix and not (path.suffix in config.output_exts):
-            continue
-           
-        source_file_path = os.path.join(dir.workspace, file_path)
-        destination_file_path = os.path.join(final_output_path, file_path)
-        if os.path.exists(destination_file_path):
-            if os.path.isdir(destination_file_path):
-                shutil.rmtree(destination_file_path)
-            elif os.path.isfile(destination_file_path):
-                os.remove(destination_file_path)
+    if published:
+        if update_mode:
+            remove_orphan_outputs(config, manifest, all_file_paths)
+        asset_manifest.write_asset_manifests(config, manifest, texture_dir_names(config))
+        manifest.save()
+
+    if runtime.cache:
+        runtime.cache.evict()
+        print(runtime.cache.summary())
+    if runtime.scratch.enabled:
+        print(runtime.scratch.summary())
+    print(runtime.executor.summary())
+    print(tracer.summary())
+    if runtime.trace_path:
+        tracer.write(runtime.trace_path)
+        print("trace written to {}".format(runtime.trace_path))
+    print("build time: {:.2f}s".format(time.time() - build_start_time))
 
-        shutil.move(source_file_path, destination_file_path)
+    return BUILD_FAILED if failed_tasks else BUILT
 
-    shutil.rmtree(dir.workspace)
+# Move the outputs of the workspace to the output path.
+# The outputs are first staged in a folder of the output path, so that they are published by renames on one
+# file system even when the workspace is elsewhere (e.g. tmpfs). Files are replaced one by one, a tier folder
+# of a full build is swapped as a whole, and in update mode the textures built are added to the existing tier folder.
+def publish_workspace(config : Config, dir : Directory, final_output_path : str, update_mode : bool):
+    staging_path = os.path.join(final_output_path, ".gltf-optimizer-staging-{}".format(dir.run_id))
+    make_directory(staging_path)
+
+    try:
+        names = []
+        for file_path in os.listdir(dir.workspace):
+            path = Path(file_path)
+            if path.suffix and not (path.suffix in config.output_exts):
+                continue
+            shutil.move(os.path.join(dir.workspace, file_path), os.path.join(staging_path, file_path))
+            names.append(file_path)
+
+        for file_path in names:
+            source_file_path = os.path.join(staging_path, file_path)
+            destination_file_path = os.path.join(final_output_path, file_path)
+
+            if os.path.isfile(source_file_path):
+                if os.path.isdir(destination_file_path):
+                    shutil.rmtree(destination_file_path)
+                os.replace(source_file_path, destination_file_path)
+                continue
+
+            if update_mode and os.path.isdir(destination_file_path):
+                for file_name in os.listdir(source_file_path):
+                    os.replace(os.path.join(source_file_path, file_name), os.path.join(destination_file_path, file_name))
+                continue
+
+            if os.path.isfile(destination_file_path):
+                os.remove(destination_file_path)
+            swap_directory(source_file_path, destination_file_path)
+    finally:
+        shutil.rmtree(staging_path, ignore_errors=True)
 
 #--------------------------------------------
-    # Print total time
-    end_time = time.time()
-    execution_time = end_time - start_time
-    print("total execution time: {:.2f}s".format(execution_time))
+# Watch mode
+def watch_models(runtime : Runtime, config_file : str, config : Config, base_model_input_path : str, final_output_path : str):
+    base_model_input_path = os.path.abspath(base_model_input_path)
+    config_file = os.path.abspath(config_file)
+    watcher = Watcher([(base_model_input_path, True), (os.path.dirname(config_file), False)],
+                      ignore_paths=[os.path.abspath(final_output_path), runtime.workspace_path or get_workspace_root_path()])
+    print("watching {} for changes ({} backend, Ctrl+C to stop)".format(base_model_input_path, watcher.backend))
+
+    try:
+        while True:
+            changed_paths = watcher.wait()
+
+            forced_file_paths = []
+            all_file_paths = None
+            if config_file in changed_paths:
+                previous_config = config
+                try:
+                    config = load_config(config_file)
+                except (OSError, ValueError) as e:
+                    print("Invalid config, keep the previous one: {}".format(e))
+                    continue
+                # The new settings may call a tool the previous ones did not
+                errors = preflight.tool_errors(preflight.discover(preflight.required_tools(config), runtime.cache.root if runtime.cache else None))
+                if errors:
+                    print("Required tools are missing, keep the previous config:\n  " + "\n  ".join(errors))
+                    config = previous_config
+                    continue
+                # Settings changed, every model is checked against the manifest
+                target_file_paths = all_file_paths = get_model_paths(base_model_input_path)
+            else:
+                target_file_paths, forced_file_paths = get_changed_model_paths(base_model_input_path, changed_paths)
+                # A removed model or folder only needs its outputs removed
+                if not target_file_paths and all(os.path.exists(path) for path in changed_paths):
+                    continue
+
+            if all_file_paths is None:
+                all_file_paths = get_model_paths(base_model_input_path)
+            try:
+                status = build(runtime, config, base_model_input_path, final_output_path, target_file_paths, all_file_paths, True, forced_file_paths, resumable=False)
+                if status == UP_TO_DATE and target_file_paths:
+                    print("{} up to date".format(", ".join(os.path.basename(path) for path in changed_paths)))
+            except Exception as e:
+                # Keep watching, the next change retries the build
+                print("Build failed: {}".format(e))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+# Models touched by changed_paths : the changed model files, and the glTF files next to a changed resource (bin, image).
+# Returns (target paths, forced paths), the second ones are rebuilt even though the glTF itself did not change.
+def get_changed_model_paths(base_model_input_path : str, changed_paths) -> Tuple[List[str], List[str]]:
+    target_file_paths = set()
+    forced_file_paths = set()
+    # Several resources of a folder change together, the folder is listed once
+    resource_folders = set()
+    for path in changed_paths:
+        if not path.startswith(base_model_input_path + os.sep):
+            continue
+        if path.endswith(tuple(model_extensions)):
+            if os.path.isfile(path):
+                target_file_paths.add(path)
+        elif os.path.isdir(os.path.dirname(path)):
+            resource_folders.add(os.path.dirname(path))
+    for folder in resource_folders:
+        forced_file_paths.update(get_all_file_paths(folder, ['.gltf'], False))
+    return sorted(target_file_paths | forced_file_paths), sorted(forced_file_paths)
 
 #--------------------------------------------
+# Distributed mode, see work_queue.py.
+# The coordinator splits the build into units of (model, LOD) and (model, texture tier), workers build
+# each unit on its own into the results of the queue, and the assembly publishes them into the output.
 
-def get_not_exist_file_paths(config, target_base_model_file_paths, final_output_path):
+def coordinate(queue_path : str, base_model_input_path : str, final_output_path : str, config_file : str, update_mode : bool, lease_seconds : float):
+    try:
+        with open(config_file, 'r') as file:
+            config_data = json.load(file)
+        config = parse_config(config_data)
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(2)
 
-    suffixs = []
-    for model_setting in config.model_settings:
-        suffixs.append(model_setting.suffix)
-
-    target_paths = []
-    for file_path in target_base_model_file_paths:
-        file_name = os.path.splitext(os.path.basename(file_path))[0]
-
-        is_not_exist_file = False
-        for ext in config.output_exts:
-            for suffix in suffixs:
-                output_path = "{}/{}{}{}".format(final_output_path, file_name, suffix, ext)
-                if not os.path.exists(output_path):
-                    is_not_exist_file = True
+    all_file_paths = get_model_paths(base_model_input_path)
+    if not all_file_paths:
+        print("At least 1 model file(glb/gltf) is required.")
+        sys.exit(2)
+
+    manifest = BuildManifest(final_output_path, base_model_input_path)
+    units = get_work_units(config, manifest, all_file_paths, update_mode)
+    info = {
+        "input": base_model_input_path,
+        "output": final_output_path,
+        "config": config_data,
+        "update": update_mode,
+        "models": [manifest.model_key(file_path) for file_path in all_file_paths],
+        "lease_seconds": lease_seconds,
+        "max_attempts": 3,
+    }
+    try:
+        WorkQueue(queue_path).create(info, units)
+    except ValueError as e:
+        print(e)
+        sys.exit(2)
+    print("{} work units queued in {}, start workers with --worker {} and finish with --assemble {}".format(len(units), queue_path, queue_path, queue_path))
+
+# One unit per LOD and per texture tier of every model to build
+def get_work_units(config : Config, manifest : BuildManifest, target_file_paths : List[str], update_mode : bool) -> List[dict]:
+    tiers = [(tier, texture_config_hash(texture_setting)) for tier, texture_setting in zip(texture_dir_names(config), config.texture_settings)]
+
+    units = []
+    for file_path, (source_hash, model_settings) in get_build_plans(config, manifest, target_file_paths, update_mode).items():
+        key = manifest.model_key(file_path)
+        for model_setting in model_settings:
+            units.append({"kind": "model", "model": key, "setting": model_setting.suffix})
+        for index, (tier, config_hash) in enumerate(tiers):
+            if update_mode and manifest.are_model_textures_fresh(key, source_hash, {tier: config_hash}):
+                continue
+            units.append({"kind": "texture", "model": key, "setting": index})
+
+    for index, unit in enumerate(units):
+        unit["id"] = "{:06d}".format(index)
+    return units
+
+# Claim and build units until the queue is empty
+def run_worker(queue_path : str, cache_path : str, cache_size : int, node_workers : int, jobs : int, workspace_path : str = None):
+    queue = WorkQueue(queue_path)
+    if not queue.info:
+        print("No queue in {}, create it with --coordinator".format(queue_path))
+        sys.exit(2)
+    config = parse_config(queue.info["config"])
+    # A worker without the tools would fail every unit it claims
+    node_workers = preflight_tools(config, node_workers, cache_path)
+
+    cache = None
+    budgets = None
+    if cache_path:
+        cache = TextureCache(cache_path, cache_size * 1024 * 1024)
+        budgets = BudgetCache(cache_path)
+    runtime = Runtime(ResourceExecutor(jobs), cache, NodeWorkerPool(node_workers), workspace_path=workspace_path, budgets=budgets)
+
+    built = 0
+    try:
+        while True:
+            unit = queue.claim()
+            if unit is None:
+                counts = queue.counts()
+                if counts[PENDING] == 0 and counts[LEASED] == 0:
                     break
-        if is_not_exist_file:
-            target_paths.append(file_path)
+                # Units leased by other workers are taken over if their lease expires
+                time.sleep(min(10, queue.lease_seconds / 3))
+                continue
+
+            print("{} builds unit {} ({} {} {})".format(worker_name(), unit["id"], unit["kind"], unit["model"], unit["setting"]))
+            work_path = "{}.{}.tmp".format(queue.result_path(unit["id"]), worker_name().replace(":", "_"))
+            stop = queue.keep_lease(unit["id"])
+            try:
+                build_unit(runtime, config, queue.info, unit, work_path)
+            except Exception as e:
+                shutil.rmtree(work_path, ignore_errors=True)
+                print("Unit {} failed: {}".format(unit["id"], e))
+                queue.fail(unit, str(e))
+                continue
+            finally:
+                stop.set()
+
+            if queue.complete(unit, work_path):
+                built += 1
+            else:
+                print("Lease of unit {} was lost, its outputs are dropped".format(unit["id"]))
+    finally:
+        runtime.close()
+
+    print("{} built {} units, queue: {}".format(worker_name(), built, queue.counts()))
+
+# Build a work unit into work_path, with a config reduced to its LOD or texture tier
+def build_unit(runtime : Runtime, config : Config, info : dict, unit : dict, work_path : str):
+    file_path = os.path.join(info["input"], unit["model"])
+    unit_config = Config(config.output_exts)
+    unit_config.pack_orm = config.pack_orm
+    # The asset manifests are written by assemble, once every unit is merged
+    unit_config.asset_manifest = "none"
+    # Every model setting is kept, the LOD chain and the config hashes depend on them
+    unit_config.model_settings = config.model_settings
+    if unit["kind"] == "model":
+        model_settings = [model_setting for model_setting in config.model_settings if model_setting.suffix == unit["setting"]]
+    else:
+        unit_config.texture_settings = [config.texture_settings[unit["setting"]]]
+        model_settings = []
+
+    make_directory(work_path)
+    plans = {file_path: (model_source_hash(file_path), model_settings)}
+    build(runtime, unit_config, info["input"], work_path, [file_path], [file_path], False, plans=plans, resumable=False)
+
+    failed_tasks = [task.name for task in runtime.scheduler.tasks.values() if task.state == FAILED]
+    if failed_tasks:
+        raise RuntimeError("{} tasks failed: {}".format(len(failed_tasks), ", ".join(failed_tasks)))
+
+# Publish the results of every done unit into the output, with their manifests
+def assemble(queue_path : str):
+    queue = WorkQueue(queue_path)
+    if not queue.info:
+        print("No queue in {}".format(queue_path))
+        sys.exit(2)
+
+    queue.requeue_expired()
+    counts = queue.counts()
+    if counts[PENDING] or counts[LEASED]:
+        print("{} units pending and {} leased, run --worker {} until the queue is empty".format(counts[PENDING], counts[LEASED], queue_path))
+        sys.exit(2)
+
+    info = queue.info
+    config = parse_config(info["config"])
+    final_output_path = info["output"]
+    manifest = BuildManifest(final_output_path, info["input"])
+
+    # Same as publish_workspace, a full build replaces the tier folders
+    if not info["update"]:
+        for tier in texture_dir_names(config):
+            if os.path.isdir(os.path.join(final_output_path, tier)):
+                shutil.rmtree(os.path.join(final_output_path, tier))
+
+    for unit in queue.units(DONE):
+        result_path = queue.result_path(unit["id"])
+        manifest.merge(BuildManifest(result_path, info["input"]))
+        for root, dirs, files in os.walk(result_path):
+            for file_name in files:
+                if file_name == MANIFEST_FILE_NAME:
+                    continue
+                destination_file_path = os.path.join(final_output_path, os.path.relpath(os.path.join(root, file_name), result_path))
+                make_directory(os.path.dirname(destination_file_path))
+                publish_file(os.path.join(root, file_name), destination_file_path)
+
+    if info["update"]:
+        remove_orphan_outputs(config, manifest, [os.path.join(info["input"], key) for key in info["models"]])
+    asset_manifest.write_asset_manifests(config, manifest, texture_dir_names(config))
+    manifest.save()
+
+    # The queue is kept so that the failed units can be inspected
+    failed_units = queue.units(FAILED_UNITS)
+    if failed_units:
+        for unit in failed_units:
+            print("unit {} ({} {} {}) failed: {}".format(unit["id"], unit["kind"], unit["model"], unit["setting"], unit.get("error", "lease expired")))
+        sys.exit(1)
+    shutil.rmtree(queue_path)
+    print("{} units assembled into {}".format(counts[DONE], final_output_path))
+
+#--------------------------------------------
+
+# Returns {model path : (source hash, model settings to build)}
+# forced_file_paths are rebuilt even when their source did not change, e.g. a glTF whose bin or image changed
+def get_build_plans(config : Config, manifest : BuildManifest, target_file_paths : List[str], update_mode : bool, forced_file_paths = ()):
+    tiers = {tier : texture_config_hash(texture_setting) for tier, texture_setting in zip(texture_dir_names(config), config.texture_settings)}
+
+    plans = {}
+    for file_path in target_file_paths:
+        model_hash = model_source_hash(file_path)
+        key = manifest.model_key(file_path)
+
+        model_settings = config.model_settings
+        if update_mode and file_path not in forced_file_paths:
+            model_settings = [model_setting for model_setting in config.model_settings
+                              if not manifest.is_lod_fresh(key, model_hash, model_setting.suffix, lod_config_hash(config, lod_lineage(config.model_settings, model_setting)))]
+            # Up to date LODs, but the model is still converted when one of its textures is stale
+            if not model_settings and manifest.are_model_textures_fresh(key, model_hash, tiers):
+                continue
+
+        plans[file_path] = (model_hash, model_settings)
             
-    return target_paths
+    return plans
+
+def remove_orphan_outputs(config : Config, manifest : BuildManifest, target_file_paths : List[str]):
+    model_keys = [manifest.model_key(file_path) for file_path in target_file_paths]
+    suffixes = [model_setting.suffix for model_setting in config.model_settings]
+    count = asset_manifest.remove_asset_manifests(manifest.output_path, [key for key in manifest.models if key not in model_keys])
+    count += manifest.remove_orphans(model_keys, suffixes, texture_dir_names(config))
+    if count > 0:
+        print("removed {} orphaned outputs".format(count))
+
+# Tier folder names, same as Directory
+def texture_dir_names(config : Config) -> List[str]:
+    return [str(texture_setting.max_size) for texture_setting in config.texture_settings]
+
+def texture_tier_name(texture_path : str) -> str:
+    return os.path.basename(texture_path)
  
 #--------------------------------------------
-def contains_substring(string_array, target_string):
-    return any(string in target_string for string in string_array)
+# Task costs used for the critical path order, roughly proportional to the bytes each tool has to process
+def file_cost(path : str, weight : float = 1) -> float:
+    try:
+        return os.path.getsize(path) * weight
+    except OSError:
+        return weight
 
-#--------------------------------------------
-def copy_models(config: Config, dir: Directory, target_file_paths: List[str]):
-     with concurrent.futures.ThreadPoolExecutor() as executor:
-        tasks = [(config, file_path, dir.base_model) for file_path in target_file_paths]
-        futures = [executor.submit(copy_and_convert_gltf, *task) for task in tasks]
-        concurrent.futures.wait(futures)
+model_cost_weight = 2
+texture_cost_weight = 1
+encode_cost_weight = 8
+
+def copy_models(runtime : Runtime, config: Config, dir: Directory, plans):
+    for file_path, (source_hash, model_settings) in plans.items():
+        task_name = "convert:{}".format(file_path)
+        runtime.scheduler.add(task_name, copy_and_convert_gltf, runtime, task_name, config, dir, file_path, source_hash, model_settings, cost=file_cost(file_path),
+                              scratch_estimate=os.path.getsize(file_path) * scratch.estimate_factor)
 
-def copy_and_convert_gltf(config: Config, source: str, dest: str):
+def copy_and_convert_gltf(runtime : Runtime, task_name : str, config: Config, dir: Directory, source: str, source_hash : str, model_settings : List[Config.ModelSetting]):
+    # Each model is extracted in its own folder, so that models converted at the same time never share files
+    dest = os.path.join(dir.base_model, os.path.splitext(os.path.basename(source))[0])
+    make_directory(dest)
     gltf_path = convert_file_path(source, dest, ".gltf")
-    subprocess.run(config.model_settings[0].to_gltf_separate(source, gltf_path), shell=True)
+    if not runtime.journal.is_done(task_name):
+        run_model_command(config.model_settings[0], runtime.node_pool, "to_gltf_separate", source, gltf_path)
+        if config.pack_orm:
+            pack_orm(gltf_path)
+        runtime.journal.done(task_name, [gltf_path] + list(get_gltf_images(gltf_path).values()))
+    runtime.scheduler.add_scratch(task_name, [gltf_path] + list(get_gltf_images(gltf_path).values()))
+
+    # Textures of this model, each unique image is encoded by the first model using it
+    texture_names = {}
+    image_names = []
+    for uri, file_path in get_gltf_images(gltf_path).items():
+        entry, is_new = register_texture(runtime, config, dir, file_path)
+        texture_names[uri] = os.path.splitext(entry.name)[0] + ".ktx2"
+        if entry.name not in image_names:
+            image_names.append(entry.name)
+        if is_new:
+            optimize_textures(runtime, task_name, config, dir, entry)
+
+    key = runtime.manifest.model_key(source)
+    # Converted at this point, the base gltf may be removed before the commit with --max-scratch
+    runtime.manifest.add_pending([], runtime.manifest.set_model_images, key, source_hash, image_names)
+
+    # Meshes of this model
+    optimize_models(runtime, task_name, config, dir, gltf_path, key, source_hash, model_settings, texture_names)
+
+# Pack the occlusion and metallic-roughness images of the materials, before the images are registered
+def pack_orm(gltf_path : str):
+    if not orm.is_available():
+        return
+    with tracer.span("orm", os.path.basename(gltf_path), [gltf_path], [gltf_path]):
+        materials, images, removed = orm.pack_materials(gltf_path)
+    if materials:
+        print("orm {}: {} materials packed into {} images, {} images removed".format(os.path.basename(gltf_path), materials, images, removed))
+
+# Find the unique image of file_path by content, the first image of a content is linked into dir.images.
+# Images are also told apart by the texture settings that encode them in the other format (keywords).
+def register_texture(runtime : Runtime, config : Config, dir : Directory, file_path : str) -> Tuple[TextureEntry, bool]:
+    image_hash = file_hash(file_path)
+    name = texture_file_name(file_path, image_hash)
+    other_formats = tuple(texture_setting.is_other_format(name) for texture_setting in config.texture_settings)
+
+    # Keep the name published by a previous build of the same image, so that update builds reuse its ktx2
+    for known_name in runtime.manifest.texture_names(image_hash):
+        if tuple(texture_setting.is_other_format(known_name) for texture_setting in config.texture_settings) == other_formats:
+            name = known_name
+            break
+
+    image_path = os.path.join(dir.images, name)
+    entry, is_new = runtime.textures.add((image_hash, other_formats), name, image_path, image_hash, os.path.getsize(file_path))
+    if is_new:
+        link_or_copy(file_path, image_path)
+    return entry, is_new
+
+# Bytes of ktx2 and encode seconds of every unique image of the build, by image stem, and the collapsed tier encodes
+def texture_dedup_summary(runtime : Runtime, dir : Directory) -> str:
+    encode_seconds = {}
+    # (seconds, count) of the toktx calls of every unique image
+    toktx_seconds = {}
+    for span in tracer.spans:
+        if span["stage"] in ("analyze", "resize", "copy", "mogrify", "toktx"):
+            stem = os.path.splitext(os.path.basename(span["asset"]))[0]
+            encode_seconds[stem] = encode_seconds.get(stem, 0) + span["duration"]
+        if span["stage"] == "toktx":
+            seconds, count = toktx_seconds.get(stem, (0, 0))
+            toktx_seconds[stem] = (seconds + span["duration"], count + 1)
+
+    output_bytes = {}
+    for texture_path in dir.texture:
+        for file_name in os.listdir(texture_path):
+            stem = os.path.splitext(file_name)[0]
+            output_bytes[stem] = output_bytes.get(stem, 0) + os.path.getsize(os.path.join(texture_path, file_name))
+
+    return runtime.textures.summary(encode_seconds, output_bytes) + "\n" + runtime.textures.tier_summary(toktx_seconds)
+
+#--------------------------------------------
+# gltf-pipeline command of ModelSetting (to_glb, to_glb_separate, to_gltf_separate)
+def run_model_command(model_setting : Config.ModelSetting, node_pool : NodeWorkerPool, command : str, src : str, dst : str):
+    if node_pool.enabled:
+        with tracer.span("node:{}".format(command), os.path.basename(dst), [src], [dst]) as record:
+            try:
+                if node_pool.pipeline(command, src, dst, tracer.timeout):
+                    return
+            except ToolError:
+                record["exit_code"] = "timeout"
+                raise
+            record["exit_code"] = "fallback"
+    tracer.run(command, os.path.basename(dst), getattr(model_setting, command)(src, dst), [src], [dst])
+
+# gltf-transform commands of ModelSetting (weld, simplify, draco, meshopt), applied in order from src to dst
+def run_model_transforms(model_setting : Config.ModelSetting, node_pool : NodeWorkerPool, commands : List[str], src : str, dst : str):
+    steps = [(command, getattr(model_setting, "{}_options".format(command))()) for command in commands]
+    if node_pool.enabled:
+        with tracer.span("node:{}".format("+".join(commands)), os.path.basename(dst), [src], [dst]) as record:
+            try:
+                if node_pool.transform(src, dst, steps, tracer.timeout):
+                    return
+            except ToolError:
+                record["exit_code"] = "timeout"
+                raise
+            record["exit_code"] = "fallback"
+    for command in commands:
+        tracer.run(command, os.path.basename(dst), getattr(model_setting, command)(src, dst), [src], [dst])
+        src = dst
+
+# Weld with the engine of model_setting, the numpy engine falls back to gltf-transform for the files it does not support
+def weld_model(model_setting : Config.ModelSetting, node_pool : NodeWorkerPool, src : str, dst : str):
+    if model_setting.weld_engine == "numpy" and mesh.is_available():
+        with tracer.span("weld:numpy", os.path.basename(dst), [src], [dst]) as record:
+            try:
+                mesh.weld_glb(src, dst, model_setting.tolerance)
+                return
+            except mesh.MeshError as e:
+                print("numpy weld of {} is not possible ({}), gltf-transform is used".format(os.path.basename(src), e))
+                record["exit_code"] = "fallback"
+    run_model_transforms(model_setting, node_pool, ["weld"], src, dst)
 
 #--------------------------------------------
-def optimize_textures(config : Config, dir : Directory):
-    index = 0
-    for texture_setting in config.texture_settings:
+def optimize_textures(runtime : Runtime, dep_name : str, config : Config, dir : Directory, entry : TextureEntry):
+    task_name = "texture:{}".format(entry.name)
+    cost = file_cost(entry.path, texture_cost_weight + encode_cost_weight * len(config.texture_settings))
+    # Mostly cache lookups, unless the image is decoded for its content analysis
+    kind = CPU if any(texture_setting.analyze for texture_setting in config.texture_settings) else IO
+    runtime.scheduler.add(task_name, optimize_texture, runtime, task_name, config, dir, entry, deps=[dep_name], cost=cost, kind=kind, scratch=[entry.path])
+
+def optimize_texture(runtime : Runtime, task_name : str, config : Config, dir : Directory, entry : TextureEntry):
+    file_path = entry.path
+    image_hash = entry.image_hash
+    name = entry.name
+
+    # Settings of every tier for the content of the image
+    png_paths = [convert_file_path(file_path, texture_path, ".png") for texture_path in dir.texture]
+    if any(texture_setting.analyze for texture_setting in config.texture_settings):
+        with tracer.span("analyze", name, [file_path]):
+            entry.texture_settings = analysis.effective_settings(config.texture_settings, file_path, png_paths)
+    else:
+        entry.texture_settings = list(config.texture_settings)
+
+    # Tiers to build, grouped by the ktx2 they produce : {(target size, encode parameters) : [tier index]}.
+    # The shrink-only resize gives a small image the same size in several tiers.
+    size = texture.image_size(file_path)
+    groups : Dict[tuple, List[int]] = {}
+    for index, texture_setting in enumerate(config.texture_settings):
         texture_path = dir.texture[index]
-        texture_file_paths = get_all_image_paths(dir.base_model, False)
-        
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            # Texture Copy
-            copy_tasks = [(file_path, texture_path) for file_path in texture_file_paths]
-            copy_futures = [executor.submit(texture_copy, *task) for task in copy_tasks]
-            concurrent.futures.wait(copy_futures)
-            
-            # Texture Resize
-            resize_tasks = [(texture_setting, file_path, texture_path) for file_path in texture_file_paths]
-            resize_futures = [executor.submit(texture_resize, *task) for task in resize_tasks]
-            concurrent.futures.wait(resize_futures)
-            
-            # Texture Convert KTX2
-            convert_tasks = [(texture_setting, texture_path, file_path) for file_path in get_all_file_paths(texture_path, [".png"], False)]
-            convert_futures = [executor.submit(to_ktx, *task) for task in convert_tasks]
-            concurrent.futures.wait(convert_futures)
+        tier = texture_tier_name(texture_path)
+        key = "{}/{}".format(tier, name)
+        config_hash = texture_config_hash(texture_setting)
+
+        # Unchanged texture already in the output folder
+        if runtime.update_mode and runtime.manifest.is_texture_fresh(key, image_hash, config_hash):
+            continue
+
+        ktx_path = convert_file_path(file_path, texture_path, ".ktx2")
+        artifact = "{}/{}".format(tier, os.path.basename(ktx_path))
+        runtime.manifest.add_pending([ktx_path], runtime.manifest.set_texture, key, image_hash, config_hash, [artifact])
+
+        # Encoded by the run this one resumes
+        if runtime.journal.is_done(ktx_task_name(index, file_path, texture_path)):
+            record_files(runtime, runtime.journal.units[ktx_task_name(index, file_path, texture_path)]["files"], texture_metrics(entry.texture_settings[index], png_paths[index]))
+            continue
+
+        other_format = texture_setting.is_other_format(png_paths[index])
+        effective = entry.texture_settings[index]
+        savings = analysis.tier_savings(texture_setting, effective, size, other_format) if size else None
+        if savings:
+            entry.savings[index] = savings
+        groups.setdefault(texture.tier_key(effective, index, size, other_format), []).append(index)
 
-        index += 1
+    # One encode per group, {tier index to encode : tier indices its ktx2 is linked into}
+    targets : Dict[int, List[int]] = {}
+    for indices in groups.values():
+        # Textures already in the cache are linked into the tier folders
+        cached = None
+        if runtime.cache:
+            cached = next((index for index in indices if fetch_cached_texture(entry.texture_settings[index], runtime.cache, image_hash, file_path, dir.texture[index])), None)
+            runtime.cache.count_lookup(cached is not None)
+        if cached is not None:
+            for index in indices:
+                if index != cached:
+                    link_tier_texture(file_path, dir.texture[cached], dir.texture[index])
+            # The linked tiers have the content of the cached one
+            ktx_paths = [convert_file_path(file_path, dir.texture[index], ".ktx2") for index in indices]
+            checksum = file_hash(ktx_paths[0])
+            record_files(runtime, {os.path.relpath(ktx_path, dir.workspace): checksum for ktx_path in ktx_paths},
+                         texture_metrics(entry.texture_settings[cached], png_paths[cached]))
+            continue
+
+        targets[indices[0]] = indices[1:]
+        entry.collapsed += len(indices) - 1
+
+    if targets:
+        resize_task_name = "resize:{}".format(file_path)
+        cost = file_cost(file_path, texture_cost_weight + encode_cost_weight * len(targets))
+        runtime.scheduler.add(resize_task_name, resize_texture, runtime, resize_task_name, dir, entry, targets, deps=[task_name], cost=cost,
+                              scratch=[file_path] + [png_paths[index] for index in targets])
+
+# targets : {tier index to encode : tier indices its ktx2 is linked into}
+def resize_texture(runtime : Runtime, task_name : str, dir : Directory, entry : TextureEntry, targets : Dict[int, List[int]]):
+    file_path = entry.path
+
+    # Texture Resize, every tier of an image at once
+    prepare_texture(entry.texture_settings, dir, file_path, list(targets))
+
+    # Texture Convert KTX2
+    threads = runtime.scheduler.executor.toktx_threads
+    for index, aliases in targets.items():
+        texture_setting = entry.texture_settings[index]
+        texture_path = dir.texture[index]
+        png_path = convert_file_path(file_path, texture_path, ".png")
+        alias_tiers = [(alias, entry.texture_settings[alias], dir.texture[alias]) for alias in aliases]
+        # A budget runs its trials at once
+        parallel = budget_parallel(runtime) if texture_setting.target_bytes else 1
+        runtime.scheduler.add(ktx_task_name(index, file_path, texture_path), encode_texture, runtime, index, texture_setting, texture_path, entry, threads, alias_tiers, parallel,
+                              deps=[task_name], cost=file_cost(png_path, encode_cost_weight) * parallel, threads=threads * parallel, scratch=[png_path])
+
+# Task, and journal unit, of the ktx2 of file_path in the tier index
+def ktx_task_name(index : int, file_path : str, texture_path : str) -> str:
+    return "ktx:{}:{}".format(index, convert_file_path(file_path, texture_path, ".png"))
+
+# Write the resized png of the tiers in targets, texture_settings : the settings of every tier for the image
+def prepare_texture(texture_settings : List[Config.TextureSetting], dir : Directory, file_path : str, targets : List[int]):
+    if texture.is_available():
+        png_paths = {index: convert_file_path(file_path, dir.texture[index], ".png") for index in targets}
+        try:
+            with tracer.span("resize", os.path.basename(file_path), [file_path], png_paths.values()):
+                texture.build_pyramid(texture_settings, file_path, png_paths)
+            return
+        except OSError as e:
+            print("Failed to resize {} in process, fallback to imagemagick: {}".format(file_path, e))
+
+    for index in targets:
+        texture_copy(file_path, dir.texture[index])
+        texture_resize(texture_settings[index], file_path, dir.texture[index])
+
+# alias_tiers : (tier index, texture setting, tier folder) of the tiers with the same ktx2, it is linked into them
+def encode_texture(runtime : Runtime, index : int, texture_setting : Config.TextureSetting, texture_path : str, entry : TextureEntry, threads : int,
+                   alias_tiers : List[Tuple[int, Config.TextureSetting, str]] = (), parallel : int = 1):
+    cache, journal = runtime.cache, runtime.journal
+    if texture_setting.target_bytes:
+        tune_texture(runtime, texture_setting, texture_path, entry, threads, parallel)
+    else:
+        to_ktx(texture_setting, texture_path, convert_file_path(entry.path, texture_path, ".png"), threads)
+
+    for alias, alias_setting, alias_path in alias_tiers:
+        link_tier_texture(entry.path, texture_path, alias_path)
+
+    # Store new encodes
+    if cache:
+        store_cached_texture(texture_setting, cache, entry.image_hash, entry.path, texture_path)
+        for alias, alias_setting, alias_path in alias_tiers:
+            store_cached_texture(alias_setting, cache, entry.image_hash, entry.path, alias_path)
+
+    metrics = texture_metrics(texture_setting, convert_file_path(entry.path, texture_path, ".png"))
+    for tier, tier_path in [(index, texture_path)] + [(alias, alias_path) for alias, alias_setting, alias_path in alias_tiers]:
+        record_files(runtime, journal.done(ktx_task_name(tier, entry.path, tier_path), [convert_file_path(entry.path, tier_path, ".ktx2")]), metrics)
+
+# Record the size, checksum and metrics of the files of a unit for the asset manifests, see asset_manifest.py.
+# checksums : {path relative to the workspace : sha256}, metrics(path) : the metrics of a file or None
+def record_files(runtime : Runtime, checksums : Dict[str, str], metrics = None):
+    for artifact, checksum in checksums.items():
+        path = os.path.join(runtime.journal.workspace, artifact)
+        runtime.manifest.add_pending([path], runtime.manifest.set_file, artifact, asset_manifest.file_stats(path, checksum, metrics(path) if metrics else None))
+
+# Metrics of the ktx2 of a tier, png_path : the resized png matched against the keywords
+def texture_metrics(texture_setting : Config.TextureSetting, png_path : str):
+    encode_format = texture_setting.encode_format(texture_setting.is_other_format(png_path))
+    return lambda path: asset_manifest.ktx2_stats(path, encode_format)
+
+def lod_metrics(path : str) -> dict:
+    return asset_manifest.lod_stats(path) if path.endswith(".glb") else None
+
+# Link the ktx2 of file_path in the tier folder texture_path into the tier folder alias_path
+def link_tier_texture(file_path : str, texture_path : str, alias_path : str):
+    link_or_copy(convert_file_path(file_path, texture_path, ".ktx2"), convert_file_path(file_path, alias_path, ".ktx2"))
+
+#--------------------------------------------
+def texture_cache_key(texture_setting : Config.TextureSetting, cache : TextureCache, image_hash : str, file_path : str, texture_path : str) -> str:
+    # The keyword match is made on the resized png name, same as to_ktx
+    copy_path = convert_file_path(file_path, texture_path, ".png")
+    return cache.key(texture_setting, image_hash, texture_setting.is_other_format(copy_path))
+
+def fetch_cached_texture(texture_setting : Config.TextureSetting, cache : TextureCache, image_hash : str, file_path : str, texture_path : str) -> bool:
+    ktx_path = convert_file_path(file_path, texture_path, ".ktx2")
+    return cache.fetch(texture_cache_key(texture_setting, cache, image_hash, file_path, texture_path), ktx_path)
+
+def store_cached_texture(texture_setting : Config.TextureSetting, cache : TextureCache, image_hash : str, file_path : str, texture_path : str):
+    ktx_path = convert_file_path(file_path, texture_path, ".ktx2")
+    # toktx failed, nothing to remember
+    if not os.path.exists(ktx_path):
+        return
+    cache.store(texture_cache_key(texture_setting, cache, image_hash, file_path, texture_path), ktx_path)
       
 #--------------------------------------------
-command_copy_to_dest = "cp {} {}"
 def texture_copy(file_path : str, texture_path : str):
     copy_path = convert_file_path(file_path, texture_path, ".png")
-    subprocess.run(command_copy_to_dest.format(file_path, copy_path), shell=True)
+    tracer.run("copy", os.path.basename(copy_path), ["cp", file_path, copy_path], [file_path], [copy_path])
 
 #--------------------------------------------
 def texture_resize(texture_setting : Config.TextureSetting, file_path : str, texture_path : str):
     copy_path = convert_file_path(file_path, texture_path, ".png")
-    subprocess.run(texture_setting.resize(copy_path), shell=True)
-    subprocess.run(texture_setting.resize_scale(copy_path), shell=True)
+    # The resize task holds a single core
+    asset = "{}/{}".format(texture_tier_name(texture_path), os.path.basename(copy_path))
+    tracer.run("mogrify", asset, texture_setting.resize(copy_path, 1), [copy_path], [copy_path])
+    tracer.run("mogrify", asset, texture_setting.resize_scale(copy_path, 1), [copy_path], [copy_path])
 
 #--------------------------------------------
-def to_ktx(texture_setting : Config.TextureSetting, texture_path : str, file_path : str):
+def to_ktx(texture_setting : Config.TextureSetting, texture_path : str, file_path : str, threads : int = 0):
     ktx_path = convert_file_path(file_path, texture_path, ".ktx2")
-    if texture_setting.keywords and contains_substring(texture_setting.keywords, file_path): # LightMap
-        subprocess.run(texture_setting.to_ktx_other(file_path, ktx_path), shell=True)
-    else: 
-        subprocess.run(texture_setting.to_ktx(file_path, ktx_path), shell=True)
+    asset = "{}/{}".format(texture_tier_name(texture_path), os.path.basename(ktx_path))
+    try:
+        if texture_setting.is_other_format(file_path): # LightMap
+            tracer.run("toktx", asset, texture_setting.to_ktx_other(file_path, ktx_path, threads), [file_path], [ktx_path])
+        else: 
+            tracer.run("toktx", asset, texture_setting.to_ktx(file_path, ktx_path, threads), [file_path], [ktx_path])
+    finally:
+        # The png is never published, even when toktx failed
+        os.remove(file_path)
 
-    os.remove(file_path)
+# Texture with target_bytes : the highest quality whose ktx2 fits in the budget, every trial encodes the png
+# to its own ktx2 next to the chosen one
+def tune_texture(runtime : Runtime, texture_setting : Config.TextureSetting, texture_path : str, entry : TextureEntry, threads : int, parallel : int):
+    png_path = convert_file_path(entry.path, texture_path, ".png")
+    ktx_path = convert_file_path(entry.path, texture_path, ".ktx2")
+    asset = "{}/{}".format(texture_tier_name(texture_path), os.path.basename(ktx_path))
+    other_format = texture_setting.is_other_format(png_path)
+
+    candidates = texture_setting.budget_settings(other_format)
+    budget_key = settings_hash(entry.image_hash, texture_config_hash(texture_setting), other_format)
+    cached = runtime.budgets.get(budget_key) if runtime.budgets else None
+    if cached:
+        candidates = [replace(texture_setting, **cached)]
+
+    trial_paths = {}
+    def trial(index : int) -> int:
+        trial_paths[index] = convert_file_path(entry.path, texture_path, "_budget{}.ktx2".format(index))
+        candidate = candidates[index]
+        command = candidate.to_ktx_other if other_format else candidate.to_ktx
+        tracer.run("toktx", asset, command(png_path, trial_paths[index], threads), [png_path], [trial_paths[index]])
+        return os.path.getsize(trial_paths[index])
+
+    try:
+        index, sizes = budget_search(len(candidates), trial, texture_setting.target_bytes, parallel)
+        os.replace(trial_paths.pop(index), ktx_path)
+    finally:
+        for trial_path in trial_paths.values():
+            if os.path.exists(trial_path):
+                os.remove(trial_path)
+        # The png is never published, even when toktx failed
+        os.remove(png_path)
+
+    chosen = candidates[index]
+    if runtime.budgets and not cached:
+        runtime.budgets.put(budget_key, {"qlevel": chosen.qlevel, "uastc_rdo_l": chosen.uastc_rdo_l})
+    quality = "uastc_rdo_l {}".format(chosen.uastc_rdo_l) if chosen.encode_format(other_format) == 'uastc' else "qlevel {}".format(chosen.qlevel)
+    print("budget {}: {}, {:.1f} KB of {:.1f} KB ({} trials)".format(asset, quality, sizes[index] / 1024, texture_setting.target_bytes / 1024, len(sizes)))
 
 #--------------------------------------------
 
-def optimize_models(config: Config, dir: Directory):
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = []
-
-        for model_setting in config.model_settings:
-            file_paths = get_all_file_paths(dir.base_model, [".gltf"], False)
-            for file_path in file_paths:
-                future = executor.submit(
-                    optimize_model, model_setting, dir, file_path
-                )
-                futures.append(future)
-
-        concurrent.futures.wait(futures)
-
-def optimize_model(model_setting : Config.ModelSetting, dir : Directory, file_path : str):
-    command_move_to_dest = "mv {} {}"
-
-    copy_to_glb_path = convert_file_path(file_path, dir.workspace, "{}.glb".format(model_setting.suffix))
-    subprocess.run(model_setting.to_glb(file_path, copy_to_glb_path), shell=True)
-
-    with open(file_path, 'r') as file:
-        gltf_data = json.load(file)
-
-    buffers = gltf_data.get("buffers", [])
-    if len(buffers) > 0:
-    #--------------------------------------------
-        # Remember value before optimize
-        extensionsUsed = gltf_data.get("extensionsUsed", [])
-        extensionsRequired = gltf_data.get("extensionsRequired", [])
-        
-        samplers = gltf_data.get("samplers", [])
-        textures = gltf_data.get("textures", [])
-        materials = gltf_data.get("materials", [])
-
-    #--------------------------------------------
-        # optimize process
-        if model_setting.tolerance != -1: 
-            subprocess.run(model_setting.weld(copy_to_glb_path, copy_to_glb_path), shell=True)
-
-        if model_setting.ratio != -1:
-            subprocess.run(model_setting.simplify(copy_to_glb_path, copy_to_glb_path), shell=True)
-
-        extensionsUsed.append("KHR_draco_mesh_compression")
-        extensionsRequired.append("KHR_draco_mesh_compression")
-        subprocess.run(model_setting.draco(copy_to_glb_path, copy_to_glb_path), shell=True)
-
-    #--------------------------------------------
-        # post process
-        copy_to_gltf_path = convert_file_path(file_path, dir.workspace, "{}.gltf".format(model_setting.suffix))
-        subprocess.run(model_setting.to_gltf_separate(copy_to_glb_path, copy_to_gltf_path), shell=True)
-
-        with open(copy_to_gltf_path, 'r') as file:
-            gltf_data = json.load(file)
-
-        # Change the texture to the ktx2 extension in the finally created gltf and register the extension.
-        extensionsUsed.append("KHR_texture_basisu")
-        extensionsRequired.append("KHR_texture_basisu")
-        images = gltf_data.get("images", [])
-        for image in images:
-            image["mimeType"] = "image/ktx2"
-            uri = image["uri"]
-            path, name = os.path.split(uri)
-            new_name = os.path.splitext(name)[0] + ".ktx2"
-            image["uri"] = os.path.join(path, new_name) 
-
-        # KHR_draco_mesh_compression and KHR_texture_basisu are added to the extension defined in the original..
-        gltf_data["extensionsUsed"] = extensionsUsed
-        gltf_data["extensionsRequired"] = extensionsRequired
-
-        # When optimizing through gltf-transform, sampler, texture, and material 
-        # that are judged not to be used in the gltf official schema are removed. 
-        # Lightmap or texuture defined in extended implementation may also be omitted, 
-        # so the previous value is restored.
-        gltf_data["samplers"] = samplers
-        gltf_data["textures"] = textures
-        gltf_data["materials"] = materials
-
-        with open(copy_to_gltf_path, 'w') as file:
-            json.dump(gltf_data, file, indent=4)
-    else:
-        copy_to_gltf_path = convert_file_path(file_path, dir.workspace, "{}.gltf".format(model_setting.suffix))
-        subprocess.run(model_setting.to_gltf_separate(copy_to_glb_path, copy_to_gltf_path), shell=True)
+# texture_names : {image uri of the model : ktx2 file name of its unique image}
+def optimize_models(runtime : Runtime, dep_name : str, config: Config, dir: Directory, file_path : str, key : str, source_hash : str,
+                    model_settings : List[Config.ModelSetting], texture_names : Dict[str, str]):
+    # Every LOD to build is recorded, the ones a resumed run already built are not built again
+    for model_setting in model_settings:
+        output_paths = [convert_file_path(file_path, dir.workspace, "{}{}".format(model_setting.suffix, ext)) for ext in config.output_exts]
+        runtime.manifest.add_pending(output_paths, runtime.manifest.set_lod, key, source_hash, model_setting.suffix,
+                                     lod_config_hash(config, lod_lineage(config.model_settings, model_setting)), [os.path.basename(path) for path in output_paths])
+    resumed = [model_setting for model_setting in model_settings if runtime.journal.is_done(model_task_name(model_setting, file_path))]
+    for model_setting in resumed:
+        record_files(runtime, runtime.journal.units[model_task_name(model_setting, file_path)]["files"], lod_metrics)
+    model_settings = [model_setting for model_setting in model_settings if model_setting not in resumed]
+
+    # Only the textures of the model are built, e.g. a texture work unit
+    if not model_settings:
+        return
+
+    # The intermediate meshes are written next to the base gltf
+    scratch_path = os.path.dirname(file_path)
+    cost = file_cost(file_path, model_cost_weight)
+
+    # Packed once for every LOD
+    glb_path = convert_file_path(file_path, scratch_path, ".glb")
+    glb_task_name = "glb:{}".format(file_path)
+    runtime.scheduler.add(glb_task_name, run_model_command, config.model_settings[0], runtime.node_pool, "to_glb", file_path, glb_path, deps=[dep_name], cost=cost,
+                          scratch=[file_path, glb_path] + list(get_gltf_images(file_path).values()))
+
+    model_has_buffers = has_buffers(file_path)
+
+    # Mesh of every LOD to build and of the LODs they are simplified from : {suffix : (task name, path)}
+    meshes = {}
+    sources = lod_sources(config.model_settings)
+    required = set()
+    for model_setting in model_settings:
+        required.update(setting.suffix for setting in lod_lineage(config.model_settings, model_setting))
+
+    weld_tasks = {}
+    for model_setting in config.model_settings:
+        if model_setting.suffix not in required:
+            continue
+        if not model_has_buffers:
+            meshes[model_setting.suffix] = (glb_task_name, glb_path)
+            continue
+
+        # One weld for every LOD of the same tolerance and weld engine
+        weld_mesh = (glb_task_name, glb_path)
+        if model_setting.tolerance != -1:
+            weld_key = (model_setting.tolerance, model_setting.weld_engine)
+            if weld_key not in weld_tasks:
+                weld_path = convert_file_path(file_path, scratch_path, "_weld{}.glb".format(len(weld_tasks)))
+                weld_task_name = "weld:{}:{}:{}".format(model_setting.tolerance, model_setting.weld_engine, file_path)
+                runtime.scheduler.add(weld_task_name, weld_model, model_setting, runtime.node_pool, glb_path, weld_path,
+                                      deps=[glb_task_name], cost=cost, scratch=[glb_path, weld_path])
+                weld_tasks[weld_key] = (weld_task_name, weld_path)
+            weld_mesh = weld_tasks[weld_key]
+        meshes[model_setting.suffix] = weld_mesh
+
+    # Simplified LODs in order of decreasing ratio, so that their source mesh exists
+    # The LODs with target_bytes are simplified by their budget search
+    simplified = sorted((model_setting for model_setting in config.model_settings
+                         if model_setting.suffix in required and model_setting.ratio != -1 and not model_setting.target_bytes and model_has_buffers),
+                        key=lambda model_setting: -model_setting.ratio)
+    for model_setting in simplified:
+        source = sources[model_setting.suffix]
+        source_task_name, source_path = meshes[source.suffix] if source else meshes[model_setting.suffix]
+        simplify_path = convert_file_path(file_path, scratch_path, "{}_simplified.glb".format(model_setting.suffix))
+        simplify_task_name = "simplify:{}:{}".format(model_setting.suffix, file_path)
+        runtime.scheduler.add(simplify_task_name, run_model_transforms, replace(model_setting, ratio=relative_ratio(model_setting, source)),
+                              runtime.node_pool, ["simplify"], source_path, simplify_path, deps=[source_task_name], cost=cost, scratch=[source_path, simplify_path])
+        meshes[model_setting.suffix] = (simplify_task_name, simplify_path)
+
+    # Compression and repackage of every LOD to build
+    for model_setting in model_settings:
+        mesh_task_name, mesh_path = meshes[model_setting.suffix]
+        if model_setting.target_bytes and model_has_buffers:
+            budget_key = settings_hash(source_hash, lod_config_hash(config, [model_setting]))
+            parallel = budget_parallel(runtime)
+            runtime.scheduler.add(model_task_name(model_setting, file_path), tune_model, runtime, model_setting, dir, config.output_exts, file_path, mesh_path, texture_names, budget_key, parallel,
+                                  deps=[mesh_task_name], cost=cost * parallel, threads=parallel, scratch=[file_path, mesh_path])
+            continue
+        runtime.scheduler.add(model_task_name(model_setting, file_path), optimize_model, runtime, model_setting, dir, config.output_exts, file_path, mesh_path, texture_names,
+                              deps=[mesh_task_name], cost=cost, scratch=[file_path, mesh_path])
+
+# Task, and journal unit, of a LOD of the base gltf file_path
+def model_task_name(model_setting : Config.ModelSetting, file_path : str) -> str:
+    return "model:{}:{}".format(model_setting.suffix, file_path)
+
+# Compress the mesh_path of a LOD and write it with the images, samplers, textures and materials of the base gltf
+def optimize_model(runtime : Runtime, model_setting : Config.ModelSetting, dir : Directory, output_exts : List[str], file_path : str, mesh_path : str,
+                   texture_names : Dict[str, str]):
+    output_paths = build_lod(model_setting, runtime.node_pool, dir.workspace, output_exts, file_path, mesh_path, texture_names)
+    record_files(runtime, runtime.journal.done(model_task_name(model_setting, file_path), output_paths), lod_metrics)
+
+# Write the LOD of mesh_path in workspace, returns the written paths
+def build_lod(model_setting : Config.ModelSetting, node_pool : NodeWorkerPool, workspace : str, output_exts : List[str], file_path : str, mesh_path : str,
+              texture_names : Dict[str, str]) -> List[str]:
+    # optimize process, the mesh is already welded and simplified
+    compressed_path = mesh_path
+    if model_setting.compression != "none" and has_buffers(file_path):
+        compressed_path = convert_file_path(file_path, workspace, "{}.glb".format(model_setting.suffix))
+        run_model_transforms(model_setting, node_pool, [model_setting.compression], mesh_path, compressed_path)
+
+    # post process
+    return repackage_model(model_setting, workspace, output_exts, file_path, compressed_path, texture_names)
 
 #--------------------------------------------
-    # After moving gltf, convert it to glb and put it back
-    # moving gltf
-    move_gltf_path = convert_file_path(copy_to_gltf_path, dir.texture[0], ".gltf")
-    subprocess.run(command_move_to_dest.format(copy_to_gltf_path, move_gltf_path), shell=True)
-
-    # convert glb
-    glb_file_path = convert_file_path(copy_to_gltf_path, dir.texture[0], ".glb")
-    subprocess.run(model_setting.to_glb_separate(move_gltf_path, glb_file_path), shell=True)
-
-    # put it back
-    workspace_glb_path = convert_file_path(move_gltf_path, dir.workspace, ".glb")
-    subprocess.run(command_move_to_dest.format(glb_file_path, workspace_glb_path), shell=True)
-
-    # put it back
-    workspace_gltf_path_back = convert_file_path(glb_file_path, dir.workspace, ".gltf")
-    subprocess.run(command_move_to_dest.format(move_gltf_path, workspace_gltf_path_back), shell=True)
-    
-#----------------------------------------------
-# CLI
+# Size budgets, see budget.py
+
+# Trials of a budget search run at once
+def budget_parallel(runtime : Runtime) -> int:
+    return max(1, min(4, runtime.executor.jobs))
+
+# LOD with target_bytes : the most detailed ratio of the welded mesh_path whose LOD file fits in the budget.
+# Every trial is a full LOD (simplify, compression, repackage) in its own folder next to the base gltf,
+# the chosen one is moved into the workspace.
+def tune_model(runtime : Runtime, model_setting : Config.ModelSetting, dir : Directory, output_exts : List[str], file_path : str, mesh_path : str,
+               texture_names : Dict[str, str], budget_key : str, parallel : int):
+    candidates = model_setting.budget_settings()
+    cached = runtime.budgets.get(budget_key) if runtime.budgets else None
+    if cached:
+        candidates = [replace(model_setting, ratio=cached["ratio"], error=cached["error"])]
+
+    trial_root = convert_file_path(file_path, os.path.dirname(file_path), "{}_budget".format(model_setting.suffix))
+    trial_outputs = {}
+    def trial(index : int) -> int:
+        trial_path = os.path.join(trial_root, str(index))
+        make_directory(trial_path)
+        simplify_path = convert_file_path(file_path, trial_path, "_simplified.glb")
+        run_model_transforms(candidates[index], runtime.node_pool, ["simplify"], mesh_path, simplify_path)
+        trial_outputs[index] = build_lod(candidates[index], runtime.node_pool, trial_path, output_exts, file_path, simplify_path, texture_names)
+        return os.path.getsize(trial_outputs[index][-1])
+
+    try:
+        index, sizes = budget_search(len(candidates), trial, model_setting.target_bytes, parallel)
+        output_paths = []
+        for trial_output in trial_outputs[index]:
+            output_paths.append(os.path.join(dir.workspace, os.path.basename(trial_output)))
+            os.replace(trial_output, output_paths[-1])
+    finally:
+        shutil.rmtree(trial_root, ignore_errors=True)
+
+    chosen = candidates[index]
+    if runtime.budgets and not cached:
+        runtime.budgets.put(budget_key, {"ratio": chosen.ratio, "error": chosen.error})
+    print("budget {}: ratio {}, {:.1f} KB of {:.1f} KB ({} trials)".format(os.path.basename(output_paths[-1]), chosen.ratio, sizes[index] / 1024, model_setting.target_bytes / 1024, len(sizes)))
+    record_files(runtime, runtime.journal.done(model_task_name(model_setting, file_path), output_paths), lod_metrics)
+
 def main(argv):
 
     FILE_NAME     = argv[0] 
@@ -295,13 +1095,29 @@ def main(argv):
     OUTPUT_PATH = ""
     CONPIG_PATH  = ""        
     UPDATE_MODE = False
+    CACHE_PATH = os.path.join(get_bundle_dir(), "cache")
+    CACHE_SIZE = 2048
+    NODE_WORKERS = min(8, os.cpu_count() or 1)
+    JOBS = default_jobs()
+    WATCH_MODE = False
+    TRACE_PATH = None
+    COORDINATOR_PATH = None
+    WORKER_PATH = None
+    ASSEMBLE_PATH = None
+    LEASE_SECONDS = 300
+    WORKSPACE_PATH = None
+    TIMEOUT = None
+    RESUME_RUN_ID = None
+    MAX_SCRATCH = 0
     
     try:
         opts, etc_args = getopt.getopt(argv[1:], \
-                                 "hi:c:", ["help", "path=", "output=", "config=", "update"])
+                                 "hi:c:j:", ["help", "path=", "output=", "config=", "update", "cache=", "cache-size=", "no-cache", "node-workers=", "jobs=", "watch", "trace=",
+                                  "coordinator=", "worker=", "assemble=", "lease=", "workspace=", "timeout=", "resume=", "max-scratch="])
 
     except getopt.GetoptError: 
-        print(FILE_NAME, '--path <input gltf path> --output <output gltf path> --config <config json path)> --update')
+        print(FILE_NAME, '--path <input gltf path> --output <output gltf path> --config <config json path)> --update --cache <cache path> --cache-size <MB> --no-cache --node-workers <count> --jobs <cores> --watch --trace <trace json path> '
+              '--coordinator <queue path> --worker <queue path> --assemble <queue path> --lease <seconds> --workspace <path, e.g. /dev/shm/gltf-optimizer> --timeout <seconds> --resume <run id> --max-scratch <MB>')
         sys.exit(2)
 
     for opt, arg in opts: 
@@ -319,7 +1135,67 @@ def main(argv):
             CONPIG_PATH = os.path.abspath(arg)
 
         elif opt in ("--u", "--update"): 
-            UPDATE_MODE = os.path.abspath(arg)
+            UPDATE_MODE = True
+
+        elif opt == "--cache":
+            CACHE_PATH = os.path.abspath(arg)
+
+        elif opt == "--cache-size":
+            CACHE_SIZE = int(arg)
+
+        elif opt == "--no-cache":
+            CACHE_PATH = None
+
+        elif opt == "--node-workers":
+            NODE_WORKERS = int(arg)
+
+        elif opt in ("-j", "--jobs"):
+            JOBS = int(arg)
+
+        elif opt == "--watch":
+            WATCH_MODE = True
+
+        elif opt == "--trace":
+            TRACE_PATH = os.path.abspath(arg)
+
+        elif opt == "--coordinator":
+            COORDINATOR_PATH = os.path.abspath(arg)
+
+        elif opt == "--worker":
+            WORKER_PATH = os.path.abspath(arg)
+
+        elif opt == "--assemble":
+            ASSEMBLE_PATH = os.path.abspath(arg)
+
+        elif opt == "--lease":
+            LEASE_SECONDS = float(arg)
+
+        elif opt == "--workspace":
+            WORKSPACE_PATH = os.path.abspath(arg)
+
+        elif opt == "--timeout":
+            TIMEOUT = float(arg)
+
+        elif opt == "--resume":
+            RESUME_RUN_ID = arg
+
+        elif opt == "--max-scratch":
+            MAX_SCRATCH = int(arg)
+
+    # A node worker runs one task at a time, more workers than cores would only wait
+    NODE_WORKERS = min(NODE_WORKERS, JOBS)
+
+    # A tool call running longer is killed and its task fails
+    tracer.timeout = TIMEOUT
+
+    # Workers and the assembly read the paths and the config from the queue
+    if WORKER_PATH:
+        run_worker(WORKER_PATH, CACHE_PATH, CACHE_SIZE, NODE_WORKERS, JOBS, WORKSPACE_PATH)
+        return
+
+    if ASSEMBLE_PATH:
+        assemble(ASSEMBLE_PATH)
+        return
 
     if len(INPUT_PATH) < 1: 
         print(FILE_NAME, "--path option is mandatory") 
@@ -332,8 +1208,15 @@ def main(argv):
     if len(CONPIG_PATH) < 1: 
         print(FILE_NAME, "--config option is mandatory") 
         sys.exit(2)
-        
-    run(INPUT_PATH, OUTPUT_PATH, CONPIG_PATH, UPDATE_MODE)
+
+    if COORDINATOR_PATH:
+        if not os.path.exists(OUTPUT_PATH):
+            print('\nOutput path does not exist. Please enter the correct path.\n')
+            sys.exit()
+        coordinate(COORDINATOR_PATH, INPUT_PATH, OUTPUT_PATH, CONPIG_PATH, UPDATE_MODE, LEASE_SECONDS)
+        return
+
+    run(INPUT_PATH, OUTPUT_PATH, CONPIG_PATH, UPDATE_MODE, CACHE_PATH, CACHE_SIZE, NODE_WORKERS, JOBS, WATCH_MODE, TRACE_PATH, WORKSPACE_PATH, RESUME_RUN_ID, MAX_SCRATCH)
 
 if __name__ == "__main__":
     main(sys.argv)
@@ -0,0 +1,254 @@
+import base64
+import json
+import mmap
+import os
+import struct
+from typing import Dict, List, Tuple
+from urllib.parse import unquote
+
+from directory import image_extensions
+
+#----------------------------------------------
+# Minimal glTF 2.0 container reader / writer.
+# Only the container is handled (GLB header and chunks, embedded buffers, image references),
+# meshes are never decoded. The BIN chunk of a GLB is read through a memoryview on a mmap,
+# so a buffer that is written back unchanged is never copied.
+# ref : https://registry.khronos.org/glTF/specs/2.0/glTF-2.0.html#glb-file-format-specification
+
+GLB_MAGIC = 0x46546C67
+GLB_VERSION = 2
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+
+GLB_HEADER = struct.Struct("<III")
+CHUNK_HEADER = struct.Struct("<II")
+
+DATA_URI_PREFIX = "data:application/octet-stream;base64,"
+
+class GltfContainerError(Exception):
+    pass
+
+def align(offset : int, alignment : int = 4) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+#----------------------------------------------
+# Reader
+
+class GltfFile:
+    def __init__(self, path : str):
+        self.path = path
+        self.json = None
+        self.bin = None
+        self.mmap = None
+
+        if os.path.splitext(path)[1].lower() == ".glb":
+            self.read_glb()
+        else:
+            self.read_gltf()
+
+    def read_glb(self):
+        with open(self.path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size < GLB_HEADER.size:
+                raise GltfContainerError("{} is not a glb file".format(self.path))
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        data = memoryview(self.mmap)
+        magic, version, length = GLB_HEADER.unpack_from(data, 0)
+        if magic != GLB_MAGIC or version != GLB_VERSION:
+            data.release()
+            self.close()
+            raise GltfContainerError("{} is not a glb 2.0 file".format(self.path))
+
+        offset = GLB_HEADER.size
+        length = min(length, len(data))
+        while offset + CHUNK_HEADER.size <= length:
+            chunk_length, chunk_type = CHUNK_HEADER.unpack_from(data, offset)
+            offset += CHUNK_HEADER.size
+            chunk = data[offset:offset + chunk_length]
+            if chunk_type == CHUNK_JSON and self.json is None:
+                self.json = json.loads(bytes(chunk))
+                chunk.release()
+            elif chunk_type == CHUNK_BIN and self.bin is None:
+                self.bin = chunk
+            else:
+                chunk.release()
+            offset = align(offset + chunk_length)
+        data.release()
+
+        if self.json is None:
+            self.close()
+            raise GltfContainerError("{} has no JSON chunk".format(self.path))
+
+        # The BIN chunk may be padded, buffers[0].byteLength is the real size
+        buffers = self.json.get("buffers", [])
+        if self.bin is not None and buffers and "uri" not in buffers[0]:
+            byte_length = buffers[0].get("byteLength", len(self.bin))
+            if byte_length < len(self.bin):
+                chunk = self.bin
+                self.bin = chunk[:byte_length]
+                chunk.release()
+
+    def read_gltf(self):
+        with open(self.path, 'rb') as file:
+            self.json = json.loads(file.read())
+
+        # An embedded first buffer is exposed as bin, same as a GLB
+        buffers = self.json.get("buffers", [])
+        if buffers and buffers[0].get("uri", "").startswith(DATA_URI_PREFIX):
+            self.bin = memoryview(base64.b64decode(buffers[0]["uri"][len(DATA_URI_PREFIX):]))
+            del buffers[0]["uri"]
+
+    def close(self):
+        if self.bin is not None:
+            self.bin.release()
+            self.bin = None
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+#----------------------------------------------
+# Writer
+
+def dump_json(gltf : dict) -> bytes:
+    return json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+
+def replace_file(path : str, chunks : List[bytes]):
+    # Written next to the destination and renamed, so the source may be the file being replaced
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_path, 'wb') as file:
+        for chunk in chunks:
+            file.write(chunk)
+    os.replace(temp_path, path)
+
+def set_bin_length(gltf : dict, bin_chunk):
+    buffers = gltf.get("buffers", [])
+    if bin_chunk is not None and buffers:
+        buffers[0]["byteLength"] = len(bin_chunk)
+
+def write_glb(path : str, gltf : dict, bin_chunk = None):
+    set_bin_length(gltf, bin_chunk)
+
+    json_chunk = dump_json(gltf)
+    json_padding = b' ' * (align(len(json_chunk)) - len(json_chunk))
+    chunks = [None, CHUNK_HEADER.pack(len(json_chunk) + len(json_padding), CHUNK_JSON), json_chunk, json_padding]
+    length = GLB_HEADER.size + CHUNK_HEADER.size + len(json_chunk) + len(json_padding)
+
+    if bin_chunk is not None and len(bin_chunk) > 0:
+        bin_padding = b'\0' * (align(len(bin_chunk)) - len(bin_chunk))
+        chunks += [CHUNK_HEADER.pack(len(bin_chunk) + len(bin_padding), CHUNK_BIN), bin_chunk, bin_padding]
+        length += CHUNK_HEADER.size + len(bin_chunk) + len(bin_padding)
+
+    chunks[0] = GLB_HEADER.pack(GLB_MAGIC, GLB_VERSION, length)
+    replace_file(path, chunks)
+
+# glTF with the first buffer embedded as a data uri. Images keep their uri, so textures stay separate.
+def write_gltf(path : str, gltf : dict, bin_chunk = None):
+    set_bin_length(gltf, bin_chunk)
+
+    buffers = gltf.get("buffers", [])
+    if bin_chunk is not None and buffers:
+        buffers[0]["uri"] = DATA_URI_PREFIX + base64.b64encode(bin_chunk).decode('ascii')
+    try:
+        replace_file(path, [dump_json(gltf)])
+    finally:
+        if bin_chunk is not None and buffers:
+            del buffers[0]["uri"]
+
+#----------------------------------------------
+# Buffer views
+
+def find_buffer_view_refs(node, refs : List[Tuple[dict, str]], skip_images : bool):
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "bufferView" and isinstance(value, int):
+                refs.append((node, key))
+            elif skip_images and key == "images":
+                continue
+            else:
+                find_buffer_view_refs(value, refs, False)
+    elif isinstance(node, list):
+        for value in node:
+            find_buffer_view_refs(value, refs, False)
+
+# Remove the buffer views that only hold embedded images (after their images got an uri)
+# and pack the remaining ranges of the first buffer. Returns the new bin chunk.
+def remove_image_buffer_views(gltf : dict, bin_chunk):
+    images = gltf.get("images", [])
+
+    image_views = set(image["bufferView"] for image in images if "bufferView" in image and "uri" in image)
+    for image in images:
+        if "uri" in image:
+            image.pop("bufferView", None)
+
+    return remove_buffer_views(gltf, bin_chunk, image_views)
+
+# Remove the buffer views of removed_views that nothing references anymore,
+# pack the remaining ranges of the first buffer and remap every bufferView reference.
+# Returns the new bin chunk.
+def remove_buffer_views(gltf : dict, bin_chunk, removed_views):
+    buffer_views = gltf.get("bufferViews", [])
+
+    refs = []
+    find_buffer_view_refs(gltf, refs, False)
+    used_views = set(node[key] for node, key in refs)
+    removed_views = set(removed_views) - used_views
+    if not removed_views or bin_chunk is None:
+        return bin_chunk
+
+    # Ranges of the first buffer to keep : the views and their EXT_meshopt_compression data
+    ranges = []
+    for index, view in enumerate(buffer_views):
+        if index in removed_views:
+            continue
+        if view.get("buffer", 0) == 0:
+            ranges.append(view)
+        meshopt = view.get("extensions", {}).get("EXT_meshopt_compression")
+        if meshopt and meshopt.get("buffer", 0) == 0:
+            ranges.append(meshopt)
+
+    packed = bytearray()
+    for owner in sorted(ranges, key=lambda owner: owner.get("byteOffset", 0)):
+        offset = owner.get("byteOffset", 0)
+        packed += b'\0' * (align(len(packed)) - len(packed))
+        owner["byteOffset"] = len(packed)
+        packed += bin_chunk[offset:offset + owner["byteLength"]]
+
+    remap = {}
+    gltf["bufferViews"] = []
+    for index, view in enumerate(buffer_views):
+        if index not in removed_views:
+            remap[index] = len(gltf["bufferViews"])
+            gltf["bufferViews"].append(view)
+    for node, key in refs:
+        node[key] = remap[node[key]]
+
+    return packed
+
+#----------------------------------------------
+# Separated gltf
+
+def has_buffers(gltf_path : str) -> bool:
+    with open(gltf_path, 'r') as file:
+        return len(json.load(file).get("buffers", [])) > 0
+
+# {image uri : image path} of the separated images of a gltf
+def get_gltf_images(gltf_path : str) -> Dict[str, str]:
+    with open(gltf_path, 'r') as file:
+        gltf_data = json.load(file)
+
+    base_path = os.path.dirname(gltf_path)
+    images = {}
+    for image in gltf_data.get("images", []):
+        uri = image.get("uri", "")
+        if not uri or uri.startswith("data:"):
+            continue
+        image_path = os.path.abspath(os.path.join(base_path, unquote(uri)))
+        if image_path.endswith(tuple(image_extensions)) and os.path.isfile(image_path):
+            images[uri] = image_path
+    return images
@@ -0,0 +1,77 @@
+import json
+import os
+import threading
+from typing import Dict, Iterable
+
+from cache import file_hash
+
+#----------------------------------------------
+# Completion journal of a run, for --resume.
+# The units of a build (base conversion of a model, ktx2 of a texture tier, LOD of a model) append a line
+# to <workspace>/journal.jsonl when they finish : "done" with the sha256 of the files they wrote in the workspace,
+# or "failed". A resumed run skips the units whose last line is "done" and whose files are still in the
+# workspace with the same checksum, every other unit is built again.
+# Units are named as their scheduler task, e.g. "model:_LOD1:<base gltf path>".
+
+JOURNAL_FILE_NAME = "journal.jsonl"
+DONE = "done"
+FAILED = "failed"
+
+class Journal:
+    def __init__(self, workspace : str):
+        self.workspace = workspace
+        self.path = os.path.join(workspace, JOURNAL_FILE_NAME)
+        self.lock = threading.Lock()
+        self.units : Dict[str, dict] = {}
+        # Units skipped because a previous run of the workspace completed them, and units finished by this run
+        self.resumed = 0
+        self.counts = {DONE: 0, FAILED: 0}
+
+        try:
+            with open(self.path, 'r') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Last line of a run killed while writing it
+                        continue
+                    self.units[record["unit"]] = record
+        except FileNotFoundError:
+            pass
+
+    def append(self, record : dict):
+        with self.lock:
+            self.units[record["unit"]] = record
+            self.counts[record["state"]] += 1
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(record) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+
+    # True when a previous run completed the unit and its files are unchanged
+    def is_done(self, unit : str) -> bool:
+        record = self.units.get(unit)
+        if not record or record["state"] != DONE:
+            return False
+        for name, checksum in record["files"].items():
+            try:
+                if file_hash(os.path.join(self.workspace, name)) != checksum:
+                    return False
+            except OSError:
+                return False
+        with self.lock:
+            self.resumed += 1
+        return True
+
+    # Returns the checksums of the files, {path relative to the workspace : sha256}
+    def done(self, unit : str, paths : Iterable[str]) -> Dict[str, str]:
+        files = {os.path.relpath(path, self.workspace): file_hash(path) for path in paths}
+        self.append({"unit": unit, "state": DONE, "files": files})
+        return files
+
+    def failed(self, unit : str, error : str):
+        self.append({"unit": unit, "state": FAILED, "error": error})
+
+    def summary(self) -> str:
+        with self.lock:
+            return "journal: {} units resumed, {} done, {} failed".format(self.resumed, self.counts[DONE], self.counts[FAILED])
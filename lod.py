@@ -0,0 +1,43 @@
+from typing import Dict, List
+
+from config import Config
+
+#----------------------------------------------
+# LOD chain of the model settings.
+# The model settings with the same weld tolerance and weld engine share one weld, and their simplified LODs form
+# a chain in order of decreasing ratio : each LOD is simplified from the previous one with the ratio
+# relative to it, instead of simplifying the full mesh again. The compression runs on every LOD at the end.
+# A LOD with ratio -1 is not simplified, it is the welded (or unwelded) mesh.
+# A LOD with target_bytes searches its own ratio (see budget.py) : it is simplified from the welded mesh and
+# is never the source of another LOD.
+
+# {suffix : model setting the LOD is simplified from, None for the welded mesh}
+def lod_sources(model_settings : List[Config.ModelSetting]) -> Dict[str, Config.ModelSetting]:
+    sources = {}
+    groups : Dict[tuple, List[Config.ModelSetting]] = {}
+    for model_setting in model_settings:
+        groups.setdefault((model_setting.tolerance, model_setting.weld_engine), []).append(model_setting)
+
+    for group in groups.values():
+        simplified = sorted((model_setting for model_setting in group if model_setting.ratio != -1 and not model_setting.target_bytes), key=lambda model_setting: -model_setting.ratio)
+        for model_setting in group:
+            sources[model_setting.suffix] = None
+        for index, model_setting in enumerate(simplified):
+            # Same ratios are simplified from the same source, each with its own error and lock_border
+            larger = [source for source in simplified[:index] if source.ratio > model_setting.ratio]
+            sources[model_setting.suffix] = larger[-1] if larger else None
+    return sources
+
+# Model settings whose simplify produced the LOD, from the first of the chain to model_setting
+def lod_lineage(model_settings : List[Config.ModelSetting], model_setting : Config.ModelSetting) -> List[Config.ModelSetting]:
+    sources = lod_sources(model_settings)
+    lineage = [model_setting]
+    while sources.get(lineage[0].suffix):
+        lineage.insert(0, sources[lineage[0].suffix])
+    return lineage
+
+# Ratio of the simplify of model_setting applied to the mesh of source
+def relative_ratio(model_setting : Config.ModelSetting, source : Config.ModelSetting) -> float:
+    if source is None:
+        return model_setting.ratio
+    return model_setting.ratio / source.ratio
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Iterable, List
+from urllib.parse import unquote
+
+from cache import file_hash
+from config import Config, changed_fields
+
+#----------------------------------------------
+# Build manifest written next to the outputs.
+# It records, for every (model, LOD) and (image, texture tier) unit, the content hash of its input,
+# the hash of the setting used and the artifacts it produced, so that --update rebuilds exactly
+# the stale units and removes the outputs of models, LODs and tiers that no longer exist.
+#
+# {
+#   "models": {"<model path relative to --path>": {"hash": "...", "images": ["a.png"],
+#              "lods": {"_LOD0": {"hash": "...", "config": "...", "artifacts": ["a_LOD0.glb"]}}}},
+#   "textures": {"<tier>/<image name>": {"hash": "...", "config": "...", "artifacts": ["<tier>/a.ktx2"]}}
+# }
+
+MANIFEST_FILE_NAME = ".gltf-optimizer-manifest.json"
+MANIFEST_VERSION = 2
+
+# Content hash of a source model. A .gltf also depends on the external buffers and images it references,
+# their hashes are folded in so that a changed .bin or texture makes the model stale.
+# A model without external resources keeps the hash of its file.
+def model_source_hash(file_path : str) -> str:
+    digest = file_hash(file_path)
+    if not file_path.endswith(".gltf"):
+        return digest
+    try:
+        with open(file_path, 'r') as file:
+            gltf = json.load(file)
+    except (OSError, ValueError):
+        return digest
+
+    parts = []
+    for entry in gltf.get("buffers", []) + gltf.get("images", []):
+        uri = entry.get("uri")
+        if not uri or uri.startswith("data:"):
+            continue
+        path = os.path.join(os.path.dirname(file_path), unquote(uri))
+        parts.append([uri, file_hash(path) if os.path.isfile(path) else None])
+    if not parts:
+        return digest
+    return hashlib.sha256(json.dumps([digest, parts]).encode()).hexdigest()
+
+def settings_hash(*values) -> str:
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode()).hexdigest()[:16]
+
+# lineage : the settings of the LOD chain that produced the LOD, see lod_lineage
+def lod_config_hash(config : Config, lineage : List[Config.ModelSetting]) -> str:
+    values = [[changed_fields(model_setting) for model_setting in lineage], config.output_exts]
+    # Only hashed when enabled, the LODs built before the option stay fresh
+    if config.pack_orm:
+        values.append("pack_orm")
+    return settings_hash(*values)
+
+def texture_config_hash(texture_setting : Config.TextureSetting) -> str:
+    return settings_hash(changed_fields(texture_setting))
+
+class BuildManifest:
+    def __init__(self, output_path : str, input_path : str):
+        self.path = os.path.join(output_path, MANIFEST_FILE_NAME)
+        self.output_path = output_path
+        self.input_path = input_path
+        self.models : Dict[str, dict] = {}
+        self.textures : Dict[str, dict] = {}
+        # {artifact : size, checksum and metrics}, for the asset manifests (see asset_manifest.py)
+        self.files : Dict[str, dict] = {}
+        # Units built by the current run, applied once their outputs exist : (workspace files, function, args)
+        self.pending = []
+        self.lock = threading.Lock()
+
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+            if data.get("version") == MANIFEST_VERSION:
+                self.models = data.get("models", {})
+                self.textures = data.get("textures", {})
+                self.files = data.get("files", {})
+        except (OSError, ValueError):
+            pass
+
+    def model_key(self, source : str) -> str:
+        return os.path.relpath(source, self.input_path)
+
+    def artifacts_exist(self, artifacts : List[str]) -> bool:
+        return all(os.path.isfile(os.path.join(self.output_path, artifact)) for artifact in artifacts)
+
+    #----------------------------------------------
+    # Freshness
+
+    def is_lod_fresh(self, key : str, source_hash : str, suffix : str, config_hash : str) -> bool:
+        lod = self.models.get(key, {}).get("lods", {}).get(suffix)
+        return bool(lod) and lod["hash"] == source_hash and lod["config"] == config_hash and self.artifacts_exist(lod["artifacts"])
+
+    def is_texture_fresh(self, key : str, image_hash : str, config_hash : str) -> bool:
+        texture = self.textures.get(key)
+        return bool(texture) and texture["hash"] == image_hash and texture["config"] == config_hash and self.artifacts_exist(texture["artifacts"])
+
+    # The textures of a model can be checked without converting it when the model did not change
+    def are_model_textures_fresh(self, key : str, source_hash : str, tiers : Dict[str, str]) -> bool:
+        model = self.models.get(key)
+        if not model or model["hash"] != source_hash:
+            return False
+
+        for name in model["images"]:
+            for tier, config_hash in tiers.items():
+                texture = self.textures.get("{}/{}".format(tier, name))
+                if not texture or texture["config"] != config_hash or not self.artifacts_exist(texture["artifacts"]):
+                    return False
+        return True
+
+    # Image file names the previous builds used for this content, in the tier folders
+    def texture_names(self, image_hash : str) -> List[str]:
+        return sorted(set(key.split("/", 1)[1] for key, texture in self.textures.items() if texture["hash"] == image_hash))
+
+    #----------------------------------------------
+    # Record units built by this run
+
+    def add_pending(self, workspace_files : List[str], function, *args):
+        with self.lock:
+            self.pending.append((workspace_files, function, args))
+
+    def set_model_images(self, key : str, source_hash : str, names : List[str]):
+        model = self.models.setdefault(key, {"hash": source_hash, "images": [], "lods": {}})
+        model["hash"] = source_hash
+        model["images"] = names
+
+    def set_lod(self, key : str, source_hash : str, suffix : str, config_hash : str, artifacts : List[str]):
+        model = self.models.setdefault(key, {"hash": source_hash, "images": [], "lods": {}})
+        model["lods"][suffix] = {"hash": source_hash, "config": config_hash, "artifacts": artifacts}
+
+    def set_texture(self, key : str, image_hash : str, config_hash : str, artifacts : List[str]):
+        self.textures[key] = {"hash": image_hash, "config": config_hash, "artifacts": artifacts}
+
+    def set_file(self, artifact : str, stats : dict):
+        self.files[artifact] = stats
+
+    # Apply the pending units whose files were produced in the workspace
+    def commit(self):
+        with self.lock:
+            for workspace_files, function, args in self.pending:
+                if all(os.path.exists(path) for path in workspace_files):
+                    function(*args)
+            self.pending = []
+
+    # Add the units recorded by the manifest of another output, e.g. a work unit built by a worker
+    def merge(self, other : "BuildManifest"):
+        for key, other_model in other.models.items():
+            model = self.models.setdefault(key, {"hash": other_model["hash"], "images": [], "lods": {}})
+            model["hash"] = other_model["hash"]
+            if other_model["images"]:
+                model["images"] = other_model["images"]
+            model["lods"].update(other_model["lods"])
+        self.textures.update(other.textures)
+        self.files.update(other.files)
+
+    #----------------------------------------------
+    # Orphans
+
+    def remove_artifacts(self, artifacts : Iterable[str]) -> int:
+        count = 0
+        for artifact in artifacts:
+            path = os.path.join(self.output_path, artifact)
+            if os.path.isfile(path):
+                os.remove(path)
+                count += 1
+            self.files.pop(artifact, None)
+        return count
+
+    # Remove the outputs of models not in model_keys, LODs not in suffixes,
+    # and textures of tiers not in tiers or of images no model uses anymore.
+    def remove_orphans(self, model_keys : Iterable[str], suffixes : Iterable[str], tiers : Iterable[str]) -> int:
+        model_keys = set(model_keys)
+        suffixes = set(suffixes)
+        tiers = set(tiers)
+        count = 0
+
+        for key in list(self.models):
+            model = self.models[key]
+            if key not in model_keys:
+                for lod in model["lods"].values():
+                    count += self.remove_artifacts(lod["artifacts"])
+                del self.models[key]
+                continue
+            for suffix in list(model["lods"]):
+                if suffix not in suffixes:
+                    count += self.remove_artifacts(model["lods"][suffix]["artifacts"])
+                    del model["lods"][suffix]
+
+        # Artifacts still listed by another unit are kept
+        used_images = set(name for model in self.models.values() for name in model["images"])
+        for key in list(self.textures):
+            tier, name = key.split("/", 1)
+            if tier not in tiers or name not in used_images:
+                artifacts = self.textures.pop(key)["artifacts"]
+                in_use = set(artifact for texture in self.textures.values() for artifact in texture["artifacts"])
+                count += self.remove_artifacts(artifact for artifact in artifacts if artifact not in in_use)
+
+        return count
+
+    def save(self):
+        data = {"version": MANIFEST_VERSION, "models": self.models, "textures": self.textures, "files": self.files}
+        temp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(temp_path, 'w') as file:
+            json.dump(data, file, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
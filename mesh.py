@@ -0,0 +1,245 @@
+from typing import Dict, List, Tuple
+
+from gltf_container import GltfFile, align, remove_buffer_views, write_glb
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#----------------------------------------------
+# In-process mesh engine, selected with "weld_engine": "numpy" in a model setting.
+# The accessors of a glb are read as NumPy views on the BIN chunk, and every triangle primitive is
+# welded in bulk : the attributes are quantized to the tolerance (a fraction of the bounding box
+# for POSITION, an absolute step for the other attributes), equal rows are merged with np.unique,
+# then degenerate triangles and the vertices no triangle uses anymore are removed.
+# Files the engine cannot rewrite safely raise MeshError, the caller then runs the gltf-transform CLI.
+
+class MeshError(Exception):
+    pass
+
+def is_available() -> bool:
+    return np is not None
+
+TRIANGLES = 4
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+component_types = {
+    5120: "i1",
+    5121: "u1",
+    5122: "<i2",
+    5123: "<u2",
+    5125: "<u4",
+    5126: "<f4",
+}
+
+type_sizes = {"SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4}
+
+# Extensions whose accessor references are all known, see accessor_refs
+supported_extension_prefixes = ("KHR_materials_", "KHR_texture_", "EXT_texture_", "KHR_lights_punctual", "KHR_mesh_quantization", "EXT_mesh_gpu_instancing")
+
+# Names of the extensions present in the document, declared ones that are never used do not matter
+def used_extensions(node, names : set) -> set:
+    if isinstance(node, dict):
+        names.update(node.get("extensions", {}))
+        for value in node.values():
+            used_extensions(value, names)
+    elif isinstance(node, list):
+        for value in node:
+            used_extensions(value, names)
+    return names
+
+def check_extensions(gltf : dict):
+    for extension in sorted(used_extensions(gltf, set())):
+        if not extension.startswith(supported_extension_prefixes):
+            raise MeshError("{} is not supported".format(extension))
+
+#----------------------------------------------
+# Accessors
+
+def read_accessor(gltf : dict, bin_chunk, index : int):
+    accessor = gltf["accessors"][index]
+    if "sparse" in accessor or "bufferView" not in accessor or accessor["type"] not in type_sizes:
+        raise MeshError("accessor {} is not supported".format(index))
+
+    view = gltf["bufferViews"][accessor["bufferView"]]
+    if view.get("buffer", 0) != 0 or bin_chunk is None:
+        raise MeshError("accessor {} is not in the BIN chunk".format(index))
+
+    dtype = np.dtype(component_types[accessor["componentType"]])
+    size = type_sizes[accessor["type"]]
+    stride = view.get("byteStride") or dtype.itemsize * size
+    offset = view.get("byteOffset", 0) + accessor.get("byteOffset", 0)
+    count = accessor["count"]
+    if count and offset + stride * (count - 1) + dtype.itemsize * size > len(bin_chunk):
+        raise MeshError("accessor {} is out of the BIN chunk".format(index))
+
+    return np.ndarray((count, size), dtype, buffer=bin_chunk, offset=offset, strides=(stride, dtype.itemsize))
+
+# Append values as a new accessor, based on the accessor at template.
+# Every element of a vertex attribute starts on a 4 byte boundary, as glTF requires : a u8 VEC3 color or
+# an i16 VEC3 quantized position is padded to 4 or 8 bytes per vertex and the buffer view gets its byteStride.
+def append_accessor(gltf : dict, bin_chunk : bytearray, values, template : dict, target : int) -> int:
+    values = np.ascontiguousarray(values)
+    stride = None
+    if target == ARRAY_BUFFER:
+        element_size = values.dtype.itemsize * values.shape[1]
+        stride = align(element_size)
+        rows = np.zeros((len(values), stride), np.uint8)
+        rows[:, :element_size] = values.view(np.uint8).reshape(len(values), element_size)
+        data = rows.tobytes()
+    else:
+        data = values.tobytes()
+    bin_chunk += b'\0' * (align(len(bin_chunk)) - len(bin_chunk))
+    view = {"buffer": 0, "byteOffset": len(bin_chunk), "byteLength": len(data)}
+    if stride:
+        view["byteStride"] = stride
+    view["target"] = target
+    gltf["bufferViews"].append(view)
+    bin_chunk += data
+
+    accessor = {key: value for key, value in template.items() if key not in ("bufferView", "byteOffset", "min", "max")}
+    accessor["bufferView"] = len(gltf["bufferViews"]) - 1
+    accessor["count"] = len(values)
+    if "min" in template and len(values):
+        accessor["min"] = values.min(axis=0).tolist()
+        accessor["max"] = values.max(axis=0).tolist()
+    gltf["accessors"].append(accessor)
+    return len(gltf["accessors"]) - 1
+
+# (container, key) of every accessor reference
+def accessor_refs(gltf : dict) -> List[Tuple[dict, str]]:
+    refs = []
+    for mesh in gltf.get("meshes", []):
+        for primitive in mesh.get("primitives", []):
+            refs += [(primitive["attributes"], name) for name in primitive.get("attributes", {})]
+            if "indices" in primitive:
+                refs.append((primitive, "indices"))
+            for target in primitive.get("targets", []):
+                refs += [(target, name) for name in target]
+    for skin in gltf.get("skins", []):
+        if "inverseBindMatrices" in skin:
+            refs.append((skin, "inverseBindMatrices"))
+    for animation in gltf.get("animations", []):
+        for sampler in animation.get("samplers", []):
+            refs += [(sampler, key) for key in ("input", "output") if key in sampler]
+    for node in gltf.get("nodes", []):
+        instancing = node.get("extensions", {}).get("EXT_mesh_gpu_instancing", {})
+        refs += [(instancing["attributes"], name) for name in instancing.get("attributes", {})]
+    return refs
+
+# Remove the accessors of removed_accessors nothing references, and their buffer views.
+# Returns the new bin chunk.
+def remove_accessors(gltf : dict, bin_chunk, removed_accessors) -> bytearray:
+    refs = accessor_refs(gltf)
+    removed_accessors = set(removed_accessors) - set(node[key] for node, key in refs)
+    if not removed_accessors:
+        return bin_chunk
+
+    accessors = gltf["accessors"]
+    removed_views = set(accessors[index]["bufferView"] for index in removed_accessors if "bufferView" in accessors[index])
+    remap = {}
+    gltf["accessors"] = []
+    for index, accessor in enumerate(accessors):
+        if index not in removed_accessors:
+            remap[index] = len(gltf["accessors"])
+            gltf["accessors"].append(accessor)
+    for node, key in refs:
+        node[key] = remap[node[key]]
+
+    return remove_buffer_views(gltf, bin_chunk, removed_views)
+
+#----------------------------------------------
+# Weld
+
+# Integer key of every vertex, vertices with equal keys are merged
+def quantize(name : str, values, tolerance : float):
+    if values.dtype.kind != 'f':
+        return values.astype(np.int64)
+
+    step = tolerance
+    if name == "POSITION" and len(values):
+        step = tolerance * float((values.max(axis=0) - values.min(axis=0)).max())
+    if step <= 0:
+        # Bit-exact comparison, -0.0 and 0.0 are still the same value
+        return (values + np.float32(0)).view(np.int32).astype(np.int64)
+    return np.floor(values / step + 0.5).astype(np.int64)
+
+# Returns (vertex indices to keep, new triangle indices), or None when nothing changes
+def weld_primitive(attributes : Dict[str, object], indices, tolerance : float):
+    vertex_count = len(next(iter(attributes.values())))
+    if vertex_count == 0:
+        return None
+
+    keys = np.ascontiguousarray(np.concatenate([quantize(name, values, tolerance) for name, values in sorted(attributes.items())], axis=1))
+    rows = keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+    _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+
+    # Merged vertices keep the order of their first occurrence
+    order = np.argsort(first, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    triangles = rank[inverse][indices].reshape(-1, 3)
+
+    # Degenerate triangles, then vertices no triangle uses
+    triangles = triangles[(triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2]) & (triangles[:, 0] != triangles[:, 2])]
+    used, new_indices = np.unique(triangles.ravel(), return_inverse=True)
+
+    if len(used) == vertex_count and len(new_indices) == len(indices):
+        return None
+    return first[order][used], new_indices.ravel()
+
+def weld_gltf(gltf : dict, bin_chunk, tolerance : float):
+    check_extensions(gltf)
+    new_bin = None
+    replaced = []
+
+    for mesh in gltf.get("meshes", []):
+        for primitive in mesh.get("primitives", []):
+            if primitive.get("mode", TRIANGLES) != TRIANGLES or primitive.get("targets") or primitive.get("extensions"):
+                continue
+
+            names = list(primitive.get("attributes", {}))
+            if not names:
+                continue
+            attributes = {name: read_accessor(gltf, bin_chunk, primitive["attributes"][name]) for name in names}
+            if "indices" in primitive:
+                indices = read_accessor(gltf, bin_chunk, primitive["indices"]).ravel().astype(np.int64)
+            else:
+                indices = np.arange(len(attributes[names[0]]), dtype=np.int64)
+            if len(indices) % 3 or (len(indices) and indices.max() >= len(attributes[names[0]])):
+                raise MeshError("invalid indices")
+
+            result = weld_primitive(attributes, indices, tolerance)
+            if result is None:
+                continue
+            vertices, new_indices = result
+
+            # New accessors are appended to a copy of the chunk, the old ones are removed at the end
+            if new_bin is None:
+                new_bin = bytearray(bin_chunk)
+            for name in names:
+                accessor_index = primitive["attributes"][name]
+                replaced.append(accessor_index)
+                primitive["attributes"][name] = append_accessor(gltf, new_bin, attributes[name][vertices], gltf["accessors"][accessor_index], ARRAY_BUFFER)
+
+            index_type = (5123, "<u2") if len(vertices) < 65535 else (5125, "<u4")
+            template = {"componentType": index_type[0], "type": "SCALAR"}
+            if "indices" in primitive:
+                replaced.append(primitive["indices"])
+            primitive["indices"] = append_accessor(gltf, new_bin, new_indices.astype(index_type[1]), template, ELEMENT_ARRAY_BUFFER)
+
+    if new_bin is None:
+        return bin_chunk
+    return remove_accessors(gltf, new_bin, replaced)
+
+# Weld the glb at src into dst. Raises MeshError when the file is not supported.
+def weld_glb(src : str, dst : str, tolerance : float):
+    if not is_available():
+        raise MeshError("numpy is not installed")
+
+    with GltfFile(src) as gltf:
+        bin_chunk = weld_gltf(gltf.json, gltf.bin, max(tolerance, 0))
+        write_glb(dst, gltf.json, bin_chunk)
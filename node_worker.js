@@ -0,0 +1,170 @@
+// Long-lived gltf-pipeline / gltf-transform worker driven by node_worker.py.
+// Requests and responses are one JSON object per line on stdin / stdout:
+//   request  : {"id": 1, "method": "transform", "params": {...}}
+//   response : {"id": 1, "result": {...}} or {"id": 1, "error": {"message": "..."}}
+// Modules are resolved from the global npm root passed in GLTF_OPTIMIZER_NPM_ROOT.
+
+const fs = require('fs');
+const path = require('path');
+const readline = require('readline');
+const { createRequire } = require('module');
+const { pathToFileURL } = require('url');
+
+// stdout is reserved for responses
+console.log = console.error;
+console.info = console.error;
+console.warn = console.error;
+
+const npmRoot = process.env.GLTF_OPTIMIZER_NPM_ROOT || '';
+
+//----------------------------------------------
+// Module loading
+
+// Dependencies of a global package are nested in its own node_modules,
+// so resolve from the package that provides them.
+function requireFrom(owner, name) {
+    const bases = [path.join(npmRoot, owner, 'package.json'), path.join(npmRoot, 'package.json'), __filename];
+    let lastError;
+    for (const base of bases) {
+        try {
+            const req = createRequire(base);
+            return { req, resolved: req.resolve(name) };
+        } catch (error) {
+            lastError = error;
+        }
+    }
+    throw lastError;
+}
+
+async function load(owner, name) {
+    const { req, resolved } = requireFrom(owner, name);
+    try {
+        return req(resolved);
+    } catch (error) {
+        if (error.code !== 'ERR_REQUIRE_ESM') throw error;
+        return import(pathToFileURL(resolved).href);
+    }
+}
+
+let modules = null;
+async function loadModules() {
+    if (modules) return modules;
+
+    const cli = '@gltf-transform/cli';
+    const core = await load(cli, '@gltf-transform/core');
+    const extensions = await load(cli, '@gltf-transform/extensions');
+    const functions = await load(cli, '@gltf-transform/functions');
+    const draco3d = await load(cli, 'draco3dgltf');
+    const meshoptimizer = await load(cli, 'meshoptimizer');
+    const pipeline = await load('gltf-pipeline', 'gltf-pipeline');
+
+    await meshoptimizer.MeshoptSimplifier.ready;
+    await meshoptimizer.MeshoptEncoder.ready;
+    await meshoptimizer.MeshoptDecoder.ready;
+
+    const io = new core.NodeIO()
+        .registerExtensions(extensions.ALL_EXTENSIONS)
+        .registerDependencies({
+            'draco3d.decoder': await draco3d.createDecoderModule(),
+            'draco3d.encoder': await draco3d.createEncoderModule(),
+            'meshopt.decoder': meshoptimizer.MeshoptDecoder,
+            'meshopt.encoder': meshoptimizer.MeshoptEncoder,
+        });
+
+    modules = { core, functions, meshoptimizer, pipeline, io };
+    return modules;
+}
+
+//----------------------------------------------
+// gltf-pipeline, same options as the CLI with --keepUnusedElements --keepLegacyExtensions
+
+async function runPipeline({ src, dst, binary, separateTextures }) {
+    const { pipeline } = await loadModules();
+    const options = {
+        resourceDirectory: path.dirname(src),
+        separateTextures: Boolean(separateTextures),
+        keepUnusedElements: true,
+        keepLegacyExtensions: true,
+    };
+
+    const input = fs.readFileSync(src);
+    const isGlb = path.extname(src).toLowerCase() === '.glb';
+    let results;
+    if (binary) {
+        results = isGlb ? await pipeline.processGlb(input, options) : await pipeline.gltfToGlb(JSON.parse(input), options);
+    } else {
+        results = isGlb ? await pipeline.glbToGltf(input, options) : await pipeline.processGltf(JSON.parse(input), options);
+    }
+
+    const outputDirectory = path.dirname(dst);
+    fs.mkdirSync(outputDirectory, { recursive: true });
+    if (binary) {
+        fs.writeFileSync(dst, results.glb);
+    } else {
+        fs.writeFileSync(dst, JSON.stringify(results.gltf));
+    }
+    for (const [relativePath, resource] of Object.entries(results.separateResources || {})) {
+        fs.writeFileSync(path.join(outputDirectory, relativePath), resource);
+    }
+    return {};
+}
+
+//----------------------------------------------
+// gltf-transform, every step runs on the same in-memory document
+
+async function transformStep({ functions, meshoptimizer }, name, options) {
+    switch (name) {
+        case 'weld':
+            return functions.weld(options);
+        case 'simplify':
+            return functions.simplify({ simplifier: meshoptimizer.MeshoptSimplifier, ...options });
+        case 'draco':
+            return functions.draco(options);
+        case 'meshopt':
+            return functions.meshopt({ encoder: meshoptimizer.MeshoptEncoder, ...options });
+        default:
+            throw new Error(`unknown transform step: ${name}`);
+    }
+}
+
+async function runTransform({ src, dst, steps }) {
+    const loaded = await loadModules();
+    const document = await loaded.io.read(src);
+    for (const [name, options] of steps) {
+        await document.transform(await transformStep(loaded, name, options));
+    }
+    await loaded.io.write(dst, document);
+    return {};
+}
+
+//----------------------------------------------
+
+const methods = {
+    ready: async () => {
+        await loadModules();
+        return {};
+    },
+    pipeline: runPipeline,
+    transform: runTransform,
+};
+
+const input = readline.createInterface({ input: process.stdin });
+let queue = Promise.resolve();
+
+// Requests are answered in order, one at a time
+input.on('line', (line) => {
+    queue = queue.then(async () => {
+        let request;
+        try {
+            request = JSON.parse(line);
+            const method = methods[request.method];
+            if (!method) throw new Error(`unknown method: ${request.method}`);
+            const result = await method(request.params || {});
+            process.stdout.write(JSON.stringify({ id: request.id, result }) + '\n');
+        } catch (error) {
+            const id = request ? request.id : null;
+            process.stdout.write(JSON.stringify({ id, error: { message: String(error && error.message || error) } }) + '\n');
+        }
+    });
+});
+input.on('close', () => queue.then(() => process.exit(0)));
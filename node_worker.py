@@ -0,0 +1,184 @@
+import json
+import os
+import queue
+import subprocess
+import threading
+from typing import List, Tuple
+
+from directory import get_bundle_dir
+from tracing import ToolError
+
+#----------------------------------------------
+# Pool of warm Node.js processes running node_worker.js.
+# gltf-pipeline and gltf-transform are loaded once per process instead of once per command,
+# and the gltf-transform steps of a model run on one in-memory document.
+# Any failure returns False so that the caller can fall back to the CLI command, except a call running longer
+# than its timeout : the worker is killed (the pool starts a new one for the next call) and ToolError is raised,
+# as Tracer.run does for a CLI command, the CLI would most likely hang on the same file.
+
+class NodeWorkerError(Exception):
+    pass
+
+# Seconds a worker may take to start and load the modules
+READY_TIMEOUT = 60
+
+# gltf-pipeline commands of Config.ModelSetting : (binary, separate textures)
+pipeline_commands = {
+    "to_glb": (True, False),
+    "to_glb_separate": (True, True),
+    "to_gltf_separate": (False, True),
+}
+
+def get_npm_root() -> str:
+    try:
+        result = subprocess.run(["npm", "root", "-g"], capture_output=True, text=True)
+        return result.stdout.strip()
+    except OSError:
+        return ""
+
+class NodeWorker:
+    def __init__(self, env):
+        self.process = subprocess.Popen(
+            ["node", os.path.join(get_bundle_dir(), "node_worker.js")],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env, text=True, bufsize=1)
+        self.request_id = 0
+        # The responses are read by a thread, so that a call can wait for its response with a timeout
+        self.lines = queue.Queue()
+        threading.Thread(target=self.read_lines, name="node-worker-reader", daemon=True).start()
+
+    def read_lines(self):
+        for line in self.process.stdout:
+            self.lines.put(line)
+        self.lines.put("")
+
+    # timeout : seconds to wait for the response, None waits forever. On expiry the worker is killed.
+    def call(self, method : str, timeout : float = None, **params):
+        self.request_id += 1
+        try:
+            self.process.stdin.write(json.dumps({"id": self.request_id, "method": method, "params": params}) + "\n")
+            self.process.stdin.flush()
+        except OSError as e:
+            raise NodeWorkerError(str(e))
+
+        try:
+            line = self.lines.get(timeout=timeout)
+        except queue.Empty:
+            self.kill()
+            raise subprocess.TimeoutExpired(method, timeout)
+
+        if not line:
+            raise NodeWorkerError("node worker exited with {}".format(self.process.poll()))
+
+        response = json.loads(line)
+        if "error" in response:
+            raise NodeWorkerError(response["error"]["message"])
+        return response["result"]
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+    def close(self):
+        if self.is_alive():
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+class NodeWorkerPool:
+    def __init__(self, size : int):
+        self.size = size
+        self.idle : List[NodeWorker] = []
+        self.started = 0
+        self.enabled = size > 0
+        # Waiters for an idle worker are woken when a worker is released, dies or fails to start
+        self.condition = threading.Condition()
+        self.env = None
+
+    def start_worker(self) -> NodeWorker:
+        if self.env is None:
+            self.env = dict(os.environ)
+            self.env["GLTF_OPTIMIZER_NPM_ROOT"] = get_npm_root()
+
+        worker = NodeWorker(self.env)
+        try:
+            worker.call("ready", READY_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            raise NodeWorkerError("node worker did not start in {}s".format(READY_TIMEOUT))
+        except NodeWorkerError:
+            worker.close()
+            raise
+        return worker
+
+    # An idle worker, or a new one while the pool is not full. Raises NodeWorkerError once a worker failed to start.
+    def acquire(self) -> NodeWorker:
+        with self.condition:
+            while True:
+                if not self.enabled:
+                    raise NodeWorkerError("node workers are disabled")
+                if self.idle:
+                    return self.idle.pop()
+                if self.started < self.size:
+                    self.started += 1
+                    break
+                self.condition.wait()
+
+        try:
+            return self.start_worker()
+        except (OSError, NodeWorkerError) as e:
+            with self.condition:
+                self.started -= 1
+                if self.enabled:
+                    print("Node worker is not available, fallback to the CLI: {}".format(e))
+                self.enabled = False
+                self.condition.notify_all()
+            raise NodeWorkerError(str(e))
+
+    # A dead worker frees its place, the next waiter starts a replacement
+    def release(self, worker : NodeWorker):
+        with self.condition:
+            if worker.is_alive():
+                self.idle.append(worker)
+            else:
+                self.started -= 1
+            self.condition.notify()
+
+    # Raises ToolError when the call runs longer than timeout seconds, None waits forever
+    def call(self, method : str, timeout : float = None, **params) -> bool:
+        if not self.enabled:
+            return False
+
+        try:
+            worker = self.acquire()
+        except NodeWorkerError:
+            return False
+
+        try:
+            worker.call(method, timeout, **params)
+            return True
+        except subprocess.TimeoutExpired:
+            # The killed worker is not reused, release lets the next acquire start a new one
+            raise ToolError("node:{} failed with exit code timeout: {}".format(method, os.path.basename(params.get("dst", ""))))
+        except NodeWorkerError as e:
+            print("Node worker {} failed, fallback to the CLI: {}".format(method, e))
+            return False
+        finally:
+            self.release(worker)
+
+    def pipeline(self, command : str, src : str, dst : str, timeout : float = None) -> bool:
+        binary, separate_textures = pipeline_commands[command]
+        return self.call("pipeline", timeout, src=src, dst=dst, binary=binary, separateTextures=separate_textures)
+
+    # steps : [(gltf-transform function name, options)]
+    def transform(self, src : str, dst : str, steps : List[Tuple[str, dict]], timeout : float = None) -> bool:
+        return self.call("transform", timeout, src=src, dst=dst, steps=steps)
+
+    def close(self):
+        with self.condition:
+            workers, self.idle = self.idle, []
+        for worker in workers:
+            worker.close()
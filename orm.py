@@ -0,0 +1,168 @@
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+import texture
+
+from gltf_container import write_gltf
+from mesh import supported_extension_prefixes, used_extensions
+
+#----------------------------------------------
+# ORM packing of the materials of a texture-separated gltf, with "pack_orm": true in the config.
+# A material with both an occlusionTexture and a metallicRoughnessTexture gets one image instead of two :
+# occlusion in R (from the R channel of its image), roughness in G and metallic in B (from the G and B channels
+# of the metallic-roughness image), at the larger of the two sizes. Both references of the material point to the
+# texture of the packed image, the materials with the same pair of images share it.
+# A pair is packed only when both references use the same texCoord and sampler, without a texture transform,
+# and both images are 8 bit files next to the gltf.
+# The textures and images no reference uses anymore are removed from the gltf, so that they are not encoded,
+# unless an extension outside of the known KHR_ / EXT_ ones may reference them by index.
+# Requires Pillow, otherwise the materials are left as they are.
+
+def is_available() -> bool:
+    return texture.is_available()
+
+def texture_info_refs(node, refs : List[dict], key : str = ""):
+    # Texture references are the textureInfo objects of the materials and their extensions : "<name>Texture": {"index": n}
+    if isinstance(node, dict):
+        if key.endswith("Texture") and isinstance(node.get("index"), int):
+            refs.append(node)
+        for child_key, value in node.items():
+            texture_info_refs(value, refs, child_key)
+    elif isinstance(node, list):
+        for value in node:
+            texture_info_refs(value, refs, key)
+    return refs
+
+# Image of a texture, None for the textures whose image is defined by an extension
+def texture_image(gltf_data : dict, texture_index : int) -> Optional[int]:
+    gltf_texture = gltf_data["textures"][texture_index]
+    if gltf_texture.get("extensions"):
+        return None
+    return gltf_texture.get("source")
+
+def image_path(gltf_data : dict, base_path : str, image_index : Optional[int]) -> Optional[str]:
+    if image_index is None:
+        return None
+    uri = gltf_data["images"][image_index].get("uri", "")
+    if not uri or uri.startswith("data:"):
+        return None
+    path = os.path.join(base_path, unquote(uri))
+    return path if os.path.isfile(path) else None
+
+def open_channels(path : str):
+    image = texture.open_image(path)
+    # 16 bit images would be clipped by the 8 bit merge
+    if image.mode == "I;16":
+        return None
+    return image.convert("RGB")
+
+# Write the packed image of the occlusion image and the metallic-roughness image
+def pack_image(occlusion_path : str, metallic_roughness_path : str, packed_path : str) -> bool:
+    occlusion = open_channels(occlusion_path)
+    metallic_roughness = open_channels(metallic_roughness_path)
+    if occlusion is None or metallic_roughness is None:
+        return False
+
+    size = max(occlusion.size, metallic_roughness.size, key=lambda size: size[0] * size[1])
+    if occlusion.size != size:
+        occlusion = occlusion.resize(size, texture.resample_filter())
+    if metallic_roughness.size != size:
+        metallic_roughness = metallic_roughness.resize(size, texture.resample_filter())
+
+    red = occlusion.getchannel("R")
+    green, blue = metallic_roughness.getchannel("G"), metallic_roughness.getchannel("B")
+    texture.Image.merge("RGB", (red, green, blue)).save(packed_path, format="PNG")
+    return True
+
+# Remove the textures and images no reference uses, and renumber the references
+def remove_unused(gltf_data : dict, refs : List[dict]) -> int:
+    textures = gltf_data.get("textures", [])
+    images = gltf_data.get("images", [])
+
+    used_textures = sorted({ref["index"] for ref in refs})
+    texture_map = {old: new for new, old in enumerate(used_textures)}
+    textures = [textures[index] for index in used_textures]
+    for ref in refs:
+        ref["index"] = texture_map[ref["index"]]
+
+    # Images are referenced by the textures, directly or through an image extension (KHR_texture_basisu, EXT_texture_webp...)
+    sources = [gltf_texture for gltf_texture in textures if "source" in gltf_texture]
+    sources += [extension for gltf_texture in textures for extension in gltf_texture.get("extensions", {}).values() if isinstance(extension, dict) and "source" in extension]
+    used_images = sorted({source["source"] for source in sources})
+    image_map = {old: new for new, old in enumerate(used_images)}
+    removed = len(images) - len(used_images)
+    for source in sources:
+        source["source"] = image_map[source["source"]]
+
+    if textures:
+        gltf_data["textures"] = textures
+    else:
+        gltf_data.pop("textures", None)
+    if used_images:
+        gltf_data["images"] = [images[index] for index in used_images]
+    else:
+        gltf_data.pop("images", None)
+    return removed
+
+# Pack the materials of gltf_path in place, returns (materials packed, images written, images removed)
+def pack_materials(gltf_path : str) -> Tuple[int, int, int]:
+    with open(gltf_path, 'r') as file:
+        gltf_data = json.load(file)
+    base_path = os.path.dirname(gltf_path)
+    stem = os.path.splitext(os.path.basename(gltf_path))[0]
+
+    # {(occlusion image, metallic-roughness image, sampler) : packed texture}
+    packed : Dict[tuple, int] = {}
+    materials = 0
+    for material in gltf_data.get("materials", []):
+        occlusion_info = material.get("occlusionTexture")
+        metallic_roughness_info = material.get("pbrMetallicRoughness", {}).get("metallicRoughnessTexture")
+        if not occlusion_info or not metallic_roughness_info or occlusion_info["index"] == metallic_roughness_info["index"]:
+            continue
+        if occlusion_info.get("extensions") or metallic_roughness_info.get("extensions"):
+            continue
+        if occlusion_info.get("texCoord", 0) != metallic_roughness_info.get("texCoord", 0):
+            continue
+
+        occlusion_texture = gltf_data["textures"][occlusion_info["index"]]
+        metallic_roughness_texture = gltf_data["textures"][metallic_roughness_info["index"]]
+        if occlusion_texture.get("sampler") != metallic_roughness_texture.get("sampler"):
+            continue
+        occlusion_image = texture_image(gltf_data, occlusion_info["index"])
+        metallic_roughness_image = texture_image(gltf_data, metallic_roughness_info["index"])
+        occlusion_path = image_path(gltf_data, base_path, occlusion_image)
+        metallic_roughness_path = image_path(gltf_data, base_path, metallic_roughness_image)
+        if not occlusion_path or not metallic_roughness_path:
+            continue
+
+        key = (occlusion_image, metallic_roughness_image, metallic_roughness_texture.get("sampler"))
+        if key not in packed:
+            # Already packed by the source when both references use the same image
+            if occlusion_image == metallic_roughness_image:
+                continue
+            uri = "{}_orm{}.png".format(stem, len(packed))
+            if not pack_image(occlusion_path, metallic_roughness_path, os.path.join(base_path, uri)):
+                continue
+            gltf_data.setdefault("images", []).append({"uri": uri, "mimeType": "image/png"})
+            packed_texture = {"source": len(gltf_data["images"]) - 1}
+            if "sampler" in metallic_roughness_texture:
+                packed_texture["sampler"] = metallic_roughness_texture["sampler"]
+            gltf_data["textures"].append(packed_texture)
+            packed[key] = len(gltf_data["textures"]) - 1
+
+        occlusion_info["index"] = packed[key]
+        metallic_roughness_info["index"] = packed[key]
+        materials += 1
+
+    if not materials:
+        return 0, 0, 0
+
+    # The unused textures and images are only removed when every reference to them is known
+    removed = 0
+    if all(extension.startswith(supported_extension_prefixes) for extension in used_extensions(gltf_data, set())):
+        removed = remove_unused(gltf_data, texture_info_refs(gltf_data.get("materials", []), []) + texture_info_refs(gltf_data.get("extensions", {}), []))
+
+    write_gltf(gltf_path, gltf_data)
+    return materials, len(packed), removed
@@ -0,0 +1,150 @@
+import concurrent.futures
+import json
+import os
+import shutil
+import subprocess
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import mesh
+import texture
+
+from config import Config
+
+#----------------------------------------------
+# Preflight of a run, before the workspace is created and before any model is converted.
+# The tools the config calls are resolved on the PATH once and probed for their version once : the result is
+# remembered in tools.json of the cache folder per resolved path, size and modification time of the binary,
+# so a later run only stats the binaries. The probes of the tools not known yet run in parallel
+# (the node based CLIs take most of a second to start).
+# A missing tool, or one that cannot be started (e.g. a gltf-transform shim without node), fails the run
+# in milliseconds instead of failing every task that calls it minutes later.
+
+TOOLS_FILE_NAME = "tools.json"
+PROBE_TIMEOUT = 30
+
+# Version argument of every tool, cp is only resolved
+version_args = {
+    "toktx": ["--version"],
+    "gltf-pipeline": ["--version"],
+    "gltf-transform": ["--version"],
+    "mogrify": ["-version"],
+    "node": ["--version"],
+}
+
+install_hints = {
+    "toktx": "install KTX-Software, https://github.com/KhronosGroup/KTX-Software/releases",
+    "gltf-pipeline": "npm install -g gltf-pipeline",
+    "gltf-transform": "npm install -g @gltf-transform/cli",
+    "mogrify": "install ImageMagick, or pip install Pillow",
+    "cp": "install coreutils, or pip install Pillow",
+    "node": "install Node.js, the CLI tools are used meanwhile",
+}
+
+# A run without these tools still works, e.g. without node the gltf tools run through their CLI
+optional_tools = ("node",)
+
+@dataclass
+class ToolInfo:
+    name: str
+    # Resolved path, None when the tool is not on the PATH
+    path: Optional[str] = None
+    version: str = ""
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+# A LOD calls gltf-transform for the weld (unless welded by NumPy), the simplify and the compression
+def uses_gltf_transform(model_setting : Config.ModelSetting) -> bool:
+    numpy_weld = model_setting.weld_engine == "numpy" and mesh.is_available()
+    return (model_setting.tolerance != -1 and not numpy_weld) or model_setting.ratio != -1 or model_setting.target_bytes > 0 or model_setting.compression != "none"
+
+# Tools a run of config calls
+def required_tools(config : Config, node_workers : int = 0) -> List[str]:
+    names = ["toktx", "gltf-pipeline"]
+    if any(uses_gltf_transform(model_setting) for model_setting in config.model_settings):
+        names.append("gltf-transform")
+    # Without Pillow the images are copied and resized by imagemagick
+    if not texture.is_available():
+        names += ["cp", "mogrify"]
+    if node_workers > 0:
+        names.append("node")
+    return names
+
+def binary_stamp(path : str) -> list:
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+# Start the tool with its version argument. Exit codes 126 and 127 are the ones of a shell or env that could not
+# start the program (missing interpreter), other codes still print a version with some builds.
+def probe(name : str, path : str) -> ToolInfo:
+    if name not in version_args:
+        return ToolInfo(name, path)
+    try:
+        result = subprocess.run([path] + version_args[name], capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return ToolInfo(name, path, error="no answer to {} in {}s".format(" ".join(version_args[name]), PROBE_TIMEOUT))
+    except OSError as e:
+        return ToolInfo(name, path, error="cannot be started: {}".format(e))
+    output = (result.stdout.strip() or result.stderr.strip()).splitlines()
+    if result.returncode in (126, 127):
+        return ToolInfo(name, path, error="cannot be started: {}".format(output[0] if output else "exit code {}".format(result.returncode)))
+    return ToolInfo(name, path, output[0].strip()[:80] if output else "")
+
+def load_known_tools(cache_path : Optional[str]) -> dict:
+    if not cache_path:
+        return {}
+    try:
+        with open(os.path.join(cache_path, TOOLS_FILE_NAME), 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def save_known_tools(cache_path : str, known : dict):
+    path = os.path.join(cache_path, TOOLS_FILE_NAME)
+    try:
+        os.makedirs(cache_path, exist_ok=True)
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path, 'w') as file:
+            json.dump(known, file, indent=1, sort_keys=True)
+        os.replace(temp_path, path)
+    except OSError:
+        pass
+
+# Resolve and probe the tools, {name : ToolInfo}. cache_path : folder of tools.json, None probes every tool.
+def discover(names : List[str], cache_path : str = None) -> Dict[str, ToolInfo]:
+    known = load_known_tools(cache_path)
+    tools : Dict[str, ToolInfo] = {}
+    probes = {}
+    for name in names:
+        path = shutil.which(name)
+        if path is None:
+            tools[name] = ToolInfo(name, error="not found on the PATH, {}".format(install_hints[name]))
+            continue
+        path = os.path.realpath(path)
+        entry = known.get(name)
+        if entry and entry["path"] == path and entry["stamp"] == binary_stamp(path):
+            tools[name] = ToolInfo(name, path, entry["version"])
+        else:
+            probes[name] = path
+
+    if probes:
+        with concurrent.futures.ThreadPoolExecutor(len(probes), thread_name_prefix="preflight") as pool:
+            for tool in pool.map(lambda name: probe(name, probes[name]), probes):
+                tools[tool.name] = tool
+                # Only the tools that start are remembered, a fixed install is probed again
+                if tool.ok:
+                    known[tool.name] = {"path": tool.path, "stamp": binary_stamp(tool.path), "version": tool.version}
+        if cache_path:
+            save_known_tools(cache_path, known)
+
+    return {name: tools[name] for name in names}
+
+# Errors of the required tools, one line per tool, empty when the run can start
+def tool_errors(tools : Dict[str, ToolInfo]) -> List[str]:
+    return ["{}: {}".format(tool.name, tool.error) for tool in tools.values() if not tool.ok and tool.name not in optional_tools]
+
+def summary(tools : Dict[str, ToolInfo]) -> str:
+    return ", ".join("{} ({})".format(tool.name, tool.version or "?") if tool.ok else "{} missing".format(tool.name) for tool in tools.values())
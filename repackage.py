@@ -0,0 +1,98 @@
+import json
+import os
+from typing import Dict, List
+
+from config import Config
+from directory import convert_file_path
+from gltf_container import GltfFile, remove_image_buffer_views, write_glb, write_gltf
+from tracing import tracer
+
+#----------------------------------------------
+# Final step of a LOD : the compressed mesh is written with the images, samplers, textures and materials
+# of the base gltf, its images pointing to the ktx2 textures. Shared by the CLI and the library API.
+
+# Extensions of the mesh data, set by the compression step
+compression_extensions = ["KHR_draco_mesh_compression", "EXT_meshopt_compression", "KHR_mesh_quantization"]
+
+# The extensions of the original without its mesh extensions, plus the mesh extensions of the compressed mesh
+def mesh_extensions(original : List[str], compressed : List[str]) -> List[str]:
+    extensions = [extension for extension in original if extension not in compression_extensions]
+    return extensions + [extension for extension in compressed if extension in compression_extensions and extension not in extensions]
+
+def add_extension(extensions_used : List[str], extensions_required : List[str], extension : str):
+    if extension not in extensions_used:
+        extensions_used.append(extension)
+    if extension not in extensions_required:
+        extensions_required.append(extension)
+
+# Write the glb and the texture-separated gltf of a model in workspace, returns the written paths
+def write_model(model_setting : Config.ModelSetting, workspace : str, output_exts : List[str], file_path : str, gltf_data : dict, bin_chunk) -> List[str]:
+    output_paths = []
+    if ".gltf" in output_exts:
+        output_paths.append(convert_file_path(file_path, workspace, "{}.gltf".format(model_setting.suffix)))
+        write_gltf(output_paths[-1], gltf_data, bin_chunk)
+    output_paths.append(convert_file_path(file_path, workspace, "{}.glb".format(model_setting.suffix)))
+    write_glb(output_paths[-1], gltf_data, bin_chunk)
+    return output_paths
+
+# Write the LOD of the base gltf file_path from its compressed mesh, returns the written paths.
+# texture_names : {image uri of the model : ktx2 file name of its unique image}
+def repackage_model(model_setting : Config.ModelSetting, workspace : str, output_exts : List[str], file_path : str, compressed_path : str,
+                    texture_names : Dict[str, str]) -> List[str]:
+    asset = os.path.basename(convert_file_path(file_path, workspace, "{}.glb".format(model_setting.suffix)))
+
+    with open(file_path, 'r') as file:
+        gltf_data = json.load(file)
+
+    if not gltf_data.get("buffers", []):
+        with tracer.span("repackage", asset, [compressed_path]) as record, GltfFile(compressed_path) as gltf:
+            record["outputs"] = write_model(model_setting, workspace, output_exts, file_path, gltf.json, gltf.bin)
+        return record["outputs"]
+
+    # Remember value before optimize
+    extensionsUsed = gltf_data.get("extensionsUsed", [])
+    extensionsRequired = gltf_data.get("extensionsRequired", [])
+
+    samplers = gltf_data.get("samplers", [])
+    textures = gltf_data.get("textures", [])
+    materials = gltf_data.get("materials", [])
+    images = gltf_data.get("images", [])
+
+    with tracer.span("repackage", asset, [compressed_path]) as record, GltfFile(compressed_path) as gltf:
+        gltf_data = gltf.json
+
+        # The mesh extensions are the ones of the compressed mesh : the compression of this LOD (and its quantization),
+        # not the one of the source
+        extensionsUsed = mesh_extensions(extensionsUsed, gltf_data.get("extensionsUsed", []))
+        extensionsRequired = mesh_extensions(extensionsRequired, gltf_data.get("extensionsRequired", []))
+
+        # Change the texture to the ktx2 extension in the finally created gltf and register the extension.
+        # The images embedded by to_glb get back the uri of the separated base image.
+        add_extension(extensionsUsed, extensionsRequired, "KHR_texture_basisu")
+        if images:
+            optimized_images = gltf_data.setdefault("images", [])
+            for index, image in enumerate(images):
+                if index == len(optimized_images):
+                    optimized_images.append(dict(image))
+                if "uri" in image:
+                    path, name = os.path.split(image["uri"])
+                    new_name = texture_names.get(image["uri"], os.path.splitext(name)[0] + ".ktx2")
+                    optimized_images[index]["mimeType"] = "image/ktx2"
+                    optimized_images[index]["uri"] = os.path.join(path, new_name)
+
+        # The mesh extensions and KHR_texture_basisu are added to the extension defined in the original..
+        gltf_data["extensionsUsed"] = extensionsUsed
+        gltf_data["extensionsRequired"] = extensionsRequired
+
+        # When optimizing through gltf-transform, sampler, texture, and material
+        # that are judged not to be used in the gltf official schema are removed.
+        # Lightmap or texuture defined in extended implementation may also be omitted,
+        # so the previous value is restored.
+        gltf_data["samplers"] = samplers
+        gltf_data["textures"] = textures
+        gltf_data["materials"] = materials
+
+        # The ktx2 textures are referenced by uri, their embedded png are dropped from the buffer
+        bin_chunk = remove_image_buffer_views(gltf_data, gltf.bin)
+        record["outputs"] = write_model(model_setting, workspace, output_exts, file_path, gltf_data, bin_chunk)
+    return record["outputs"]
@@ -0,0 +1,52 @@
+from budget import BudgetCache
+from cache import TextureCache
+from executor import ResourceExecutor
+from journal import Journal
+from manifest import BuildManifest
+from node_worker import NodeWorkerPool
+from scheduler import Scheduler
+from scratch import Scratch
+from texture_registry import TextureRegistry
+from tracing import tracer
+
+#----------------------------------------------
+# Services shared by the tasks of a run.
+# The executor, the caches and the node workers live as long as the process (all the builds of --watch),
+# the scheduler, the manifest, the texture registry, the journal and the scratch are replaced at the start of every build.
+class Runtime:
+    def __init__(self, executor : ResourceExecutor, cache : TextureCache, node_pool : NodeWorkerPool, trace_path : str = None, workspace_path : str = None,
+                 resume_run_id : str = None, max_scratch : int = 0, budgets : BudgetCache = None):
+        self.executor = executor
+        self.cache = cache
+        # Settings chosen for the target_bytes of the LODs and textures, see budget.py
+        self.budgets = budgets
+        self.node_pool = node_pool
+        self.trace_path = trace_path
+        # Root of the build workspaces, None for the default one next to the script
+        self.workspace_path = workspace_path
+        # Run id of the workspace the first build resumes, see journal.py
+        self.resume_run_id = resume_run_id
+        # Bytes of intermediates the workspace may hold, 0 keeps them until the end of the build
+        self.max_scratch = max_scratch
+        self.scheduler : Scheduler = None
+        self.manifest : BuildManifest = None
+        self.textures : TextureRegistry = None
+        self.journal : Journal = None
+        self.scratch : Scratch = None
+        self.update_mode = False
+
+    def begin(self, manifest : BuildManifest, update_mode : bool, textures : TextureRegistry, journal : Journal):
+        self.executor.reset_stats()
+        tracer.reset()
+        if self.cache:
+            self.cache.reset_stats()
+        self.scratch = Scratch(self.max_scratch)
+        self.scheduler = Scheduler(self.executor, self.scratch)
+        self.manifest = manifest
+        self.textures = textures
+        self.journal = journal
+        self.update_mode = update_mode
+
+    def close(self):
+        self.executor.shutdown()
+        self.node_pool.close()
@@ -0,0 +1,204 @@
+import concurrent.futures
+import heapq
+import itertools
+import os
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Iterable, List
+
+from executor import CPU, IO, ResourceExecutor
+from scratch import Scratch
+from tracing import tracer
+
+#----------------------------------------------
+# Dependency graph scheduler.
+# Every unit of work (base conversion, texture tier, LOD ...) is a task that starts as soon as
+# the tasks it depends on are done, instead of waiting for a whole stage to finish.
+# Ready tasks are started in critical path order : the rank of a task is its own cost plus
+# the largest rank among the tasks that depend on it, so large assets are started first.
+# Tasks may add new tasks while running, e.g. a base conversion adds the tasks of its textures.
+# A CPU task only starts when the threads it declares fit in the core budget of the executor.
+# Every task is traced as the stage "task:<name prefix>", e.g. "task:convert" for "convert:<path>".
+# Tasks declare the intermediates they write or read, removed when the last of them finishes, and the tasks
+# that start a model declare the scratch bytes they need, they wait until the scratch budget has room (see scratch.py).
+
+PENDING = 0
+READY = 1
+RUNNING = 2
+DONE = 3
+FAILED = 4
+
+class Task:
+    def __init__(self, name : str, function : Callable, args : tuple, cost : float, kind : str, threads : int, scratch : List[str], scratch_estimate : int):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.cost = cost
+        self.kind = kind
+        self.threads = threads
+        self.scratch = scratch
+        self.scratch_estimate = scratch_estimate
+        self.start_time = 0.0
+        self.rank = cost
+        self.state = PENDING
+        self.deps : List[Task] = []
+        self.dependents : List[Task] = []
+        self.remaining = 0
+        self.error = None
+        self.result = None
+
+class Scheduler:
+    def __init__(self, executor : ResourceExecutor, scratch : Scratch = None):
+        self.executor = executor
+        self.scratch = scratch or Scratch()
+        self.tasks : Dict[str, Task] = {}
+        self.ready = []
+        self.running = 0
+        self.unfinished = 0
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    # Returns False when a task with the same name already exists.
+    # scratch : intermediates the task writes or reads, scratch_estimate : scratch bytes needed to start it
+    def add(self, name : str, function : Callable, *args, deps : Iterable[str] = (), cost : float = 1, kind : str = CPU, threads : int = 1,
+            scratch : Iterable[str] = (), scratch_estimate : int = 0) -> bool:
+        with self.condition:
+            if name in self.tasks:
+                return False
+
+            task = Task(name, function, args, cost, kind, threads, list(scratch), scratch_estimate)
+            self.tasks[name] = task
+            self.unfinished += 1
+            self.scratch.hold(task.scratch)
+
+            failed = False
+            for dep_name in deps:
+                dep = self.tasks[dep_name]
+                task.deps.append(dep)
+                if dep.state == FAILED:
+                    failed = True
+                elif dep.state != DONE:
+                    dep.dependents.append(task)
+                    task.remaining += 1
+                    self.raise_rank(dep, task.rank)
+
+            if failed:
+                self.fail(task, "dependency failed")
+            elif task.remaining == 0:
+                self.push_ready(task)
+
+            self.condition.notify_all()
+            return True
+
+    def raise_rank(self, task : Task, dependent_rank : float):
+        stack = [(task, dependent_rank)]
+        while stack:
+            task, dependent_rank = stack.pop()
+            if task.cost + dependent_rank <= task.rank:
+                continue
+            task.rank = task.cost + dependent_rank
+            # Re-queue with the new rank, the stale heap entry is skipped when popped
+            if task.state == READY:
+                heapq.heappush(self.ready, (-task.rank, next(self.counter), task))
+            for dep in task.deps:
+                if dep.state in (PENDING, READY, RUNNING):
+                    stack.append((dep, task.rank))
+
+    def push_ready(self, task : Task):
+        task.state = READY
+        heapq.heappush(self.ready, (-task.rank, next(self.counter), task))
+
+    def fail(self, task : Task, error):
+        stack = [(task, error)]
+        while stack:
+            task, error = stack.pop()
+            if task.state in (DONE, FAILED):
+                continue
+            task.state = FAILED
+            task.error = error
+            self.unfinished -= 1
+            self.scratch.release(task.scratch)
+            for dependent in task.dependents:
+                stack.append((dependent, "dependency failed: {}".format(task.name)))
+
+    # Highest ranked task that fits in the executor. When the best CPU task does not fit,
+    # no smaller CPU task is started in its place, otherwise it could wait forever.
+    def pop_ready(self) -> Task:
+        skipped = []
+        found = None
+        cpu_blocked = False
+        while self.ready:
+            entry = heapq.heappop(self.ready)
+            rank, count, task = entry
+            if task.state != READY or -rank != task.rank:
+                continue
+            # A new model waits for scratch room, unless nothing else runs
+            if task.scratch_estimate and self.scratch.enabled and self.running > 0 and not self.scratch.has_room(task.scratch_estimate):
+                skipped.append(entry)
+                continue
+            if task.kind == CPU and cpu_blocked:
+                skipped.append(entry)
+                continue
+            if self.executor.can_start(task.kind, task.threads):
+                found = task
+                break
+            skipped.append(entry)
+            if task.kind == CPU:
+                cpu_blocked = True
+
+        for entry in skipped:
+            heapq.heappush(self.ready, entry)
+        return found
+
+    def run_task(self, task : Task):
+        with tracer.span("task:{}".format(task.name.split(":", 1)[0]), os.path.basename(task.name.rsplit(":", 1)[-1])):
+            return task.function(*task.args)
+
+    def finish(self, task : Task, future : concurrent.futures.Future):
+        with self.condition:
+            self.running -= 1
+            self.executor.release(task.kind, task.threads, time.time() - task.start_time)
+            self.scratch.unreserve(task.name)
+            error = future.exception()
+            if error is not None:
+                print("Task {} failed: {}".format(task.name, "".join(traceback.format_exception(type(error), error, error.__traceback__)).strip()))
+                self.fail(task, error)
+            else:
+                task.state = DONE
+                task.result = future.result()
+                self.unfinished -= 1
+                self.scratch.release(task.scratch)
+                for dependent in task.dependents:
+                    dependent.remaining -= 1
+                    if dependent.remaining == 0 and dependent.state == PENDING:
+                        self.push_ready(dependent)
+            self.condition.notify_all()
+
+    # Intermediates written by the running task name, released with the others of the task when it finishes
+    def add_scratch(self, name : str, paths : Iterable[str]):
+        paths = list(paths)
+        with self.condition:
+            self.tasks[name].scratch += paths
+            self.scratch.hold(paths)
+
+    # Run until every task, including the ones added while running, is finished.
+    # Returns the failed tasks.
+    def run(self) -> List[Task]:
+        with self.condition:
+            while self.unfinished > 0:
+                while True:
+                    task = self.pop_ready()
+                    if task is None:
+                        break
+                    task.state = RUNNING
+                    task.start_time = time.time()
+                    if task.scratch_estimate and self.scratch.enabled:
+                        self.scratch.reserve(task.name, task.scratch_estimate)
+                    self.running += 1
+                    future = self.executor.submit(task.kind, task.threads, self.run_task, task)
+                    future.add_done_callback(lambda future, task=task: self.finish(task, future))
+                if self.unfinished > 0:
+                    self.condition.wait()
+
+        return [task for task in self.tasks.values() if task.state == FAILED]
@@ -0,0 +1,91 @@
+import os
+import shutil
+from typing import Dict, Iterable
+
+#----------------------------------------------
+# Intermediate files of a build with --max-scratch.
+# Every task declares the intermediates it writes or reads (base gltf folder, glb, welded and simplified meshes,
+# images, tier png). A path is held by each of these tasks from the moment it is added to the scheduler,
+# and deleted as soon as the last of them finishes, instead of at the end of the build.
+# The bytes of the live intermediates are measured when a task holding them finishes. A model only starts
+# when the measured bytes plus the estimate of the models still converting and of the new model fit
+# in the budget, so a large input set is processed in windows of models that fit on the scratch disk.
+# Without a budget nothing is deleted early, the workspace is removed at the end as before.
+# The methods are not thread-safe, the scheduler calls them under its own lock.
+
+# Scratch bytes of a model being converted, per byte of source : base gltf (base64 buffers), its images and the glb
+estimate_factor = 4
+
+def path_size(path : str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for file_name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, file_name))
+            except OSError:
+                pass
+    return size
+
+class Scratch:
+    def __init__(self, max_bytes : int = 0):
+        self.max_bytes = max_bytes
+        self.refs : Dict[str, int] = {}
+        self.sizes : Dict[str, int] = {}
+        self.reserved : Dict[str, int] = {}
+        self.used = 0
+        self.peak = 0
+        self.deleted = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def hold(self, paths : Iterable[str]):
+        if not self.enabled:
+            return
+        for path in paths:
+            self.refs[path] = self.refs.get(path, 0) + 1
+
+    # Measure the paths a finished task held, then release them
+    def release(self, paths : Iterable[str]):
+        if not self.enabled:
+            return
+        for path in paths:
+            self.measure(path)
+        for path in paths:
+            self.refs[path] -= 1
+            if self.refs[path] == 0:
+                del self.refs[path]
+                self.delete(path)
+
+    def measure(self, path : str):
+        size = path_size(path) if os.path.exists(path) else 0
+        self.used += size - self.sizes.get(path, 0)
+        self.sizes[path] = size
+        self.peak = max(self.peak, self.used + sum(self.reserved.values()))
+
+    def delete(self, path : str):
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+        self.used -= self.sizes.pop(path, 0)
+        self.deleted += 1
+
+    #----------------------------------------------
+    # Admission of new models
+
+    def has_room(self, estimate : int) -> bool:
+        return self.used + sum(self.reserved.values()) + estimate <= self.max_bytes
+
+    def reserve(self, name : str, estimate : int):
+        self.reserved[name] = estimate
+        self.peak = max(self.peak, self.used + sum(self.reserved.values()))
+
+    def unreserve(self, name : str):
+        self.reserved.pop(name, None)
+
+    def summary(self) -> str:
+        return "scratch: peak {:.2f} MB of {:.2f} MB, {} intermediates removed early".format(self.peak / 1048576, self.max_bytes / 1048576, self.deleted)
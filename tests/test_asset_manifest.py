@@ -0,0 +1,31 @@
+from asset_manifest import ASSET_INDEX_MAGIC, ASSET_MANIFEST_VERSION, INDEX_HEADER, INDEX_LOD, INDEX_TIER, build_asset_index
+
+#----------------------------------------------
+
+def test_build_asset_index_layout():
+    asset_manifest = {
+        "version": ASSET_MANIFEST_VERSION,
+        "lods": [
+            {"suffix": "_LOD0", "triangles": 1200, "vertices": 700,
+             "files": [{"uri": "a_LOD0.gltf", "bytes": 10, "sha256": "11" * 32}, {"uri": "a_LOD0.glb", "bytes": 5000, "sha256": "ab" * 32}]},
+            # A LOD without glb is written with zeros
+            {"suffix": "_LOD1", "files": []},
+        ],
+        "tiers": [
+            {"name": "high", "max_size": 2048, "bytes": 300, "gpu_bytes": 4000, "textures": [{}, {}]},
+            {"name": "low", "max_size": 512, "bytes": 30, "gpu_bytes": 400, "textures": [{}]},
+        ],
+    }
+    index = build_asset_index(asset_manifest)
+    assert len(index) == INDEX_HEADER.size + 2 * INDEX_LOD.size + 2 * INDEX_TIER.size
+    assert (INDEX_HEADER.size, INDEX_LOD.size, INDEX_TIER.size) == (16, 48, 24)
+
+    assert INDEX_HEADER.unpack_from(index, 0) == (ASSET_INDEX_MAGIC, ASSET_MANIFEST_VERSION, 2, 2)
+    offset = INDEX_HEADER.size
+    assert INDEX_LOD.unpack_from(index, offset) == (5000, 1200, 700, bytes.fromhex("ab" * 32))
+    offset += INDEX_LOD.size
+    assert INDEX_LOD.unpack_from(index, offset) == (0, 0, 0, bytes(32))
+    offset += INDEX_LOD.size
+    assert INDEX_TIER.unpack_from(index, offset) == (2048, 2, 300, 4000)
+    offset += INDEX_TIER.size
+    assert INDEX_TIER.unpack_from(index, offset) == (512, 1, 30, 400)
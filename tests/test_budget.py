@@ -0,0 +1,37 @@
+import threading
+
+from budget import search
+
+#----------------------------------------------
+# Candidates of decreasing sizes, trial returns the size of the candidate and records the ones built
+
+def sized_trial(sizes : list):
+    tried = []
+    lock = threading.Lock()
+    def trial(index : int) -> int:
+        with lock:
+            tried.append(index)
+        return sizes[index]
+    return trial, tried
+
+def test_search_finds_the_most_detailed_fitting_candidate():
+    sizes = [1000 - 50 * index for index in range(20)]
+    for parallel in (1, 3, 8):
+        trial, tried = sized_trial(sizes)
+        index, measured = search(len(sizes), trial, 620, parallel)
+        # 1000 - 50 * 8 = 600 is the first size within 620
+        assert index == 8
+        assert measured[8] == 600
+        assert len(tried) == len(set(tried)) < len(sizes)
+
+def test_search_stops_after_one_round_when_the_settings_fit():
+    trial, tried = sized_trial([100, 90, 80])
+    assert search(3, trial, 500, 1) == (0, {0: 100})
+    assert tried == [0]
+
+def test_search_keeps_the_last_candidate_when_none_fits():
+    sizes = [1000, 900, 800, 700]
+    trial, tried = sized_trial(sizes)
+    index, measured = search(len(sizes), trial, 10, 2)
+    assert index == 3
+    assert measured[3] == 700
@@ -0,0 +1,24 @@
+from dataclasses import field, make_dataclass
+
+from cache import TextureCache
+from config import Config, changed_fields
+
+#----------------------------------------------
+
+# TextureSetting of a later version, with one more option left at its default
+NewTextureSetting = make_dataclass("TextureSetting", [("new_option", int, field(default=0))], bases=(Config.TextureSetting,))
+
+def test_changed_fields_leaves_out_defaults():
+    assert changed_fields(Config.TextureSetting()) == {}
+    assert changed_fields(Config.TextureSetting(keywords=["_normal"])) == {"keywords": ["_normal"]}
+    assert changed_fields(Config.ModelSetting(suffix="_LOD1", ratio=0.5)) == {"suffix": "_LOD1", "ratio": 0.5}
+
+def test_key_ignores_a_new_default_field(tmp_path):
+    cache = TextureCache(str(tmp_path), 0)
+    texture_setting = Config.TextureSetting(max_size=1024, default_format="uastc")
+    key = cache.key(texture_setting, "0" * 64, False)
+
+    assert cache.key(NewTextureSetting(max_size=1024, default_format="uastc"), "0" * 64, False) == key
+    assert cache.key(NewTextureSetting(max_size=1024, default_format="uastc", new_option=1), "0" * 64, False) != key
+    assert cache.key(texture_setting, "0" * 64, True) != key
+    assert cache.key(texture_setting, "1" * 64, False) != key
@@ -0,0 +1,42 @@
+import pytest
+
+from config import parse_config, validate_config
+
+#----------------------------------------------
+
+def test_validate_config_suggests_misspelled_keys():
+    data = {
+        "output_exts": [".glb"],
+        "texture_settings": [{"max_size": 1024, "defualt_format": "uastc"}],
+        "model_settings": [{"suffix": "_LOD0", "ratoi": 0.5}],
+        "pack_orn": True,
+    }
+    with pytest.raises(ValueError) as error:
+        validate_config(data)
+    message = str(error.value)
+    assert message.startswith("Invalid config:\n")
+    assert 'config: unknown key "pack_orn", did you mean "pack_orm"?' in message
+    assert 'texture_settings[0]: unknown key "defualt_format", did you mean "default_format"?' in message
+    assert 'model_settings[0]: unknown key "ratoi", did you mean "ratio"?' in message
+
+def test_validate_config_reports_types_and_choices():
+    data = {
+        "output_exts": [".fbx"],
+        "texture_settings": [{"max_size": "1024"}],
+        "model_settings": [{"compression": "zip", "ratio": 1, "lock_border": 1}],
+        "xyz": 1,
+    }
+    with pytest.raises(ValueError) as error:
+        validate_config(data)
+    message = str(error.value)
+    assert 'config: "output_exts" is ".fbx", expected one of .glb, .gltf' in message
+    assert 'texture_settings[0]: "max_size" must be a integer, not string' in message
+    assert 'model_settings[0]: "compression" is "zip", expected one of draco, meshopt, none' in message
+    assert 'model_settings[0]: "lock_border" must be a boolean, not integer' in message
+    # An integer is a valid number, a key without close match gets no suggestion
+    assert '"ratio"' not in message
+    assert 'config: unknown key "xyz"' in [line.strip() for line in message.splitlines()]
+
+def test_parse_config_accepts_valid_data():
+    config = parse_config({"output_exts": [".glb"], "texture_settings": [{"max_size": 512}], "model_settings": [{"suffix": "_LOD0"}]})
+    assert config.output_exts == [".glb"]
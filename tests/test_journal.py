@@ -0,0 +1,44 @@
+from journal import Journal
+
+#----------------------------------------------
+
+def write(path, content : bytes):
+    with open(str(path), 'wb') as file:
+        file.write(content)
+
+def test_is_done_checks_the_files_of_the_unit(tmp_path):
+    write(tmp_path / "a.glb", b"a")
+    write(tmp_path / "b.ktx2", b"b")
+    journal = Journal(str(tmp_path))
+    files = journal.done("model:_LOD0:a", [str(tmp_path / "a.glb"), str(tmp_path / "b.ktx2")])
+    assert sorted(files) == ["a.glb", "b.ktx2"]
+    journal.failed("texture:low:c", "toktx failed")
+
+    # A resumed run reads the journal of the workspace
+    resumed = Journal(str(tmp_path))
+    assert resumed.is_done("model:_LOD0:a")
+    assert not resumed.is_done("texture:low:c")
+    assert not resumed.is_done("model:_LOD1:a")
+    assert resumed.resumed == 1
+
+    # A changed or missing file builds the unit again
+    write(tmp_path / "b.ktx2", b"changed")
+    assert not Journal(str(tmp_path)).is_done("model:_LOD0:a")
+    (tmp_path / "b.ktx2").unlink()
+    assert not Journal(str(tmp_path)).is_done("model:_LOD0:a")
+
+def test_last_record_of_a_unit_wins(tmp_path):
+    write(tmp_path / "a.glb", b"a")
+    journal = Journal(str(tmp_path))
+    journal.done("model:_LOD0:a", [str(tmp_path / "a.glb")])
+    journal.failed("model:_LOD0:a", "simplify failed")
+    assert not Journal(str(tmp_path)).is_done("model:_LOD0:a")
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    write(tmp_path / "a.glb", b"a")
+    journal = Journal(str(tmp_path))
+    journal.done("model:_LOD0:a", [str(tmp_path / "a.glb")])
+    with open(journal.path, 'a') as file:
+        file.write('{"unit": "model:_LOD1')
+    assert Journal(str(tmp_path)).is_done("model:_LOD0:a")
+    assert journal.summary() == "journal: 0 units resumed, 1 done, 0 failed"
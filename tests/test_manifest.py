@@ -0,0 +1,39 @@
+import json
+from dataclasses import field, make_dataclass
+
+from config import Config
+from manifest import lod_config_hash, model_source_hash, texture_config_hash
+
+#----------------------------------------------
+
+# Settings of a later version, with one more option left at its default
+NewModelSetting = make_dataclass("ModelSetting", [("new_option", int, field(default=0))], bases=(Config.ModelSetting,))
+NewTextureSetting = make_dataclass("TextureSetting", [("new_option", int, field(default=0))], bases=(Config.TextureSetting,))
+
+def test_config_hashes_ignore_a_new_default_field():
+    config = Config([".glb"])
+    lineage = [Config.ModelSetting(suffix="_LOD0", tolerance=0.0001), Config.ModelSetting(suffix="_LOD1", ratio=0.5)]
+    config_hash = lod_config_hash(config, lineage)
+    new_lineage = [NewModelSetting(suffix="_LOD0", tolerance=0.0001), NewModelSetting(suffix="_LOD1", ratio=0.5)]
+    assert lod_config_hash(config, new_lineage) == config_hash
+    assert lod_config_hash(config, new_lineage[:1] + [NewModelSetting(suffix="_LOD1", ratio=0.5, new_option=1)]) != config_hash
+    assert lod_config_hash(config, lineage[:1]) != config_hash
+
+    texture_setting = Config.TextureSetting(max_size=512)
+    assert texture_config_hash(NewTextureSetting(max_size=512)) == texture_config_hash(texture_setting)
+    assert texture_config_hash(NewTextureSetting(max_size=512, new_option=1)) != texture_config_hash(texture_setting)
+
+def test_source_hash_of_a_gltf_covers_its_resources(tmp_path):
+    gltf_path = str(tmp_path / "a.gltf")
+    with open(gltf_path, 'w') as file:
+        json.dump({"asset": {"version": "2.0"}, "buffers": [{"uri": "a.bin", "byteLength": 4}], "images": [{"uri": "a%20b.png"}]}, file)
+    (tmp_path / "a.bin").write_bytes(b"1234")
+    (tmp_path / "a b.png").write_bytes(b"png")
+
+    source_hash = model_source_hash(gltf_path)
+    (tmp_path / "a b.png").write_bytes(b"changed")
+    assert model_source_hash(gltf_path) != source_hash
+    (tmp_path / "a b.png").write_bytes(b"png")
+    assert model_source_hash(gltf_path) == source_hash
+    (tmp_path / "a.bin").unlink()
+    assert model_source_hash(gltf_path) != source_hash
@@ -0,0 +1,141 @@
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import mesh
+
+from asset_manifest import mesh_counts
+from config import Config
+from gltf_container import GltfFile, align, write_glb
+
+#----------------------------------------------
+# A grid of size x size quads, two unindexed triangles per quad : the inner vertices are repeated
+# by every triangle around them, the weld merges them into (size + 1)² vertices.
+
+def grid_corners(size : int):
+    corners = []
+    for y in range(size):
+        for x in range(size):
+            corners += [(x, y), (x + 1, y), (x + 1, y + 1), (x, y), (x + 1, y + 1), (x, y + 1)]
+    return np.array(corners)
+
+def add_attribute(gltf : dict, bin_chunk : bytearray, values, component_type : int, accessor_type : str, **extra) -> int:
+    element_size = values.dtype.itemsize * values.shape[1]
+    stride = align(element_size)
+    rows = np.zeros((len(values), stride), np.uint8)
+    rows[:, :element_size] = np.ascontiguousarray(values).view(np.uint8).reshape(len(values), element_size)
+    gltf["bufferViews"].append({"buffer": 0, "byteOffset": len(bin_chunk), "byteLength": rows.size, "byteStride": stride, "target": mesh.ARRAY_BUFFER})
+    bin_chunk += rows.tobytes()
+    gltf["accessors"].append(dict({"bufferView": len(gltf["bufferViews"]) - 1, "componentType": component_type, "count": len(values), "type": accessor_type}, **extra))
+    return len(gltf["accessors"]) - 1
+
+# quantized : i16 positions of KHR_mesh_quantization instead of floats, and u8 colors
+def write_grid(path : str, size : int = 3, quantized : bool = False):
+    corners = grid_corners(size)
+    gltf = {"asset": {"version": "2.0"}, "buffers": [{}], "bufferViews": [], "accessors": [], "nodes": [{"mesh": 0}], "scenes": [{"nodes": [0]}], "scene": 0}
+    bin_chunk = bytearray()
+    attributes = {}
+    if quantized:
+        gltf["extensionsUsed"] = gltf["extensionsRequired"] = ["KHR_mesh_quantization"]
+        positions = np.concatenate([corners * 100, np.zeros((len(corners), 1), np.int64)], axis=1).astype("<i2")
+        attributes["POSITION"] = add_attribute(gltf, bin_chunk, positions, 5122, "VEC3", min=positions.min(axis=0).tolist(), max=positions.max(axis=0).tolist())
+        colors = np.concatenate([corners * 40, np.full((len(corners), 1), 7)], axis=1).astype("u1")
+        attributes["COLOR_0"] = add_attribute(gltf, bin_chunk, colors, 5121, "VEC3", normalized=True)
+    else:
+        positions = np.concatenate([corners, np.zeros((len(corners), 1))], axis=1).astype("<f4")
+        attributes["POSITION"] = add_attribute(gltf, bin_chunk, positions, 5126, "VEC3", min=positions.min(axis=0).tolist(), max=positions.max(axis=0).tolist())
+        normals = np.tile(np.array([[0, 0, 1]], "<f4"), (len(corners), 1))
+        attributes["NORMAL"] = add_attribute(gltf, bin_chunk, normals, 5126, "VEC3")
+    gltf["meshes"] = [{"primitives": [{"attributes": attributes}]}]
+    write_glb(path, gltf, bin_chunk)
+
+# A cube of flat faces, two unindexed triangles per face : the corners are shared by three faces with different
+# normals, the weld only merges the two corners repeated inside each face into 24 vertices.
+def write_cube(path : str):
+    corners = []
+    normals = []
+    for axis in range(3):
+        for side in (0, 1):
+            face = [(0, 0), (1, 0), (1, 1), (0, 0), (1, 1), (0, 1)]
+            for u, v in face:
+                corner = [u, v]
+                corner.insert(axis, side)
+                corners.append(corner)
+                normals.append([(side * 2 - 1) if index == axis else 0 for index in range(3)])
+    gltf = {"asset": {"version": "2.0"}, "buffers": [{}], "bufferViews": [], "accessors": [], "nodes": [{"mesh": 0}], "scenes": [{"nodes": [0]}], "scene": 0}
+    bin_chunk = bytearray()
+    positions = np.array(corners, "<f4")
+    attributes = {
+        "POSITION": add_attribute(gltf, bin_chunk, positions, 5126, "VEC3", min=positions.min(axis=0).tolist(), max=positions.max(axis=0).tolist()),
+        "NORMAL": add_attribute(gltf, bin_chunk, np.array(normals, "<f4"), 5126, "VEC3"),
+    }
+    gltf["meshes"] = [{"primitives": [{"attributes": attributes}]}]
+    write_glb(path, gltf, bin_chunk)
+
+# Models of tests/fixtures/weld_counts.json, whose welded counts are the ones of gltf-transform weld
+fixture_models = {
+    "cube": write_cube,
+    "grid": lambda path: write_grid(path, size=5),
+}
+
+def load_weld_counts() -> dict:
+    with open(os.path.join(os.path.dirname(__file__), "fixtures", "weld_counts.json"), 'r') as file:
+        return json.load(file)
+
+def read_counts(path : str):
+    with GltfFile(path) as gltf:
+        return mesh_counts(gltf.json)
+
+#----------------------------------------------
+
+def test_weld_merges_repeated_vertices(tmp_path):
+    write_grid(str(tmp_path / "grid.glb"))
+    mesh.weld_glb(str(tmp_path / "grid.glb"), str(tmp_path / "welded.glb"), 0.0001)
+
+    assert read_counts(str(tmp_path / "grid.glb")) == (18, 54)
+    assert read_counts(str(tmp_path / "welded.glb")) == (18, 16)
+
+def test_weld_aligns_vertex_attributes(tmp_path):
+    write_grid(str(tmp_path / "grid.glb"), quantized=True)
+    mesh.weld_glb(str(tmp_path / "grid.glb"), str(tmp_path / "welded.glb"), 0)
+
+    with GltfFile(str(tmp_path / "welded.glb")) as gltf:
+        primitive = gltf.json["meshes"][0]["primitives"][0]
+        for name, index in primitive["attributes"].items():
+            accessor = gltf.json["accessors"][index]
+            view = gltf.json["bufferViews"][accessor["bufferView"]]
+            # i16 VEC3 (6 bytes) and u8 VEC3 (3 bytes) are padded to 8 and 4 bytes
+            assert view["byteStride"] == {"POSITION": 8, "COLOR_0": 4}[name]
+            assert (view.get("byteOffset", 0) + accessor.get("byteOffset", 0)) % 4 == 0
+            assert accessor["count"] == 16
+
+        positions = mesh.read_accessor(gltf.json, gltf.bin, primitive["attributes"]["POSITION"])
+        colors = mesh.read_accessor(gltf.json, gltf.bin, primitive["attributes"]["COLOR_0"])
+        # Padding does not shift the values : the color of each vertex still follows its position
+        assert (colors[:, :2].astype(int) * 100 == positions[:, :2].astype(int) * 40).all()
+        assert len({tuple(row) for row in positions.tolist()}) == 16
+
+@pytest.mark.parametrize("name", sorted(fixture_models))
+def test_weld_counts_match_the_fixture(tmp_path, name):
+    expected = load_weld_counts()[name]
+    fixture_models[name](str(tmp_path / "source.glb"))
+    mesh.weld_glb(str(tmp_path / "source.glb"), str(tmp_path / "welded.glb"), Config.ModelSetting(tolerance=0.0001).tolerance)
+
+    assert read_counts(str(tmp_path / "source.glb")) == tuple(expected["source"])
+    assert read_counts(str(tmp_path / "welded.glb")) == tuple(expected["welded"])
+
+# The fixture counts checked against the CLI itself, when it is installed
+@pytest.mark.skipif(shutil.which("gltf-transform") is None, reason="gltf-transform is not installed")
+@pytest.mark.parametrize("name", sorted(fixture_models))
+def test_weld_counts_match_gltf_transform(tmp_path, name):
+    fixture_models[name](str(tmp_path / "source.glb"))
+    model_setting = Config.ModelSetting(tolerance=0.0001)
+    mesh.weld_glb(str(tmp_path / "source.glb"), str(tmp_path / "numpy.glb"), model_setting.tolerance)
+    subprocess.run(model_setting.weld(str(tmp_path / "source.glb"), str(tmp_path / "cli.glb")), check=True)
+
+    assert read_counts(str(tmp_path / "numpy.glb")) == read_counts(str(tmp_path / "cli.glb")) == tuple(load_weld_counts()[name]["welded"])
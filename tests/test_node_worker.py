@@ -0,0 +1,73 @@
+import threading
+import time
+
+from node_worker import NodeWorkerError, NodeWorkerPool
+
+#----------------------------------------------
+# Pools whose start_worker is replaced, no node process is started
+
+class FakeWorker:
+    def __init__(self):
+        self.alive = True
+
+    def is_alive(self) -> bool:
+        return self.alive
+
+    def close(self):
+        self.alive = False
+
+def acquire_from_threads(pool : NodeWorkerPool, count : int) -> list:
+    results = [None] * count
+    def acquire(index : int):
+        try:
+            results[index] = pool.acquire()
+        except NodeWorkerError as e:
+            results[index] = e
+    threads = [threading.Thread(target=acquire, args=(index,), daemon=True) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert not any(thread.is_alive() for thread in threads), "acquire is blocked"
+    return results
+
+def test_concurrent_acquires_fail_when_the_worker_cannot_start():
+    pool = NodeWorkerPool(2)
+    def start_worker():
+        # Slow enough for the other threads to wait for a worker
+        time.sleep(0.2)
+        raise OSError("node: not found")
+    pool.start_worker = start_worker
+
+    results = acquire_from_threads(pool, 5)
+    assert all(isinstance(result, NodeWorkerError) for result in results)
+    assert not pool.enabled and pool.started == 0
+    assert pool.call("pipeline", src="a.gltf", dst="a.glb") is False
+
+def test_released_dead_worker_is_replaced():
+    pool = NodeWorkerPool(1)
+    pool.start_worker = FakeWorker
+    worker = pool.acquire()
+
+    waiter = threading.Thread(target=lambda: setattr(waiter, "worker", pool.acquire()), daemon=True)
+    waiter.start()
+    time.sleep(0.1)
+    assert waiter.is_alive()
+
+    # A worker killed by a timeout frees its place for a new one
+    worker.close()
+    pool.release(worker)
+    waiter.join(5)
+    assert not waiter.is_alive()
+    assert waiter.worker is not worker and waiter.worker.is_alive()
+    assert pool.started == 1
+
+def test_released_worker_is_reused():
+    pool = NodeWorkerPool(1)
+    pool.start_worker = FakeWorker
+    worker = pool.acquire()
+    pool.release(worker)
+    assert pool.acquire() is worker
+    pool.release(worker)
+    pool.close()
+    assert not worker.is_alive()
@@ -0,0 +1,32 @@
+from orm import remove_unused, texture_info_refs
+
+#----------------------------------------------
+
+def test_remove_unused_renumbers_textures_and_images():
+    gltf_data = {
+        "images": [{"uri": "a.png"}, {"uri": "b.png"}, {"uri": "c.png"}, {"uri": "d.png"}],
+        "textures": [
+            {"source": 0},
+            {"source": 1},
+            {"source": 2, "sampler": 0},
+            {"extensions": {"KHR_texture_basisu": {"source": 3}}},
+        ],
+        "materials": [
+            {"pbrMetallicRoughness": {"baseColorTexture": {"index": 2}}, "normalTexture": {"index": 3, "scale": 1.0}},
+            {"emissiveTexture": {"index": 2}},
+        ],
+    }
+    refs = texture_info_refs(gltf_data["materials"], [])
+    assert len(refs) == 3
+
+    # Textures 0 and 1, and their images a.png and b.png, are not referenced
+    assert remove_unused(gltf_data, refs) == 2
+    assert gltf_data["images"] == [{"uri": "c.png"}, {"uri": "d.png"}]
+    assert gltf_data["textures"] == [{"source": 0, "sampler": 0}, {"extensions": {"KHR_texture_basisu": {"source": 1}}}]
+    assert gltf_data["materials"][0] == {"pbrMetallicRoughness": {"baseColorTexture": {"index": 0}}, "normalTexture": {"index": 1, "scale": 1.0}}
+    assert gltf_data["materials"][1] == {"emissiveTexture": {"index": 0}}
+
+def test_remove_unused_drops_empty_lists():
+    gltf_data = {"images": [{"uri": "a.png"}], "textures": [{"source": 0}], "materials": [{}]}
+    assert remove_unused(gltf_data, texture_info_refs(gltf_data["materials"], [])) == 1
+    assert "images" not in gltf_data and "textures" not in gltf_data
@@ -0,0 +1,53 @@
+import os
+import time
+
+from work_queue import DONE, FAILED, LEASED, PENDING, WorkQueue
+
+#----------------------------------------------
+
+def create_queue(path, max_attempts : int = 3) -> WorkQueue:
+    queue = WorkQueue(str(path))
+    queue.create({"lease_seconds": 60, "max_attempts": max_attempts}, [{"id": "a", "kind": "model"}])
+    return queue
+
+def expire(queue : WorkQueue, unit_id : str):
+    old = time.time() - 3600
+    os.utime(queue.state_path(LEASED, unit_id), (old, old))
+
+def test_fail_requeues_then_gives_up(tmp_path):
+    queue = create_queue(tmp_path, max_attempts=2)
+    queue.fail(queue.claim(), "toktx failed")
+    assert queue.counts()[PENDING] == 1
+    assert queue.units(PENDING)[0]["error"] == "toktx failed"
+
+    queue.fail(queue.claim(), "toktx failed")
+    assert queue.counts() == {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 1}
+
+def test_fail_after_the_lease_was_taken_over(tmp_path):
+    queue = create_queue(tmp_path)
+    unit = queue.claim()
+    expire(queue, "a")
+    # Another worker requeues the expired lease and claims the unit again
+    other = queue.claim()
+    assert other["attempts"] == 2
+
+    queue.fail(unit, "late failure")
+    assert queue.counts()[LEASED] == 1
+    assert "error" not in queue.units(LEASED)[0]
+
+    # Once completed by the other worker, a late failure does not bring the unit back
+    work_path = str(tmp_path / "work")
+    os.makedirs(work_path)
+    assert queue.complete(other, work_path)
+    queue.fail(unit, "late failure")
+    assert queue.counts() == {PENDING: 0, LEASED: 0, DONE: 1, FAILED: 0}
+
+def test_fail_after_the_lease_was_requeued(tmp_path):
+    queue = create_queue(tmp_path)
+    unit = queue.claim()
+    expire(queue, "a")
+    assert queue.requeue_expired() == 1
+
+    queue.fail(unit, "late failure")
+    assert queue.counts() == {PENDING: 1, LEASED: 0, DONE: 0, FAILED: 0}
+    assert "error" not in queue.units(PENDING)[0]
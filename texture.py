@@ -0,0 +1,83 @@
+import os
+import struct
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+#----------------------------------------------
+# In-process resize of one source image into every texture tier.
+# The source is decoded once and each tier is downsampled from the next larger one,
+# so the imagemagick 'cp' + 'mogrify' x2 round trip per tier is not needed.
+# Requires Pillow, otherwise the caller falls back to the imagemagick commands.
+
+def is_available() -> bool:
+    return Image is not None
+
+# (width, height) read from the header of an image, None when unknown. Without Pillow only png is read.
+def image_size(file_path : str) -> Optional[Tuple[int, int]]:
+    if Image is not None:
+        try:
+            with Image.open(file_path) as image:
+                return image.size
+        except OSError:
+            return None
+
+    try:
+        with open(file_path, 'rb') as file:
+            header = file.read(24)
+    except OSError:
+        return None
+    if header[:8] == b'\x89PNG\r\n\x1a\n' and header[12:16] == b'IHDR':
+        return struct.unpack(">II", header[16:24])
+    return None
+
+# Tiers with the same key produce the same ktx2 : same target size and encode parameters.
+# size is the (width, height) of the source, unknown sizes give every tier its own key.
+def tier_key(texture_setting : Config.TextureSetting, index : int, size : Optional[Tuple[int, int]], other_format : bool) -> tuple:
+    if not size:
+        return (index,)
+    return (texture_setting.target_size(*size), texture_setting.encode_params(other_format))
+
+def resample_filter():
+    return getattr(Image, "Resampling", Image).LANCZOS
+
+def open_image(file_path : str):
+    image = Image.open(file_path)
+    image.load()
+
+    # Palette and exotic modes are expanded so that resampling is not done with nearest neighbor
+    if image.mode == "P":
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    elif image.mode not in ("L", "LA", "RGB", "RGBA", "I;16"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    return image
+
+# Write the png of file_path for the tiers in 'targets' ({tier index : png path}).
+def build_pyramid(texture_settings : List[Config.TextureSetting], file_path : str, targets : Dict[int, str]):
+    if not targets:
+        return
+
+    image = open_image(file_path)
+    width, height = image.size
+
+    # Largest tier first, so each tier can be derived from the previous one
+    sizes = [(texture_setting.target_size(width, height), index) for index, texture_setting in enumerate(texture_settings)]
+    sizes.sort(key=lambda item: (item[0][0] * item[0][1], item[1]), reverse=True)
+
+    smallest_needed = min(size[0] * size[1] for size, index in sizes if index in targets)
+    for size, index in sizes:
+        if size[0] * size[1] < smallest_needed:
+            break
+
+        if image.size != size:
+            image = image.resize(size, resample_filter())
+
+        if index in targets:
+            # Intermediate file only read by toktx, favour speed over size
+            image.save(targets[index], format="PNG", compress_level=1)
@@ -0,0 +1,91 @@
+import os
+import threading
+from typing import Dict, List, Tuple
+
+#----------------------------------------------
+# Unique images of a build.
+# The images extracted from every model are keyed by their content hash (and how the texture settings
+# encode them), so an image shared by many models under different file names is resized and encoded
+# once per tier, and two different images with the same file name never overwrite each other.
+# Every unique image gets the file name "<name>_<hash8>", used by the ktx2 files and the model uris.
+
+class TextureEntry:
+    def __init__(self, name : str, path : str, image_hash : str, size : int):
+        self.name = name
+        self.path = path
+        self.image_hash = image_hash
+        self.size = size
+        # Image files of the models that resolved to this entry
+        self.references = 1
+        # Tier encodes replaced by a link to the ktx2 of a tier with the same size and encode parameters
+        self.collapsed = 0
+        # Settings of every tier for this image, after the content analysis (see analysis.py)
+        self.texture_settings = None
+        # {tier index : (GPU bytes saved, shrunk, downgraded to etc1s)} of the tiers the analysis changed
+        self.savings : Dict[int, Tuple[int, bool, bool]] = {}
+
+def texture_file_name(file_path : str, image_hash : str) -> str:
+    stem, ext = os.path.splitext(os.path.basename(file_path))
+    return "{}_{}{}".format(stem, image_hash[:8], ext)
+
+class TextureRegistry:
+    def __init__(self):
+        self.entries : Dict[tuple, TextureEntry] = {}
+        self.lock = threading.Lock()
+
+    # Returns (entry, True) for the first image of a key, (existing entry, False) for its duplicates
+    def add(self, key : tuple, name : str, path : str, image_hash : str, size : int) -> Tuple[TextureEntry, bool]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                entry.references += 1
+                return entry, False
+            entry = TextureEntry(name, path, image_hash, size)
+            self.entries[key] = entry
+            return entry, True
+
+    # encode_seconds and output_bytes : {unique image stem : value}
+    def summary(self, encode_seconds : Dict[str, float], output_bytes : Dict[str, int]) -> str:
+        with self.lock:
+            entries = list(self.entries.values())
+
+        references = sum(entry.references for entry in entries)
+        source_bytes = 0
+        saved_bytes = 0
+        saved_seconds = 0.0
+        for entry in entries:
+            duplicates = entry.references - 1
+            stem = os.path.splitext(entry.name)[0]
+            source_bytes += duplicates * entry.size
+            saved_bytes += duplicates * output_bytes.get(stem, 0)
+            saved_seconds += duplicates * encode_seconds.get(stem, 0)
+
+        return "texture dedup: {} images, {} unique, {:.2f} MB of duplicate sources, {:.2f} MB of ktx2 and {:.2f}s of encode saved".format(
+            references, len(entries), source_bytes / 1048576, saved_bytes / 1048576, saved_seconds)
+
+    # toktx_seconds : {unique image stem : (seconds, count) of its toktx calls}
+    def tier_summary(self, toktx_seconds : Dict[str, Tuple[float, int]]) -> str:
+        with self.lock:
+            entries = list(self.entries.values())
+
+        collapsed = 0
+        saved_seconds = 0.0
+        for entry in entries:
+            seconds, count = toktx_seconds.get(os.path.splitext(entry.name)[0], (0, 0))
+            collapsed += entry.collapsed
+            saved_seconds += entry.collapsed * seconds / max(1, count)
+
+        return "texture tiers: {} encodes collapsed into links to a tier of the same size and encode parameters, about {:.2f}s of encode saved".format(collapsed, saved_seconds)
+
+    # tier_names : name of every tier folder
+    def analysis_summary(self, tier_names : List[str]) -> str:
+        with self.lock:
+            entries = list(self.entries.values())
+
+        tiers = []
+        for index, tier_name in enumerate(tier_names):
+            savings = [entry.savings[index] for entry in entries if index in entry.savings]
+            tiers.append("{}: {} images shrunk, {} downgraded to etc1s, {:.2f} MB of GPU memory saved".format(
+                tier_name, sum(shrunk for saved, shrunk, downgraded in savings), sum(downgraded for saved, shrunk, downgraded in savings),
+                sum(saved for saved, shrunk, downgraded in savings) / 1048576))
+        return "texture analysis: " + ", ".join(tiers)
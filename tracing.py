@@ -0,0 +1,177 @@
+import asyncio
+import json
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List
+
+#----------------------------------------------
+# Per-stage, per-asset tracing.
+# Every external tool call and internal stage is recorded as a span with its wall time, exit code,
+# input / output bytes and the worker thread that ran it. The spans are written with --trace
+# in the Chrome Trace Event format (chrome://tracing, https://ui.perfetto.dev) and summed
+# per stage at the end of a build.
+# Tools are run from their argument vector without a shell, and killed when they run longer than the timeout.
+# ref : https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+
+# A tool exited with a non-zero code, timed out or was not found : the task running it fails
+class ToolError(Exception):
+    pass
+
+def get_size(paths : Iterable[str]) -> int:
+    size = 0
+    for path in paths:
+        try:
+            size += os.path.getsize(path)
+        except OSError:
+            pass
+    return size
+
+class Tracer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Seconds a tool call may run before it is killed, None waits forever
+        self.timeout = None
+        self.reset()
+
+    # Spans are kept per build, watch mode starts a new trace for every build
+    def reset(self):
+        with self.lock:
+            self.spans : List[dict] = []
+            self.thread_ids : Dict[str, int] = {}
+            self.start_time = time.perf_counter()
+
+    def thread_id(self, name : str) -> int:
+        if name not in self.thread_ids:
+            self.thread_ids[name] = len(self.thread_ids) + 1
+        return self.thread_ids[name]
+
+    # Record the block as a span of `stage` for `asset`, a short name such as the file name.
+    # The yielded dict may receive more values, e.g. "exit_code" of the tool or "outputs" known only at the end.
+    # worker defaults to the name of the current thread.
+    @contextmanager
+    def span(self, stage : str, asset : str, inputs : Iterable[str] = (), outputs : Iterable[str] = (), worker : str = None):
+        record = {"exit_code": 0, "outputs": list(outputs)}
+        input_bytes = get_size(inputs)
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            # A block that failed with its own exit code (e.g. "timeout") keeps it
+            if record["exit_code"] == 0:
+                record["exit_code"] = "exception"
+            raise
+        finally:
+            end = time.perf_counter()
+            span = {
+                "stage": stage,
+                "asset": asset,
+                "start": start,
+                "duration": end - start,
+                "exit_code": record["exit_code"],
+                "input_bytes": input_bytes,
+                "output_bytes": get_size(record["outputs"]),
+                "worker": worker or threading.current_thread().name,
+            }
+            with self.lock:
+                self.spans.append(span)
+
+    # Run the argument vector of a tool inside a span.
+    # Raises ToolError unless it exits with 0, the exit code is "timeout" when it was killed after timeout seconds
+    # (self.timeout by default) and "not found" when the tool is missing.
+    def run(self, stage : str, asset : str, command : List[str], inputs : Iterable[str] = (), outputs : Iterable[str] = (), timeout : float = None):
+        timeout = self.timeout if timeout is None else timeout
+        with self.span(stage, asset, inputs, outputs) as record:
+            try:
+                record["exit_code"] = subprocess.run(command, timeout=timeout).returncode
+            except subprocess.TimeoutExpired:
+                record["exit_code"] = "timeout"
+            except FileNotFoundError:
+                record["exit_code"] = "not found"
+        if record["exit_code"] != 0:
+            raise ToolError("{} failed with exit code {}: {}".format(stage, record["exit_code"], asset))
+
+    # Same as run for asyncio, the span is recorded on the current task. A cancelled call kills the tool.
+    async def run_async(self, stage : str, asset : str, command : List[str], inputs : Iterable[str] = (), outputs : Iterable[str] = (), timeout : float = None):
+        timeout = self.timeout if timeout is None else timeout
+        task = asyncio.current_task()
+        with self.span(stage, asset, inputs, outputs, task.get_name() if task else None) as record:
+            # The start is shielded, a call cancelled while the tool starts still gets the process to kill
+            start = asyncio.ensure_future(asyncio.create_subprocess_exec(*command))
+            process = None
+            try:
+                process = await asyncio.shield(start)
+                record["exit_code"] = await asyncio.wait_for(process.wait(), timeout)
+            except FileNotFoundError:
+                record["exit_code"] = "not found"
+            except asyncio.TimeoutError:
+                record["exit_code"] = "timeout"
+            finally:
+                if process is None and not start.done():
+                    try:
+                        process = await start
+                    except OSError:
+                        pass
+                if process is not None and process.returncode is None:
+                    process.kill()
+                    await process.wait()
+        if record["exit_code"] != 0:
+            raise ToolError("{} failed with exit code {}: {}".format(stage, record["exit_code"], asset))
+
+    #----------------------------------------------
+    # Chrome Trace Event format, complete events ("ph": "X") in microseconds
+
+    def write(self, path : str):
+        pid = os.getpid()
+        with self.lock:
+            spans = list(self.spans)
+            events = []
+            for span in spans:
+                events.append({
+                    "name": span["stage"],
+                    "cat": span["stage"].split(":")[0],
+                    "ph": "X",
+                    "ts": round((span["start"] - self.start_time) * 1e6),
+                    "dur": round(span["duration"] * 1e6),
+                    "pid": pid,
+                    "tid": self.thread_id(span["worker"]),
+                    "args": {key: span[key] for key in ("asset", "exit_code", "input_bytes", "output_bytes", "worker")},
+                })
+            for name, tid in self.thread_ids.items():
+                events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+
+        temp_path = "{}.{}.tmp".format(path, pid)
+        with open(temp_path, 'w') as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+        os.replace(temp_path, path)
+
+    #----------------------------------------------
+    # Per-stage table, slowest stage first
+
+    def summary(self) -> str:
+        with self.lock:
+            spans = list(self.spans)
+
+        stages = {}
+        for span in spans:
+            stage = stages.setdefault(span["stage"], {"count": 0, "total": 0.0, "max": 0.0, "max_asset": "", "failed": 0, "input_bytes": 0, "output_bytes": 0})
+            stage["count"] += 1
+            stage["total"] += span["duration"]
+            if span["duration"] >= stage["max"]:
+                stage["max"] = span["duration"]
+                stage["max_asset"] = span["asset"]
+            stage["failed"] += span["exit_code"] != 0
+            stage["input_bytes"] += span["input_bytes"]
+            stage["output_bytes"] += span["output_bytes"]
+
+        row = "{:<24} {:>6} {:>10} {:>9} {:>9} {:>6} {:>10} {:>10}  {}"
+        lines = [row.format("stage", "count", "total(s)", "mean(s)", "max(s)", "failed", "in(MB)", "out(MB)", "slowest asset")]
+        for name, stage in sorted(stages.items(), key=lambda item: item[1]["total"], reverse=True):
+            lines.append(row.format(name, stage["count"], "{:.2f}".format(stage["total"]), "{:.3f}".format(stage["total"] / stage["count"]),
+                                    "{:.3f}".format(stage["max"]), stage["failed"],
+                                    "{:.2f}".format(stage["input_bytes"] / 1048576), "{:.2f}".format(stage["output_bytes"] / 1048576), stage["max_asset"]))
+        return "\n".join(lines)
+
+tracer = Tracer()
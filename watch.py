@@ -0,0 +1,196 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from typing import Dict, List, Set, Tuple
+
+#----------------------------------------------
+# File system watcher for --watch.
+# Linux uses inotify through libc, other platforms (and file systems without inotify support)
+# poll a snapshot of the watched trees. Events are debounced : wait() returns once no file
+# changed for `debounce` seconds, so that a model and its textures copied together are built once.
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+INOTIFY_EVENT = struct.Struct("iIII")
+
+# Temporary files of editors and of this tool
+def is_ignored_name(name : str) -> bool:
+    return name.startswith(".") or name.endswith(("~", ".tmp", ".swp"))
+
+class Watcher:
+    # roots : [(directory, recursive)]
+    def __init__(self, roots : List[Tuple[str, bool]], ignore_paths : List[str] = (), debounce : float = 1.0, poll_interval : float = 1.0):
+        self.roots = [(os.path.abspath(path), recursive) for path, recursive in roots]
+        self.ignore_paths = [os.path.abspath(path) for path in ignore_paths]
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        # A file that keeps changing does not delay the build forever
+        self.max_delay = debounce * 10
+
+        self.fd = -1
+        self.watches : Dict[int, Tuple[str, bool]] = {}
+        self.snapshot = {}
+        self.libc = None
+        try:
+            self.start_inotify()
+            self.backend = "inotify"
+        except OSError:
+            self.close()
+            self.snapshot = self.take_snapshot()
+            self.backend = "polling"
+
+    def is_ignored(self, path : str) -> bool:
+        if is_ignored_name(os.path.basename(path)):
+            return True
+        return any(path == ignore_path or path.startswith(ignore_path + os.sep) for ignore_path in self.ignore_paths)
+
+    def walk_files(self, directory : str, recursive : bool) -> List[str]:
+        file_paths = []
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [name for name in dirs if not self.is_ignored(os.path.join(root, name))] if recursive else []
+            file_paths += [os.path.join(root, name) for name in files if not self.is_ignored(os.path.join(root, name))]
+        return file_paths
+
+    #----------------------------------------------
+    # inotify
+
+    def start_inotify(self):
+        library = ctypes.util.find_library("c")
+        if not library:
+            raise OSError("libc not found")
+        self.libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        for path, recursive in self.roots:
+            self.add_watch(path, recursive)
+
+    def add_watch(self, directory : str, recursive : bool):
+        directories = [directory]
+        if recursive:
+            for root, dirs, files in os.walk(directory):
+                dirs[:] = [name for name in dirs if not self.is_ignored(os.path.join(root, name))]
+                directories += [os.path.join(root, name) for name in dirs]
+
+        for path in directories:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed: {}".format(path))
+            # The same directory may be given twice, e.g. the config folder inside the input folder
+            recursive_before = self.watches.get(wd, (path, False))[1]
+            self.watches[wd] = (path, recursive or recursive_before)
+
+    def read_inotify(self, timeout : float, changed_paths : Set[str]) -> bool:
+        readable, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if not readable:
+            return False
+
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+
+            # Too many events, every watched file is reported
+            if mask & IN_Q_OVERFLOW:
+                for path, recursive in self.roots:
+                    changed_paths.update(self.walk_files(path, recursive))
+                continue
+
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches or not name:
+                continue
+
+            directory, recursive = self.watches[wd]
+            path = os.path.join(directory, name)
+            if self.is_ignored(path):
+                continue
+
+            if mask & IN_ISDIR:
+                if not recursive:
+                    continue
+                # Files may be written before the watch of a new folder is added, report all of them
+                if mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(path):
+                    try:
+                        self.add_watch(path, True)
+                    except OSError as e:
+                        print("Cannot watch {}: {}".format(path, e))
+                    changed_paths.update(self.walk_files(path, True))
+                    continue
+
+            changed_paths.add(path)
+        return True
+
+    #----------------------------------------------
+    # Polling
+
+    def take_snapshot(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        for root, recursive in self.roots:
+            for path in self.walk_files(root, recursive):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def read_polling(self, timeout : float, changed_paths : Set[str]) -> bool:
+        time.sleep(max(min(timeout, self.poll_interval), 0))
+        snapshot = self.take_snapshot()
+        changes = set(path for path in snapshot.keys() | self.snapshot.keys() if snapshot.get(path) != self.snapshot.get(path))
+        self.snapshot = snapshot
+        changed_paths.update(changes)
+        return bool(changes)
+
+    #----------------------------------------------
+
+    def read(self, timeout : float, changed_paths : Set[str]) -> bool:
+        if self.backend == "inotify":
+            return self.read_inotify(timeout, changed_paths)
+        return self.read_polling(timeout, changed_paths)
+
+    # Block until files changed and no further change happened for `debounce` seconds.
+    # Returns the absolute paths of the changed, added and removed files.
+    def wait(self) -> Set[str]:
+        changed_paths = set()
+        while not changed_paths:
+            self.read(self.poll_interval, changed_paths)
+
+        first_time = time.time()
+        last_time = first_time
+        while True:
+            now = time.time()
+            timeout = min(last_time + self.debounce, first_time + self.max_delay) - now
+            if timeout <= 0:
+                return changed_paths
+            if self.read(timeout, changed_paths):
+                last_time = time.time()
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        self.watches = {}
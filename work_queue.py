@@ -0,0 +1,195 @@
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+from typing import List, Optional
+
+#----------------------------------------------
+# Work queue on a shared directory, for builds split across processes and machines.
+# The coordinator writes one file per work unit in pending/. A worker claims a unit by renaming it
+# into leased/ (atomic, only one worker wins) and keeps the lease alive by touching the file while
+# it builds. A lease not renewed for lease_seconds belongs to a crashed worker : the unit is renamed
+# back into pending/ by whichever process notices it first, and failed/ after max_attempts.
+# The outputs of a unit are written in results/<unit id>, renamed into place once complete.
+#
+# <queue>/queue.json           input, output, config and options of the build
+# <queue>/pending/<id>.json    {"id": ..., "kind": "model" | "texture", "model": ..., "setting": ..., "attempts": 0}
+# <queue>/leased/<id>.json
+# <queue>/done/<id>.json
+# <queue>/failed/<id>.json
+# <queue>/results/<id>/
+
+QUEUE_FILE_NAME = "queue.json"
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+RESULTS = "results"
+
+def worker_name() -> str:
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+def write_json(path : str, data):
+    temp_path = "{}.{}.tmp".format(path, worker_name().replace(":", "_"))
+    with open(temp_path, 'w') as file:
+        json.dump(data, file, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+def read_json(path : str):
+    with open(path, 'r') as file:
+        return json.load(file)
+
+class WorkQueue:
+    def __init__(self, path : str):
+        self.path = path
+        self.info = {}
+        if os.path.exists(self.queue_file()):
+            self.info = read_json(self.queue_file())
+
+    def queue_file(self) -> str:
+        return os.path.join(self.path, QUEUE_FILE_NAME)
+
+    def state_path(self, state : str, unit_id : str = None) -> str:
+        if unit_id is None:
+            return os.path.join(self.path, state)
+        return os.path.join(self.path, state, "{}.json".format(unit_id))
+
+    def result_path(self, unit_id : str) -> str:
+        return os.path.join(self.path, RESULTS, unit_id)
+
+    @property
+    def lease_seconds(self) -> float:
+        return self.info.get("lease_seconds", 300)
+
+    @property
+    def max_attempts(self) -> int:
+        return self.info.get("max_attempts", 3)
+
+    #----------------------------------------------
+    # Coordinator
+
+    def create(self, info : dict, units : List[dict]):
+        if os.path.exists(self.queue_file()):
+            raise ValueError("{} already holds a queue".format(self.path))
+        for state in (PENDING, LEASED, DONE, FAILED, RESULTS):
+            os.makedirs(self.state_path(state), exist_ok=True)
+
+        for unit in units:
+            unit.setdefault("attempts", 0)
+            write_json(self.state_path(PENDING, unit["id"]), unit)
+        # Written last, workers only start once every unit is queued
+        self.info = info
+        write_json(self.queue_file(), info)
+
+    def unit_ids(self, state : str) -> List[str]:
+        try:
+            return sorted(os.path.splitext(name)[0] for name in os.listdir(self.state_path(state)) if name.endswith(".json"))
+        except FileNotFoundError:
+            return []
+
+    def counts(self) -> dict:
+        return {state: len(self.unit_ids(state)) for state in (PENDING, LEASED, DONE, FAILED)}
+
+    #----------------------------------------------
+    # Worker
+
+    # Returns the unit claimed by this worker, or None when no unit is pending
+    def claim(self) -> Optional[dict]:
+        self.requeue_expired()
+        for unit_id in self.unit_ids(PENDING):
+            pending_path = self.state_path(PENDING, unit_id)
+            leased_path = self.state_path(LEASED, unit_id)
+            try:
+                # The lease starts now, not when the unit was queued
+                os.utime(pending_path)
+                os.rename(pending_path, leased_path)
+            except FileNotFoundError:
+                # Claimed by another worker
+                continue
+            unit = read_json(leased_path)
+            unit["worker"] = worker_name()
+            unit["attempts"] += 1
+            write_json(leased_path, unit)
+            return unit
+        return None
+
+    # Keep the lease of unit_id while it is built, returns the event that stops the renewal
+    def keep_lease(self, unit_id : str) -> threading.Event:
+        stop = threading.Event()
+        def renew():
+            while not stop.wait(self.lease_seconds / 3):
+                try:
+                    os.utime(self.state_path(LEASED, unit_id))
+                except FileNotFoundError:
+                    return
+        threading.Thread(target=renew, name="lease", daemon=True).start()
+        return stop
+
+    # Move the outputs written in work_path to the results of the unit, returns False when the lease was lost
+    def complete(self, unit : dict, work_path : str) -> bool:
+        result_path = self.result_path(unit["id"])
+        try:
+            os.rename(work_path, result_path)
+        except OSError:
+            # A worker which took over the expired lease already completed it, same outputs
+            shutil.rmtree(work_path, ignore_errors=True)
+        try:
+            os.rename(self.state_path(LEASED, unit["id"]), self.state_path(DONE, unit["id"]))
+            return True
+        except FileNotFoundError:
+            return os.path.exists(self.state_path(DONE, unit["id"]))
+
+    # True when the leased file of the unit is still the one claimed by this worker for this attempt
+    def holds_lease(self, unit : dict, path : str) -> bool:
+        try:
+            leased = read_json(path)
+        except (OSError, ValueError):
+            return False
+        return leased.get("worker") == unit.get("worker") and leased.get("attempts") == unit["attempts"]
+
+    # Requeue a unit that failed, or give it up after max_attempts. Nothing is written when the lease expired
+    # and the unit was requeued, taken over or completed by another worker meanwhile.
+    def fail(self, unit : dict, reason : str):
+        leased_path = self.state_path(LEASED, unit["id"])
+        if not self.holds_lease(unit, leased_path):
+            return
+        # Renamed out of leased/ first, like complete() : only one process moves the unit on
+        failing_path = "{}.{}.failing".format(leased_path, worker_name().replace(":", "_"))
+        try:
+            os.rename(leased_path, failing_path)
+        except FileNotFoundError:
+            return
+        if not self.holds_lease(unit, failing_path):
+            # Claimed again between the check and the rename
+            os.rename(failing_path, leased_path)
+            return
+        unit["error"] = reason
+        state = FAILED if unit["attempts"] >= self.max_attempts else PENDING
+        write_json(failing_path, unit)
+        os.rename(failing_path, self.state_path(state, unit["id"]))
+
+    # Units whose worker stopped renewing the lease go back to pending
+    def requeue_expired(self) -> int:
+        count = 0
+        now = time.time()
+        for unit_id in self.unit_ids(LEASED):
+            leased_path = self.state_path(LEASED, unit_id)
+            try:
+                if now - os.path.getmtime(leased_path) < self.lease_seconds:
+                    continue
+                unit = read_json(leased_path)
+            except (OSError, ValueError):
+                continue
+            state = FAILED if unit.get("attempts", 0) >= self.max_attempts else PENDING
+            try:
+                os.rename(leased_path, self.state_path(state, unit_id))
+            except FileNotFoundError:
+                continue
+            print("lease of {} by {} expired, {}".format(unit_id, unit.get("worker"), "requeued" if state == PENDING else "failed"))
+            count += 1
+        return count
+
+    def units(self, state : str) -> List[dict]:
+        return [read_json(self.state_path(state, unit_id)) for unit_id in self.unit_ids(state)]